@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+import csv
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from query import BITS, ANY_PROTO, addr_ranges, port_ranges, prefixes
+
+
+######################## Variables to change dependant on environment ########################
+# Header names of the findings file
+findings_header = ['Policy/ACL Name', 'Line Number', 'Access', 'Finding', 'Earlier Rules', 'Hit Count']
+
+
+################################## Shadowed, redundant and correlated rules ##################################
+# Compares every row of the expanded ACL with the earlier rows of the same ACL (or Checkpoint policy/layer) to find the rules that are:
+#  shadowed   - every row is covered by earlier rules (so can never be hit) and at least one of those has a different action
+#  redundant  - every row is covered by earlier rules with the same action (can be removed without changing what is allowed)
+#  correlated - a row overlaps an earlier rule with a different action without either covering the other (swapping them changes the policy)
+# Rather than comparing every pair of rows, the source and destination addresses of each ACL are indexed (a table per prefix length like
+# query.Index and the sorted start addresses). The only earlier rows looked at are those holding the first address of the row (could cover
+# or overlap it) or starting within it (overlap it), using whichever of the source or destination finds the fewest rows.
+# Rows that can't be compared (object names or inactive) are skipped, so a rule with any of these is never reported as shadowed or redundant
+
+# ROW: The parts of an ACE that are compared, (num, action, protocol, src, dst, src_port, dst_port, src_port_ranges, dst_port_ranges)
+def compare_row(ace):
+    return (ace[1], ace[2], ace[3], addr_ranges(ace[4]), addr_ranges(ace[6]), ace[5], ace[7], port_ranges(ace[5]), port_ranges(ace[7]))
+
+def addr_covers(ranges, other):
+    # Most addresses are a single range so are compared directly
+    if len(ranges) == 1 and len(other) == 1:
+        return ranges[0][0] == other[0][0] and ranges[0][1] <= other[0][1] and other[0][2] <= ranges[0][2]
+    return all(any(ver == each_ver and first <= start and end <= last for ver, first, last in ranges) for each_ver, start, end in other)
+
+def addr_overlaps(ranges, other):
+    return any(ver == each_ver and first <= end and start <= last for ver, first, last in ranges for each_ver, start, end in other)
+
+# PORTS: Ports are compared as ranges (any_port is all of them), anything that is not a port (ICMP types or application names) must be the same
+def port_covers(port, ranges, other_port, other):
+    if port == other_port or ranges == ((0, 65535),):
+        return True
+    return len(ranges) != 0 and len(other) != 0 and all(any(first <= start and end <= last for first, last in ranges) for start, end in other)
+
+def port_overlaps(port, ranges, other_port, other):
+    if port == other_port or ranges == ((0, 65535),) or other == ((0, 65535),):
+        return True
+    return any(first <= end and start <= last for first, last in ranges for start, end in other)
+
+def proto_covers(proto, other):
+    return proto in ANY_PROTO or proto == other or (proto == 'tcp-udp' and other in ['tcp', 'udp'])
+
+# COVERS: Every packet matching row other also matches row
+def covers(row, other):
+    return (proto_covers(row[2], other[2]) and addr_covers(row[3], other[3]) and addr_covers(row[4], other[4]) and
+            port_covers(row[5], row[7], other[5], other[7]) and port_covers(row[6], row[8], other[6], other[8]))
+
+# OVERLAPS: Some packets match both rows
+def overlaps(row, other):
+    return ((proto_covers(row[2], other[2]) or proto_covers(other[2], row[2])) and addr_overlaps(row[3], other[3]) and
+            addr_overlaps(row[4], other[4]) and port_overlaps(row[5], row[7], other[5], other[7]) and port_overlaps(row[6], row[8], other[6], other[8]))
+
+# ADDR_INDEX: For the source (col 3) or destination (col 4) of the rows returns the prefix tables {version: {length: {network: [row positions]}}}
+# and the sorted (start address, row position) of each version
+def addr_index(rows, col):
+    tables, starts = {4: {}, 6: {}}, {4: [], 6: []}
+    for pos, row in enumerate(rows):
+        if row == None:
+            continue
+        for ver, first, last in row[col]:
+            for length, network in prefixes(ver, first, last):
+                tables[ver].setdefault(length, {}).setdefault(network, []).append(pos)
+            starts[ver].append((first, pos))
+    for ver in starts:
+        starts[ver].sort()
+    return tables, starts
+
+# CANDIDATES: Lists of row positions (each in row order) of the prefixes holding the first range (could cover it) or if overlap=True the
+# prefixes holding the first address of each range and those that start within it (overlap it)
+def candidates(index, ranges, overlap):
+    tables, starts = index
+    found = []
+    for ver, first, last in (ranges if overlap == True else ranges[:1]):
+        max_length = BITS[ver] if overlap == True else prefixes(ver, first, last)[0][0]
+        for length, networks in tables[ver].items():
+            row_ids = networks.get(first >> (BITS[ver] - length)) if length <= max_length else None
+            if row_ids != None:
+                found.append(row_ids)
+        if overlap == True:
+            found.append(sorted(pos for start, pos in starts[ver][bisect_left(starts[ver], (first + 1, -1)):bisect_right(starts[ver], (last, float('inf')))]))
+    return found
+
+# EARLIER: Yields the rows before the rule of the row at pos (rule_pos is its first row) found by the source or destination, whichever finds the fewest
+def earlier(src_index, dst_index, rows, pos, rule_pos, overlap):
+    found = min(candidates(src_index, rows[pos][3], overlap), candidates(dst_index, rows[pos][4], overlap),
+                key=lambda found: sum(len(each_ids) for each_ids in found))
+    last_pos = None
+    for each_pos in merge(*found):
+        if each_pos >= rule_pos:
+            return
+        if each_pos != last_pos:
+            last_pos = each_pos
+            yield rows[each_pos]
+
+# ACL_FINDINGS: Finds the shadowed, redundant and correlated rules of the rows of one ACL, returned as [name, num, action, finding, earlier rules, hitcnt]
+def acl_findings(aces):
+    # Rows that can't be compared are None, rules are {num: [action, hitcnt, rows, rows covered, {earlier num: action}, {correlated num: action},
+    # comparable, first row position]}. The rows of a rule are together (each rule is expanded in turn)
+    rows, rules = [], {}
+    for ace in aces:
+        rule = rules.setdefault(ace[1], [ace[2], ace[8], 0, 0, {}, {}, True, len(rows)])
+        row = compare_row(ace)
+        rule[2] += 1
+        if ace[11].lower() == 'inactive' or len(row[3]) == 0 or len(row[4]) == 0:
+            rule[6] = False
+            row = None
+        rows.append(row)
+    src_index, dst_index = addr_index(rows, 3), addr_index(rows, 4)
+
+    for pos, row in enumerate(rows):
+        if row == None:
+            continue
+        rule = rules[row[0]]
+        # COVERED: The first earlier row (of another rule) that covers the row is the one its packets would match
+        for other in earlier(src_index, dst_index, rows, pos, rule[7], False):
+            if covers(other, row):
+                rule[3] += 1
+                rule[4][other[0]] = other[1]
+                break
+        # CORRELATED: If not covered, the first earlier row with a different action that overlaps it without either covering the other
+        else:
+            for other in earlier(src_index, dst_index, rows, pos, rule[7], True):
+                if other[1] != row[1] and overlaps(other, row) and not covers(row, other):
+                    rule[5][other[0]] = other[1]
+                    break
+
+    findings = []
+    name = aces[0][0]
+    for num, (action, hitcnt, num_rows, covered, earlier_rules, correlated, comparable, rule_pos) in rules.items():
+        if comparable == True and covered == num_rows:
+            finding = 'shadowed' if any(other_action != action for other_action in earlier_rules.values()) else 'redundant'
+        elif len(correlated) != 0:
+            finding, earlier_rules = 'correlated', correlated
+        else:
+            continue
+        findings.append([name, num, action, finding, ', '.join('{} ({})'.format(*each_rule) for each_rule in earlier_rules.items()), hitcnt])
+    return findings
+
+# FINDINGS: Findings of all the ACLs in the expanded ACL rows of a device, each ACL is compared separately
+def findings(dvc_acl):
+    acls = {}
+    for ace in dvc_acl:
+        acls.setdefault(ace[0], []).append(ace)
+    return [finding for aces in acls.values() for finding in acl_findings(aces)]
+
+# WRITE: Saves the findings of a device as a CSV file with a header row
+def write_findings(filename, dvc_findings):
+    with open(filename, 'w', newline='') as file_content:
+        writer = csv.writer(file_content)
+        writer.writerow(findings_header)
+        writer.writerows(dvc_findings)
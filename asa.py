@@ -3,14 +3,26 @@ from netmiko import Netmiko
 import re
 from ipaddress import IPv4Network
 from datetime import datetime
-from copy import deepcopy
+from functools import lru_cache
+from collections import defaultdict
+from hashlib import sha256
+import stats
+from record import Ace
+
+
+######################## Variables to change dependant on environment ########################
+# How long (seconds) to wait for the output of each command, show access-list can be tens of MB so has its own longer timeout
+read_timeout = 60
+acl_read_timeout = 600
+# The conversions of IP and mask to a prefix are cached (most recently used) as the same networks are in many ACEs, net_cache is how many are kept
+net_cache = 65536
 
 
 ###################################### 1. Login and logoff ######################################
 # 1a. Attempt logon to ASA and create sessions
-def login(fw, user, pword):
+def login(fw, user, pword, timeout=10):
     try:
-        net_conn = Netmiko(host=fw, username=user, password=pword, device_type='cisco_asa')
+        net_conn = Netmiko(host=fw, username=user, password=pword, device_type='cisco_asa', conn_timeout=timeout)
         net_conn.find_prompt()
         return (True, net_conn)
     except Exception as e:
@@ -19,229 +31,266 @@ def login(fw, user, pword):
 def logoff(fw, sid):
     sid.disconnect()
 
+# SEND_COMMAND: Runs a command on the ASA, is counted (with the output size) when the run is instrumented (--stats)
+def send_command(sid, command):
+    output = sid.send_command(command)
+    stats.count(sid, output)
+    return output
+
+# SEND_COMMANDS: The prompt is found once and then each command is run with it as the expect_string, so Netmiko doesn't have to detect the prompt
+# (a delay and extra round trip) for every command. Each command has its own timeout (read_timeout unless set), if the prompt isn't seen in that
+# time Netmiko raises ReadTimeout. Returns the output of each command in the same order as the commands. The commands are not batched (sent in
+# one write with the output split by the prompt) as a prompt-like line in the output would move the output of all later commands onto the wrong
+# command, it is still a round trip per command. The fewer round trips come from the one show run for the ACL names and each ACL only once
+def send_commands(sid, commands, timeout=None):
+    all_output = []
+    prompt = re.escape(sid.find_prompt())
+    for cmd in commands:
+        all_output.append(sid.send_command(cmd, expect_string=prompt, read_timeout=timeout or read_timeout))
+        stats.count(sid, all_output[-1])
+    return all_output
+
 
 ################################## 2. Gather ACLs from ASAs ##################################
+# Command to get the ACLs applied to interfaces, RA VPN split tunnels and crypto maps (one filtered show run rather than one for each)
+SHOW_ACL_NAMES = 'show run | in ^access-group |split-tunnel-network-list value|match address'
+SHOW_ACL = 'show access-list | ex elements|cached|alert-interval|remark'
+
 def get_acls(fw, sid):
-    asa_all_acls, acl_brief, acl_brief_temp = ([] for i in range(3))
-
-    # 2a. Gets the name of all ACLs to be used in the show acl name brief cmd
-    asa_acl = sid.send_command('show run access-group')
-    ra_vpn_acl = sid.send_command('show run | in split-tunnel-network-list')
-    sts_vpn_acl = sid.send_command('show run | in match address')
-    for ace in asa_acl.splitlines():
-        asa_all_acls.append(ace.split(' ')[1])
-    for ace in ra_vpn_acl.splitlines():
-        asa_all_acls.append(ace.split('value ')[1])
-    for ace in sts_vpn_acl.splitlines():
-        asa_all_acls.append(ace.split('address ')[1])
-
-    # 2b. Gathers show ACL (as a string) and show ACL brief (as a list) output for all the ACLs
-    for ace in set(asa_all_acls):
-        acl_brief_temp.append(sid.send_command('show access-list {} brief'.format(ace)))
-    acl_expanded = sid.send_command('show access-list | ex elements|cached|alert-interval|remark')
-
-    # 2c. Creates new ACL brief list of all lines that have a timestamp (matching 8 characters, space, 8 characters)
-    for item in acl_brief_temp:
-        for line in item.splitlines():
-            if re.match(r"^\S{8}\s\S{8}\s", line):
-                acl_brief.append(line)
-    return acl_brief, acl_expanded
+    # 2a. Gets the name of all ACLs (each only once however many times it is used)
+    acl_names = get_acl_names(send_commands(sid, [SHOW_ACL_NAMES])[0])
+    # 2b. Gets the show access-list <name> brief output (ACE hashes, hitcnts and timestamps) of all the ACLs and show ACL (as a string)
+    acl_brief = []
+    for output in send_commands(sid, ['show access-list {} brief'.format(acl_name) for acl_name in acl_names]):
+        acl_brief.extend(brief_lines(output))
+    return acl_brief, send_commands(sid, [SHOW_ACL], acl_read_timeout)[0]
+
+# ACL_NAMES: Gets the name of all ACLs from the output of SHOW_ACL_NAMES (access-group, split tunnel and crypto map lines), to be used in the show acl name brief cmd
+def get_acl_names(acl_name_output):
+    asa_all_acls = []
+    for line in acl_name_output.splitlines():
+        if line.startswith('access-group '):
+            asa_all_acls.append(line.split(' ')[1])
+        elif 'split-tunnel-network-list value ' in line:
+            asa_all_acls.append(line.split('value ')[1])
+        elif 'match address ' in line:
+            asa_all_acls.append(line.split('address ')[1])
+    return sorted(set(asa_all_acls))
+
+# BRIEF: Creates ACL brief list of all lines that have a timestamp (matching 8 characters, space, 8 characters) from show ACL brief of all the ACLs
+def brief_lines(output):
+    return [line for line in output.splitlines() if re.match(r"^\S{8}\s\S{8}\s", line)]
+
+# CACHE_KEY: Hash of the ACLs and objects config along with the ACL names, if the hash is unchanged the cached ACLs can be used. Is 4 show run cmds
+# on every run (the cost of finding a changed policy), these are small compared to show access-list which they replace on an unchanged device
+def cache_key(fw, sid):
+    all_output = send_commands(sid, ['show run access-list', 'show run object-group', 'show run object', SHOW_ACL_NAMES])
+    return sha256('\n'.join(all_output[:3] + get_acl_names(all_output[3])).encode()).hexdigest()
+
+# REFRESH_HITS: Only gets show ACL brief of each cached ACL (much smaller than show ACL and no show run cmds) to update the hitcnts and timestamps
+# of the cached ACLs. The brief only has the ACEs that have been hit, so an ACE added or removed without hits is found by the number of elements
+# in its header. If an ACL no longer exists, has a different number of elements or its brief has ACE hashes not in the cached ACL it has changed,
+# so returns None to gather the full ACLs
+def refresh_hits(fw, sid, acl_brief, acl_expanded):
+    acl_brief = []
+    all_ace_hashes = get_ace_hashes(acl_expanded)
+    ace_counts = get_ace_counts(acl_expanded)
+    all_output = send_commands(sid, ['show access-list {} brief'.format(acl_name) for acl_name in all_ace_hashes])
+    for (acl_name, ace_hashes), output in zip(all_ace_hashes.items(), all_output):
+        elements = ELEMENTS.search(output)
+        if elements == None or elements.group(1) != acl_name or int(elements.group(2)) != ace_counts[acl_name]:
+            return None
+        for line in brief_lines(output):
+            if '0x' + line.split(' ')[0] not in ace_hashes:
+                return None
+            acl_brief.append(line)
+    return acl_brief, update_hits(acl_brief, acl_expanded)
+
+# ACE_HASHES: Gets the ACE hashes (last field) of every ACE in the show ACL output in the format {acl_name: {ace_hashes}}
+def get_ace_hashes(acl_expanded):
+    ace_hashes = defaultdict(set)
+    for line in acl_expanded.splitlines():
+        tokens = line.split()
+        if len(tokens) > 3 and tokens[0] == 'access-list' and tokens[2] == 'line' and tokens[-1].startswith('0x'):
+            ace_hashes[tokens[1]].add(tokens[-1])
+    return ace_hashes
+
+# ACE_COUNTS: Gets the number of elements (expanded ACEs) of each ACL in the show ACL output in the format {acl_name: elements}. An object-group
+# ACE is not an element itself, its expanded ACEs (the indented lines that follow it) are
+def get_ace_counts(acl_expanded):
+    ace_counts = defaultdict(int)
+    lines = acl_expanded.splitlines()
+    for idx, line in enumerate(lines):
+        tokens = line.split()
+        if len(tokens) > 3 and tokens[0] == 'access-list' and tokens[2] == 'line':
+            if line.startswith(' ') or idx + 1 == len(lines) or not lines[idx + 1].startswith(' '):
+                ace_counts[tokens[1]] += 1
+    return ace_counts
+
+# UPDATE_HITS: Replaces the hitcnt of each show ACL line with that from show ACL brief (matched on the ACE hash). The brief has the ACE hash, the
+# hash of the object-group ACE it is expanded from (00000000 if none), hitcnt and timestamp. Object-group ACEs hitcnt is the total of their ACEs
+def update_hits(acl_brief, acl_expanded):
+    hits = defaultdict(int)
+    for line in acl_brief:
+        ace_hash, parent_hash, hitcnt = line.split(' ')[:3]
+        hits['0x' + ace_hash] += int(hitcnt, 16)
+        if parent_hash != '00000000':
+            hits['0x' + parent_hash] += int(hitcnt, 16)
+    # ACEs not in the brief have not been hit
+    return HITCNT.sub(lambda ace: '(hitcnt={}){} {}'.format(hits.get(ace.group(2), 0), ace.group(1) or '', ace.group(2)), acl_expanded)
 
 
 ################################## DRY filters run by the main Sanitize method (format_acl) ##################################
-# CATEG_OBJ: If it is an object or object-group remove that and add an identifier to its name and padout with any1
-def categorize_obj(ele1, ele2):
-    if ele1 == 'object-group':
-        return ['grp_' + ele2, 'any1']
-    elif ele1 == 'object':
-        return ['obj_' + ele2, 'any1']
-    elif ele1 == 'fqdn':
-        return ['fqdn_' + ele2, 'any1']
-    # matches object ranges
+# Identifiers added to the start of address object names and to the ports of the operators (eq, neq, lt, gt)
+ADDR_OBJ = {'object': 'obj_', 'object-group': 'grp_', 'fqdn': 'fqdn_'}
+PORT_OP = {'eq': '', 'neq': 'NOT_', 'lt': 'LT_', 'gt': 'GT_'}
+# The hitcnt, state (if inactive) and ACE hash at the end of each show ACL line and the ACL name and number of elements at the start of show ACL brief
+HITCNT = re.compile(r'\(hitcnt=\d+\)( \(inactive\))? (0x[0-9a-f]+)')
+ELEMENTS = re.compile(r'^access-list (\S+); (\d+) elements;', re.M)
+
+# NORM_NET: Convert IP and subnet mask to a prefix, if not a valid network (has host bits set) is just the IP. Cached as same networks used in many ACEs
+@lru_cache(maxsize=net_cache)
+def normalize_net(ip, mask):
+    try:
+        return IPv4Network((ip, mask)).with_prefixlen
+    except ValueError:
+        return ip
+
+# PARSE_ADDR: Normalises the source or destination address starting at token[idx] returning the address and the index of the next token
+def parse_addr(tokens, idx):
+    ele = tokens[idx]
+    if ele == 'any' or ele == 'any4' or ele == 'any6':
+        return 'any', idx + 1
+    # Object, object-group or FQDN have an identifier added to the name. FQDN objects are followed by a '(resolved)' type field which is skipped
+    elif ele in ADDR_OBJ:
+        if idx + 2 < len(tokens) and '(' in tokens[idx + 2]:
+            return ADDR_OBJ[ele] + tokens[idx + 1], idx + 3
+        return ADDR_OBJ[ele] + tokens[idx + 1], idx + 2
+    # Address ranges are made an object of start-end
+    elif ele == 'range':
+        return 'obj_' + tokens[idx + 1] + '-' + tokens[idx + 2], idx + 3
+    # Hosts are a /32 or for IPv6 a /128
+    elif ele == 'host':
+        return tokens[idx + 1] + ('/128' if ':' in tokens[idx + 1] else '/32'), idx + 2
+    elif ele == 'interface':
+        return 'intf_' + tokens[idx + 1], idx + 2
+    # IPv6 prefixes are a single field
+    elif ':' in ele:
+        return ele, idx + 1
     else:
-        return ['obj_' + ele1 + '-' + ele2, 'any1']
-
-# NORM_SVC: Normalise src and dst ports so that are ranges joined and the identifiers (eq or range) removed
-def normalize_svc(ace, ele):
-    # If has a source range of ports replace "range" with "start-end" port numbers
-    if ace[ele] == 'range':
-        start = ace.pop(ele +1)
-        end = ace.pop(ele +1)
-        ace[ele] = start + '-' + end
-    # If has a single source port delete eq or add extra identifier for not, less than or greater than
-    elif ace[ele] == 'eq':
-        del ace[ele]
-    elif ace[ele] == 'neq':
-        del ace[ele]
-        ace[ele] =  'NOT_' + ace[ele]
-    elif ace[ele] == 'lt':
-        del ace[ele]
-        ace[ele] =  'LT_' + ace[ele]
-    elif ace[ele] == 'gt':
-        del ace[ele]
-        ace[ele] =  'GT_' + ace[ele]
-    # SRC_SVC: Catch-all ALL - If ICMP (cant have src_port) or has no source port padout with 'any_port'
-    elif ele == 6:
-        (ace.insert(ele, 'any_port'))
-    # DST_SVC: Catch-all Non-ICMP - Any other ACEs that are not ICMP and have no dst_svc are padout with 'any_port'
-    elif ele == 9 and 'icmp' not in ace:
-        (ace.insert(ele, 'any_port'))
-    # DST_SVC: Catch-all ICMP - Any other ICMP that have no dst_svc are padout with 'any_port'
-    elif ace[9].isdigit() or ace[9] == 'log':
-        (ace.insert(ele, 'any_port'))
-
-# NORM_NET: Convert subnet mask to prefix and padout old mask with 'any1'. If interface name used in ace do same for that
-def normalize_net(ace, ele):
-    # if it uses interface combines into 1 filed and pads out with any1
-    if ace[ele] == 'interface':
-        ace[ele] = 'intf_' + ace[ele +1]
-        ace[ele +1] = 'any1'
-    # Changes subnet mask to a prefix
+        return normalize_net(ele, tokens[idx + 1]), idx + 2
+
+# PARSE_PORT: Normalise src and dst ports so that ranges are joined and the identifiers (eq, neq, lt, gt) replaced, if is no port returns None
+def parse_port(tokens, idx):
+    if idx < len(tokens):
+        if tokens[idx] in PORT_OP:
+            return PORT_OP[tokens[idx]] + tokens[idx + 1], idx + 2
+        elif tokens[idx] == 'range':
+            return tokens[idx + 1] + '-' + tokens[idx + 2], idx + 3
+    return None, idx
+
+# PARSE_ACE: Single pass of the fields of a 'show access-list' line producing [name, num, permit/deny, protocol, src, src_port, dst, dst_port, hitcnt, hash, '', state]
+def parse_ace(tokens):
+    name, num, acl_type, action = tokens[1], tokens[3], tokens[4], tokens[5]
+    # Hash, state and hitcnt are the last fields. As FQDN doesn't have a hitcnt uses 0
+    end = len(tokens)
+    ace_hash, state, hitcnt = '', '', '0'
+    if tokens[end - 1].startswith('0x'):
+        ace_hash, end = tokens[end - 1], end - 1
+    if tokens[end - 1] == '(inactive)':
+        state, end = 'inactive', end - 1
+    if tokens[end - 1].startswith('(hitcnt='):
+        hitcnt, end = tokens[end - 1][8:-1], end - 1
+    tokens = tokens[6:end]
+
+    # Standard ACLs only have a source so pad out protocol and destination to make it same as extended
+    if acl_type == 'standard':
+        src = parse_addr(tokens, 0)[0]
+        proto, src_port, dst, dst_port = 'ip', 'any_port', 'any', 'any_port'
     else:
-        try:                # If it is a valid IP (not 'any' or an object)
-            src_pfx = IPv4Network((ace[ele], ace[ele +1])).with_prefixlen	    # Add prefix to the src_IP
-            ace[ele] = src_pfx
-            ace[ele +1] = 'any1'
-        except:             # So script doesn't fail if is not an IP address (an object)
-            pass
-    del ace[ele +1]                 # Remove the padding ('any1')
+        # If it is a service object or object-group remove 'object or 'object-group' and add identifer to the name
+        if tokens[0] == 'object-group':
+            proto, idx = 'svc-grp_' + tokens[1], 2
+        elif tokens[0] == 'object':
+            proto, idx = 'svc_' + tokens[1], 2
+        else:
+            proto, idx = tokens[0], 1
+        src, idx = parse_addr(tokens, idx)
+        # A range straight after the source is the destination address range (same as it has always been reported)
+        if idx < len(tokens) and tokens[idx] == 'range':
+            src_port = None
+        else:
+            src_port, idx = parse_port(tokens, idx)
+        dst, idx = parse_addr(tokens, idx)
+        dst_port, idx = parse_port(tokens, idx)
+        # ICMP has no ports, if the next field is not an option (log, etc) or a number it is the ICMP type
+        if dst_port == None and proto == 'icmp' and idx < len(tokens):
+            if not tokens[idx].isdigit() and tokens[idx] not in ['log', 'inactive', 'time-range']:
+                dst_port = tokens[idx]
+        # Anything after the dst_port (logging or time-ranges) is ignored. If no ports pads out with 'any_port'
+        src_port, dst_port = src_port or 'any_port', dst_port or 'any_port'
+
+    # The blank column is used for the last hit time
+    return [name, num, action, proto, src, src_port, dst, dst_port, hitcnt, ace_hash, '', state]
 
 # NORM_DATE: Splits date/time into 2 fields and reformats it to be more human readable
 def normalize_datetime(acl):
     for ace in acl:
         if ace[10] != '':
-            ace[9] = ace[10].strftime('%Y-%m-%d %H:%M:%S').split(' ')[0]
-            ace[10] = ace[10].strftime('%Y-%m-%d %H:%M:%S').split(' ')[1]
+            ace[9], ace[10] = ace[10].strftime('%Y-%m-%d %H:%M:%S').split(' ')
 
 
 ################################## 3. Sanitize the data - Create ACL structured data ##################################
 # 3. ENGINE: Feeds ACL data and uses functions to produce standardized data model of ACL and expanded ACL
 def format_acl(fw, acl_brief, acl_expanded):
-    acl_exp, acl_date, acl_no_date = ([] for i in range(3))
+    acl_exp = []
 
-    # 3a. Pad out 'any' so that the all source and destination are 2 fields (ACL is 1 big string at the moment)
-    acl_all_temp1 = acl_expanded.replace('any4', 'any').replace('any', 'any any1')
-    # Remove 'hitcnt' text by replacing fields.
-    for elem in ['(hitcnt=', ')']:
-        acl_all_temp1 = acl_all_temp1.replace(elem, '')
+    # Dict of {ace_hash: last_hit_unixtime} from show access-list <name> brief so each ACE gets its timestamp (3b) with a single lookup
+    last_hit = {}
+    for hashes in acl_brief:
+        last_hit[hashes.split(' ')[0]] = hashes.split(' ')[-1]
 
-    # 3b. Make string into a list and split the elements in each list at the whitespaces
-    for item in acl_all_temp1.splitlines():
-        ace = item.strip().split(' ')
+    for line in acl_expanded.splitlines():
+        # 3a. Parses each ACE line into the standardized data model (categorize object names, simplify ranges, remove unneeded fields, etc)
+        tokens = line.split()
+        if len(tokens) < 7 or tokens[0] != 'access-list' or tokens[2] != 'line':
+            continue
+        ace = parse_ace(tokens)
+        # 3b. Convert unixtime into human-readable time (is got as hash from last element in show access-list <name> brief)
+        unix_time = last_hit.get(ace[9][2:])            # ACE hash is the acl_brief hash with 0x in front of it
+        if unix_time != None:
+            ace[10] = datetime.fromtimestamp(int(unix_time, 16))
+        else:                   # If is no matching hashes (no timestamp) removes hashes
+            ace[9] = ''
         acl_exp.append(ace)
 
-    # Loops though ACL to normalise the data (categorize object names, simplify ranges, remove unneeded fields, etc)
+    # CREATE_ACL: Single pass through the expanded ACL grouped on (acl_name, line_number). The first ACE of each group is copied to create the
+    # non-expanded ACL (all fields are strings or dates so a shallow copy is enough) and the latest hit of all ACEs in the group is recorded
+    acl, latest_hit = [], {}
+    last_key = None
     for ace in acl_exp:
-        #3c. If it is a standard ACL pads out protocol and destination to make it same as extended
-        if ace[4] == 'standard':
-            ace.insert(6, 'ip')
-            ace.insert(9, 'any')
-            ace.insert(10, 'any1')
-        # Deletes first 3 fields (access-list, line and extended/standard)
-        for field in [0, 1, 2]:
-            del ace[field]
-
-        if ace[4] == 'range':
-            del ace[4]
-            ace[4:5] = categorize_obj(ace[4], ace.pop(5))
-        if ace[6] == 'range':
-            del ace[6]
-            ace[6:7] = categorize_obj(ace[6], ace.pop(7))
-
-        # 3d. If it is a service object or object-group remove 'object or 'object-group' and add identifer to the name
-        if ace[3] == 'object-group':
-            ace[3] = 'svc-grp_' + ace.pop(4)
-        if ace[3] == 'object':
-            ace[3] = 'svc_' + ace.pop(4)
-        # If it is an object or object-group remove, add an identifier to its name and padout with any1
-        if ace[4] == 'object' or ace[4] == 'object-group' or ace[4] == 'fqdn':
-            ace[4:5] = categorize_obj(ace[4], ace.pop(5))
-        if ace[6] == 'object' or ace[6] == 'object-group' or ace[6] == 'fqdn':
-            ace[6:7] = categorize_obj(ace[6],ace.pop(7))
-        # Cleans up src and dst extra field added by FQDN objects
-        if '(' in ace[6]:
-            del ace[6]
-        if '(' in ace[8]:
-            del ace[8]
-
-        # 3e. Normalise src and dst ports so that are ranges joined with the identifiers (eq or range) removed
-        normalize_svc(ace, 6)
-        normalize_svc(ace, 9)
-
-        # 3f. For all host entries delete host and add /32 subnet mask after the IP
-        if ace[4] == 'host':						# if src_ip is /32
-            del ace[4]
-            (ace.insert(5, '255.255.255.255'))
-        if ace[7] == 'host':						# if dst_ip is /32
-            del ace[7]
-            (ace.insert(8, '255.255.255.255'))
-
-        # 3g. Converts subnet mask to prefix and removes the padding (any1)
-        normalize_net(ace, 4)
-        normalize_net(ace, 6)
-
-        # 3h. If inactive moves 'state' to the last column (also removes '('), if is active adds a blank column)
-        if ace[-2] == '(inactive':
-            ace.append(ace.pop(-2)[1:])
-        else:
-            ace.append('')
-        # Cleans up any columns between dst_port and hitcnt (logging or time-ranges)
-        if len(ace) != 11:
-            del ace[8:-3]
-        # As FQDN doesn't have a hitcnt adds a blank entry
-        if ace[8].isdigit() == False:
-            ace.insert(8, '0')
-
-        # 3i. Convert unixtime into human-readable time (is got as hash from last element in show access-list <name> brief)
-        ace.insert(10, '')                              # Insert blank column to be used by the time
-        for hashes in acl_brief:     				    # Loop through acl_brief
-            if hashes.split(' ')[0] in ace[9]:    		# If acl_brief hash matches ace hash
-                unix_time = hashes.split(' ')[-1]
-                ace[10] = datetime.fromtimestamp(int(unix_time, 16))
-        if ace[10] == '':       # If is no matching hashes (no timestamp) removes hashes
-            ace[9] = ''
+        key = (ace[0], ace[1])
+        if key != last_key:
+            acl.append(list(ace))
+            last_key = key
+        # Only ACEs with a timestamp still have the hash
+        if len(ace[9]) != 0 and (key not in latest_hit or ace[10] > latest_hit[key]):
+            latest_hit[key] = ace[10]
 
-    # CREATE_ACL: Create non-expanded ACL by removing all duplicate ACL_name/acl_num combinations after the first
-    acl_temp = deepcopy(acl_exp)        # Creates a separate copy of acl_exp so the new acl list isn't referencing it
-    acl = [acl_temp[0]]                 # Creates new list containing only first element (as loop is offset by 1)
-    # The loop on 2nd list is one element in front which is what allows to look for duplicates
-    for ace_exp, ace in zip(acl_exp, acl_temp[1:]):
-        # Skip duplicates and append non-duplicates (always first one due to the offset) to list
-        if ace_exp[0:2] == ace[0:2]:
-            pass
-        else:
-            acl.append(ace)
-
-    # GET_ACE_MISSING_DATE: Loop through ACL, get any with hitcnts but no date. Are stored in list as [name, rule_num, hits]
+    # GET_ACE_MISSING_DATE: ACEs with hitcnts but no date get the latest date of all the expanded ACEs under the same main ACE
     for ace in acl:
         if ace[8] != '0' and len(ace[9]) == 0:
-            acl_no_date.append([ace[0], ace[1], ace[8]])
-    # Compare this against acl_exp matching rule and number to get date for all expanded ACEs under the same main ACE
-    for ace in acl_no_date:
-        acl_exp_date = []
-        for ace_exp in acl_exp:
-            if ace[0:2] == ace_exp[0:2] and len(ace_exp[9]) !=0:
-                acl_exp_date.append(ace_exp[10])
-        if len(acl_exp_date) != 0:
-            # Add date to ACL missing hits rules. Max() (part of datetime) gets only the latest date from the list of dates
-            acl_date.append([ace[0], ace[1], ace[2], max(acl_exp_date)])
+            ace[10] = latest_hit.get((ace[0], ace[1]), '')
 
     # ACL & ACL_EXP_DATE: Splits date/time into 2 fields and reformats it to be more human readable
     normalize_datetime(acl)
     normalize_datetime(acl_exp)
 
-    # ACL: Adds time/date got from 3k to the ACEs that were missing dates (splits and makes human readable)
-    for ace in acl:
-        for ace_date in acl_date:
-            if ace[:2] == ace_date[:2]:
-                ace[9] = ace_date[3].strftime('%Y-%m-%d %H:%M:%S').split(' ')[0]
-                ace[10] = ace_date[3].strftime('%Y-%m-%d %H:%M:%S').split(' ')[1]
-
-    # ACL_EXP: Removes all entries that are objects or object groups from the expanded ACL
-    for idx, ace in enumerate(acl_exp):
-        if 'grp' in ace[3] or 'grp' in ace[4] or 'obj' in ace[4] or 'grp' in ace[6] or 'obj' in ace[6]:
-            del acl_exp[idx]
+    # ACL_EXP: Removes all entries that are objects or object groups from the expanded ACL. The rows of both are made into ACE records
+    acl = [Ace(*ace) for ace in acl]
+    acl_exp = [Ace(*ace) for ace in acl_exp if not ('grp' in ace[3] or 'grp' in ace[4] or 'obj' in ace[4] or 'grp' in ace[6] or 'obj' in ace[6])]
 
-    # OUTPUT: Returns a dictionary of {device_ip_acl: non_expanded_acl, device_ip_exp_acl: expanded_acl} with every line of each being in the format:
+    # OUTPUT: Returns a dictionary of {device_ip_acl: non_expanded_acl, device_ip_exp_acl: expanded_acl} with every line of each being an ACE
+    # record (record.Ace) with the fields:
     # [name, num, permit/deny, protocol, src_ip/pfx, src_port, dst_ip/pfx, dst_port, hitcnt, last_hit_date, last_hit_time, state]
     return {fw + '_acl': acl, fw + '_exp_acl': acl_exp}
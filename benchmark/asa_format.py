@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Times asa.format_acl against a large synthetic 'show access-list' output and matching 'show access-list <name> brief' hashes.
+# Run from the repo root: python benchmark/asa_format.py -l 20000
+import argparse
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import asa
+
+
+# SYNTHETIC_ACL: Returns (acl_brief, acl_expanded) in the same format as asa.get_acls. Every 4th rule is an object-group with 3 expanded ACEs
+def synthetic_acl(num_lines, seed=1):
+    rand = random.Random(seed)
+    acl_expanded, acl_brief = ([] for i in range(2))
+    line_num = 0
+    while len(acl_expanded) < num_lines:
+        line_num += 1
+        hits = rand.choice([0, 0, rand.randint(1, 100000)])
+        parent = '{:08x}'.format(rand.getrandbits(32))
+        if line_num % 4 == 0:
+            acl_expanded.append('access-list outside line {} extended permit tcp any object-group GRP_{} eq https (hitcnt={}) 0x{}'.format(
+                                line_num, line_num, hits * 3, parent))
+            for child in range(3):
+                ace_hash = '{:08x}'.format(rand.getrandbits(32))
+                acl_expanded.append('  access-list outside line {} extended permit tcp any host 10.{}.{}.{} eq https (hitcnt={}) 0x{}'.format(
+                                    line_num, line_num // 65536 % 256, line_num // 256 % 256, child, hits, ace_hash))
+                if hits != 0:
+                    acl_brief.append('{} {} {:08x} {:08x}'.format(ace_hash, parent, hits, 1600000000 + rand.randint(0, 10000000)))
+        else:
+            acl_expanded.append('access-list outside line {} extended permit udp 10.{}.{}.0 255.255.255.0 host 192.168.1.1 eq 53 (hitcnt={}) 0x{}'.format(
+                                line_num, line_num // 65536 % 256, line_num // 256 % 256, hits, parent))
+            if hits != 0:
+                acl_brief.append('{} 00000000 {:08x} {:08x}'.format(parent, hits, 1600000000 + rand.randint(0, 10000000)))
+    return acl_brief, '\n'.join(acl_expanded)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--lines', type=int, default=20000, help='Number of show access-list lines (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs, the fastest is reported (default: %(default)s)')
+    args = parser.parse_args()
+
+    acl_brief, acl_expanded = synthetic_acl(args.lines)
+    timings = []
+    for each_run in range(args.repeat):
+        start = time.perf_counter()
+        acl = asa.format_acl('bench', acl_brief, acl_expanded)
+        timings.append(time.perf_counter() - start)
+    rows = len(acl['bench_exp_acl'])
+    print('asa.format_acl: {} lines, {} brief hashes, {} expanded rows in {:.3f}s ({:,.0f} lines/sec)'.format(
+          args.lines, len(acl_brief), rows, min(timings), args.lines / min(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Benchmarks asa.format_acl, ckp.format_acl and main.create_xls against synthetic rulebases (synthetic.py) at different scales, reporting rows/sec
+# and peak memory. Results are added to history.jsonl so performance can be tracked over time and a regression fails the run.
+# Run from the repo root: python benchmark/run.py -s 1k 10k 100k
+import argparse
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+from rich.console import Console
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import asa
+import ckp
+import main
+import synthetic
+
+
+######################## Variables to change dependant on environment ########################
+# File the results of every run are added to (a JSON object per benchmark and scale)
+history_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.jsonl')
+# Scales that can be run, is the number of ACL rows created
+scales = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+# A drop in rows/sec of more than this percentage (against the last run of the same benchmark and scale) is a regression
+threshold = 10
+
+
+################################## Benchmarks ##################################
+# Each benchmark is a pair of functions, one creates the input (not measured) and the other the code measured returning the number of rows made.
+# Input is created for every run as format_acl and create_xls consume (pop or change) what they are given
+
+def asa_input(num_rows):
+    return synthetic.asa_acl(num_rows)
+
+def asa_run(acl_brief, acl_expanded):
+    acl = asa.format_acl('bench', acl_brief, acl_expanded)
+    return sum(1 for ace in acl['bench_exp_acl'])
+
+def ckp_input(num_rows):
+    return synthetic.ckp_acl(num_rows)
+
+def ckp_run(acl_brief, acl_expanded):
+    acl = ckp.format_acl('bench', acl_brief, acl_expanded)
+    return sum(1 for ace in acl['bench_acl']) + sum(1 for ace in acl['bench_exp_acl'])
+
+# XLS: Rows are a generator (like format_acl returns) so the memory measured is only that of the workbook being written
+def xls_input(num_rows):
+    return num_rows, tempfile.mkdtemp()
+
+def xls_run(num_rows, location):
+    with redirect_stdout(open(os.devnull, 'w')):
+        main.create_xls(dict(location=location, name='bench'), {'bench_exp_acl': synthetic.report_rows(num_rows)})
+    os.remove(os.path.join(location, 'bench.xlsx'))
+    os.rmdir(location)
+    return num_rows
+
+benchmarks = {'asa': (asa_input, asa_run), 'ckp': (ckp_input, ckp_run), 'xls': (xls_input, xls_run)}
+
+
+################################## Measure and record ##################################
+# TIME: Fastest of the runs, garbage collection is done before each so it isn't counted against the next run
+def time_bench(bench, num_rows, repeat):
+    timings = []
+    for each_run in range(repeat):
+        bench_input = benchmarks[bench][0](num_rows)
+        gc.collect()
+        start = time.perf_counter()
+        rows = benchmarks[bench][1](*bench_input)
+        timings.append(time.perf_counter() - start)
+    return rows, min(timings)
+
+# MEMORY: Peak memory (MB) allocated while running, is a separate run as tracemalloc slows the code down
+def memory_bench(bench, num_rows):
+    bench_input = benchmarks[bench][0](num_rows)
+    gc.collect()
+    tracemalloc.start()
+    benchmarks[bench][1](*bench_input)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1000000
+
+# LAST_RESULTS: The last result of each benchmark and scale from the history file, is {(bench, scale): result}
+def last_results():
+    results = {}
+    if os.path.exists(history_file):
+        with open(history_file) as file_content:
+            for line in file_content:
+                result = json.loads(line)
+                results[(result['bench'], result['scale'])] = result
+    return results
+
+# COMMIT: Git commit the benchmarks were run against so a change in performance can be matched to a change in the code
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+###################################### Run the benchmarks ######################################
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--scale', nargs='+', choices=scales, default=['1k', '10k', '100k'], help='Number of rows to benchmark (default: %(default)s)')
+    parser.add_argument('-b', '--bench', nargs='+', choices=benchmarks, default=list(benchmarks), help='Benchmarks to run (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of timed runs, the fastest is reported (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure peak memory (is an extra run of each benchmark)')
+    parser.add_argument('--no-history', action='store_true', help='Do not add the results to the history file')
+    parser.add_argument('-t', '--threshold', type=float, default=threshold, help='Percent rows/sec can drop before is a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    rc = Console()
+    main.rc = Console(quiet=True)
+    previous = last_results()
+    results, regressions = [], []
+    for bench in args.bench:
+        for scale in args.scale:
+            rows, seconds = time_bench(bench, scales[scale], args.repeat)
+            peak_mb = None if args.no_memory == True else round(memory_bench(bench, scales[scale]), 1)
+            result = dict(date=datetime.now().isoformat(timespec='seconds'), commit=git_commit(), python=platform.python_version(), bench=bench,
+                          scale=scale, rows=rows, seconds=round(seconds, 3), rows_per_sec=round(rows / seconds), peak_mb=peak_mb)
+            results.append(result)
+
+            # Compares against the last run of the benchmark, a drop of more than the threshold is a regression
+            last = previous.get((bench, scale))
+            change = ''
+            if last != None:
+                change = (result['rows_per_sec'] - last['rows_per_sec']) / last['rows_per_sec'] * 100
+                if change < -args.threshold:
+                    regressions.append('{} {}'.format(bench, scale))
+                change = ' ({:+.1f}% vs {})'.format(change, last['commit'] or last['date'])
+            rc.print('{:<4} {:>5}: {:>9,} rows in {:>8.3f}s, {:>10,} rows/sec{}, peak memory {} MB'.format(
+                     bench, scale, rows, seconds, result['rows_per_sec'], change, peak_mb if peak_mb != None else '-'))
+
+    if args.no_history == False:
+        with open(history_file, 'a') as file_content:
+            for result in results:
+                file_content.write(json.dumps(result) + '\n')
+    if len(regressions) != 0:
+        rc.print(':x: [b red]REGRESSION[/b red] - rows/sec dropped by more than {}% for [i]{}[/i]'.format(args.threshold, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Generators of large synthetic rulebases in the same format as asa.get_acls and ckp.get_acls, used by the benchmarks (run.py).
+# The same seed always gives the same rulebase so results can be compared between runs
+import random
+from ipaddress import IPv4Network
+
+
+################################## ASA ##################################
+# ASA_ACL: Returns (acl_brief, acl_expanded) with about num_rows 'show access-list' lines spread over num_acls ACLs. Every 4th rule is an object-group
+# ACE, with nesting the group has nested groups so expands to group_size ** nesting ACEs. hit_ratio is the share of ACEs hit (are in the brief)
+def asa_acl(num_rows, num_acls=10, group_size=4, nesting=1, hit_ratio=0.5, seed=1):
+    rand = random.Random(seed)
+    acl_expanded, acl_brief = ([] for i in range(2))
+    rows_per_acl = max(num_rows // num_acls, 1)
+    protocols = ['tcp', 'udp', 'ip', 'icmp']
+
+    for acl_num in range(num_acls):
+        name, line_num, acl_rows = 'acl_{}'.format(acl_num), 0, 0
+        while acl_rows < rows_per_acl:
+            line_num += 1
+            parent = '{:08x}'.format(rand.getrandbits(32))
+            proto = protocols[line_num % 4]
+            port = ' eq {}'.format(rand.choice(['https', 'www', 'domain', '8080'])) if proto in ['tcp', 'udp'] else ''
+            state = ' inactive' if line_num % 50 == 0 else ''
+            # OBJECT_GROUP: Parent ACE with the destination group followed by an ACE per expanded (nested) member
+            if line_num % 4 == 0:
+                children = []
+                for child in range(group_size ** nesting):
+                    hits = rand.randint(1, 100000) if rand.random() < hit_ratio and state == '' else 0
+                    children.append(('{:08x}'.format(rand.getrandbits(32)), hits, str(IPv4Network((0x0a000000 + line_num * 256 + child * 4, 30)))))
+                acl_expanded.append('access-list {} line {} extended permit {} any object-group GRP_{}{}{} (hitcnt={}){} 0x{}'.format(
+                                    name, line_num, proto, line_num, port, state, sum(child[1] for child in children),
+                                    ' (inactive)' if state else '', parent))
+                for ace_hash, hits, network in children:
+                    addr, mask = network.split('/')[0], str(IPv4Network(network).netmask)
+                    acl_expanded.append('  access-list {} line {} extended permit {} any {} {}{}{} (hitcnt={}){} 0x{}'.format(
+                                        name, line_num, proto, addr, mask, port, state, hits, ' (inactive)' if state else '', ace_hash))
+                    if hits != 0:
+                        acl_brief.append('{} {} {:08x} {:08x}'.format(ace_hash, parent, hits, 1600000000 + rand.randint(0, 10000000)))
+                acl_rows += len(children) + 1
+            # ACE: Mix of hosts, networks, objects and ranges
+            else:
+                hits = rand.randint(1, 100000) if rand.random() < hit_ratio and state == '' else 0
+                src = rand.choice(['any', 'host 10.1.{}.{}'.format(line_num // 256 % 256, line_num % 256), 'object OBJ_{}'.format(line_num),
+                                   '10.{}.{}.0 255.255.255.0'.format(line_num // 65536 % 256, line_num // 256 % 256)])
+                dst = rand.choice(['any4', 'host 192.168.1.1', 'range 172.16.0.1 172.16.0.10', '172.16.{}.0 255.255.254.0'.format(line_num % 256)])
+                acl_expanded.append('access-list {} line {} extended {} {} {} {}{}{} (hitcnt={}){} 0x{}'.format(
+                                    name, line_num, rand.choice(['permit', 'deny']), proto, src, dst, port, state, hits,
+                                    ' (inactive)' if state else '', parent))
+                if hits != 0:
+                    acl_brief.append('{} 00000000 {:08x} {:08x}'.format(parent, hits, 1600000000 + rand.randint(0, 10000000)))
+                acl_rows += 1
+    return acl_brief, '\n'.join(acl_expanded)
+
+
+################################## Checkpoint ##################################
+# CKP_ACL: Returns (acl_brief, acl_expanded) pages of 'show-access-rulebase' (500 rules per page) and 'show-as-ranges' (20 rules per page) that
+# will produce about num_rows expanded ACL rows. Rules are in sections of section_size with some negated, inline layers, services groups
+# and big address groups of group_size members
+def ckp_acl(num_rows, num_policies=2, section_size=50, group_size=20, seed=1):
+    rand = random.Random(seed)
+    rules, rows = [], 0
+    while rows < num_rows:
+        rule, exp_rows = ckp_rule(rand, len(rules) + 1, group_size)
+        rules.append(rule)
+        rows += exp_rows
+
+    # Rules are split between the policies, each policy having its own rule numbers and sections
+    acl_brief, acl_expanded = [], []
+    per_policy = -(-len(rules) // num_policies)
+    for policy_num in range(num_policies):
+        policy_rules = rules[policy_num * per_policy:(policy_num + 1) * per_policy]
+        for rule_num, rule in enumerate(policy_rules, 1):
+            rule[0]['rule-number'] = rule[1]['rule-number'] = rule_num
+        acl_brief.extend(ckp_pages('policy_{}'.format(policy_num), [rule[0] for rule in policy_rules], section_size, 500))
+        acl_expanded.extend(ckp_pages('policy_{}'.format(policy_num), [rule[1] for rule in policy_rules], section_size, 20))
+    return acl_brief, acl_expanded
+
+# PAGES: Splits the rules into pages of limit rules and within each page into access-sections of section_size
+def ckp_pages(policy, rules, section_size, limit):
+    pages = []
+    for offset in range(0, len(rules), limit):
+        rulebase = []
+        for rule in rules[offset:offset + limit]:
+            if (rule['rule-number'] - 1) % section_size == 0 or len(rulebase) == 0:
+                rulebase.append({'type': 'access-section', 'name': 'section_{}'.format(rule['rule-number']), 'rulebase': []})
+            rulebase[-1]['rulebase'].append(rule)
+        pages.append({'name': policy, 'from': offset + 1, 'to': offset + len(rules[offset:offset + limit]), 'total': len(rules), 'rulebase': rulebase})
+    return pages
+
+# RULE: Returns the (brief_rule, expanded_rule) and the number of expanded ACL rows it creates
+def ckp_rule(rand, num, group_size):
+    src, src_ranges = ckp_addr(rand, num, group_size)
+    dst, dst_ranges = ckp_addr(rand, num + 100000, group_size)
+    svc, svc_ranges, num_svc = ckp_svc(rand, num)
+    rule = {'uid': 'rule-{}'.format(num), 'type': 'access-rule', 'rule-number': num, 'enabled': num % 40 != 0,
+            'action': {'name': rand.choice(['Accept', 'Drop'])}, 'hits': {'value': 0}}
+    if rand.random() < 0.7:
+        rule['hits'] = {'value': rand.randint(1, 1000000), 'last-date': {'posix': (1600000000 + rand.randint(0, 10000000)) * 1000}}
+    if num % 100 == 0:
+        rule['inline-layer'] = {'name': 'inline_{}'.format(num)}
+    brief = dict(rule, **{'source': src, 'destination': dst, 'service': svc, 'source-negate': num % 30 == 0, 'destination-negate': num % 45 == 0,
+                          'service-negate': False})
+    expanded = dict(rule, **{'source-ranges': src_ranges, 'destination-ranges': dst_ranges, 'service-ranges': svc_ranges})
+    expanded['action'] = dict(rule['action'])
+    return (brief, expanded), max(len(src_ranges['ipv4']), len(src_ranges['others']), 1) * max(len(dst_ranges['ipv4']), len(dst_ranges['others']), 1) * num_svc
+
+# ADDR: A host, network, the 'Any' object or a big group (expanded into a range per member)
+def ckp_addr(rand, num, group_size):
+    choice = rand.random()
+    net = IPv4Network((0x0a000000 + num * 256 % 0x1000000, 24))
+    if choice < 0.1:
+        return [{'type': 'CpmiAnyObject', 'name': 'Any'}], {'ipv4': [{'start': '0.0.0.0', 'end': '255.255.255.255'}], 'ipv6': [], 'others': [],
+                                                            'excluded-others': []}
+    elif choice < 0.45:
+        return [{'type': 'host', 'name': 'h_{}'.format(num)}], {'ipv4': [{'start': str(net[1]), 'end': str(net[1])}], 'ipv6': [], 'others': [],
+                                                                 'excluded-others': []}
+    elif choice < 0.95:
+        return [{'type': 'network', 'name': 'n_{}'.format(num)}], {'ipv4': [{'start': str(net[0]), 'end': str(net[-1])}], 'ipv6': [],
+                                                                    'others': [], 'excluded-others': []}
+    else:
+        members = [{'start': str(net[each_member + 1]), 'end': str(net[each_member + 1])} for each_member in range(min(group_size, 250))]
+        return [{'type': 'group', 'name': 'g_{}'.format(num)}], {'ipv4': members, 'ipv6': [], 'others': [], 'excluded-others': []}
+
+# SVC: Any, a TCP/UDP service or a service group. Returns the services, service ranges and number of services in the expanded ACL
+def ckp_svc(rand, num):
+    choice = rand.random()
+    services = [{'type': 'service-tcp', 'name': 'https', 'port': '443'}, {'type': 'service-tcp', 'name': 'http', 'port': '80'},
+                {'type': 'service-udp', 'name': 'domain-udp', 'port': '53'}, {'type': 'service-tcp', 'name': 'ssh', 'port': '22'}]
+    if choice < 0.2:
+        return [{'type': 'CpmiAnyObject', 'name': 'Any'}], {'tcp': [{'start': '0', 'end': '65535'}], 'udp': [{'start': '0', 'end': '65535'}],
+                                                            'others': [], 'excluded-others': []}, 1
+    elif choice < 0.7:
+        service = services[num % 4]
+        return [service], {'tcp': [], 'udp': [], 'others': [service], 'excluded-others': []}, 1
+    else:
+        return [{'type': 'service-group', 'name': 'svc_grp_{}'.format(num % 10)}], {'tcp': [], 'udp': [], 'others': services,
+                                                                                     'excluded-others': []}, len(services)
+
+
+################################## Report ##################################
+# REPORT_ROWS: Yields num_rows normalized ACL rows (as format_acl outputs) for the report writers
+def report_rows(num_rows, seed=1):
+    rand = random.Random(seed)
+    for row in range(num_rows):
+        hit = rand.random() < 0.5
+        yield ['acl_{}'.format(row // 10000), str(row % 10000 + 1), rand.choice(['permit', 'deny']), rand.choice(['tcp', 'udp', 'ip']),
+               '10.{}.{}.0/24'.format(row // 65536 % 256, row // 256 % 256), 'any_port', rand.choice(['any', '192.168.1.1/32', 'grp_servers']),
+               rand.choice(['443', '53', 'any_port', 'https']), str(rand.randint(1, 100000) if hit else 0),
+               '2021-05-{:02d}'.format(rand.randint(1, 28)) if hit else '', '12:{:02d}:00'.format(rand.randint(0, 59)) if hit else '',
+               'Inactive' if row % 50 == 0 else '']
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import os
+import json
+import gzip
+import time
+
+
+######################## Variables to change dependant on environment ########################
+# Directory the cached ACLs are saved in (a compressed file per device), by default in the users cache directory. Can be changed at runtime (--cache-dir)
+cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'acl_report')
+# Cached ACLs older than max_age (days) are deleted, if all the cached ACLs are bigger than max_size (MB) the oldest are deleted
+max_age = 7
+max_size = 500
+
+
+################################## Change detection cache ##################################
+# The ACLs gathered by get_acls (acl_brief and acl_expanded) are saved along with a key of the devices policy (revision, config hash, etc).
+# When the key is the same on the next run the policy is unchanged so the cached ACLs are used and only the hit counts need refreshing.
+# It is the raw output of get_acls (not the formatted rows) that is cached as the hits are refreshed in it (by ASA ACE hash or Checkpoint rule
+# UID, which the rows don't have) before it is formatted, is also the same as the captures. As it is the devices ACLs and objects config the
+# directory is only accessible by the user (0700) and the files only readable by them (0600)
+
+# FILENAME: Name of the cache (or capture) file for a device
+def cache_file(fw_type, fw, directory=None):
+    return os.path.join(directory or cache_dir, '{}_{}.json.gz'.format(fw_type, fw.replace(os.sep, '_').replace(':', '_')))
+
+# LOAD: Returns the cached {key, acl_brief, acl_expanded} of a device if its key matches the key saved with them (any key if None), otherwise None
+def load(fw_type, fw, key=None):
+    try:
+        with gzip.open(cache_file(fw_type, fw), 'rt') as file_content:
+            cached = json.load(file_content)
+    # No cache file or a corrupt one is same as a changed policy
+    except (OSError, ValueError):
+        return None
+    if key != None and cached.get('key') != key:
+        return None
+    return cached
+
+# SAVE: Streams the ACLs and key as JSON into a gzip file. Written to a temp file first so a failed write can never leave a half written cache
+def save(fw_type, fw, key, acl_brief, acl_expanded, directory=None):
+    os.makedirs(directory or cache_dir, mode=0o700, exist_ok=True)
+    filename = cache_file(fw_type, fw, directory)
+    with os.fdopen(os.open(filename + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as raw_file:
+        with gzip.open(raw_file, 'wt') as file_content:
+            json.dump(dict(fw_type=fw_type, fw=fw, key=key, acl_brief=acl_brief, acl_expanded=acl_expanded), file_content)
+    os.replace(filename + '.tmp', filename)
+
+# EVICT: Deletes cached ACLs older than max_age, then from the newest adds up the file sizes deleting any that take it over max_size
+def evict():
+    if not os.path.isdir(cache_dir):
+        return
+    total_size = 0
+    all_files = [each_file for each_file in os.scandir(cache_dir) if each_file.name.endswith('.json.gz')]
+    for each_file in sorted(all_files, key=lambda each_file: each_file.stat().st_mtime, reverse=True):
+        total_size += each_file.stat().st_size
+        if time.time() - each_file.stat().st_mtime > max_age * 86400 or total_size > max_size * 1000000:
+            os.remove(each_file.path)
+
+
+################################## Capture and replay ##################################
+# The ACLs gathered from each device (raw output of get_acls) are saved in the capture directory (same format as the cache), these can then be
+# replayed to run the formatting and report without connecting to any devices
+
+# CAPTURE: Saves the ACLs of a device, has no key as a capture is always used
+def capture(directory, fw_type, fw, acl_brief, acl_expanded):
+    save(fw_type, fw, None, acl_brief, acl_expanded, directory)
+
+# CAPTURE_ORDER: Saves the order of the devices (in the input file) so the replayed report is in the same order, is a list of [fw_type, fw]
+def capture_order(directory, devices):
+    with open(os.path.join(directory, 'devices.json'), 'w') as file_content:
+        json.dump(devices, file_content)
+
+# REPLAY: Yields the (fw_type, fw, acl_brief, acl_expanded) of each captured device a device at a time, in the order of the captured run
+def replay(directory):
+    try:
+        with open(os.path.join(directory, 'devices.json')) as file_content:
+            all_files = [cache_file(fw_type, fw, directory) for fw_type, fw in json.load(file_content)]
+    # If the capture run didn't finish there is no order, any devices captured are used
+    except OSError:
+        all_files = sorted(each_file.path for each_file in os.scandir(directory) if each_file.name.endswith('.json.gz'))
+    for each_file in all_files:
+        with gzip.open(each_file, 'rt') as file_content:
+            captured = json.load(file_content)
+        yield captured['fw_type'], captured['fw'], captured['acl_brief'], captured['acl_expanded']
@@ -1,28 +1,72 @@
 #!/usr/bin/env python
 import json
+import time
+import asyncio
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import urllib3
-from ipaddress import ip_network
+from ipaddress import ip_network, ip_address
 from datetime import datetime
+from functools import lru_cache
 import re
+import stats
+from record import Ace
+# aiohttp is only needed by the asyncio API client (async_api = True)
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 urllib3.disable_warnings()
 
 
+######################## Variables to change dependant on environment ########################
+# URL of the managers API, {} is the manager (from the input file)
+api_url = 'https://{}/web_api/'
+# Max number of HTTPS connections kept open (keep-alive) to each manager and how long (seconds) to wait for responses to API calls
+pool_size = 10
+read_timeout = 300
+# Max number of rulebase pages requested at once for a policy, is the load put on the managers API server (shouldn't be more than pool_size).
+# With the asyncio client it is the max number of API calls sent at once to each manager
+page_workers = 4
+# API client, False is the requests client and True the asyncio client (needs aiohttp, also set by --ckp-async) with all managers sharing one
+# event loop. Each manager is rate limited to rate_limit API calls per second (0 is no limit) with bursts of up to rate_burst calls
+async_api = False
+rate_limit = 20
+rate_burst = 10
+# 'ranges' downloads each policy twice (500 rules and 20 expanded rules per call), 'dictionary' downloads it once with the object dictionary
+# and builds the expanded ranges locally from the groups (gathered once per manager), needing a lot less API calls for big rulebases
+collection_mode = 'ranges'
+# Address ranges that are not a single network are split into the fewest networks that cover them ('prefixes') or kept as start-end ('ranges').
+# The conversions are cached (most recently used) as the same objects are in many rules, range_cache is how many are kept
+range_mode = 'prefixes'
+range_cache = 65536
+
+
 ###################################### 1. Login ######################################
 # Initial login to get a Session ID (SID) and handling of errors. Based on the the HTTP responce code generates user error messages
-def login(fw, user, pword):
+def login(fw, user, pword, timeout=10):
+    if async_api == True and aiohttp == None:
+        return (False, "\u26A0\uFE0F  [yellow]WARNING[/yellow] - The asyncio API client needs aiohttp installed (pip install aiohttp) for {}".format(fw))
     try:
-        url = 'https://' + fw + '/web_api/login'
+        if async_api == True:
+            client = AsyncApiClient(fw, timeout)
+        else:
+            client = ApiClient(fw, timeout)
         payload = {'user':user, 'password': pword}
-        request_headers = {'Content-Type' : 'application/json'}
-        res = requests.post(url,data=json.dumps(payload), headers=request_headers, verify=False)
+        res = client.post('login', payload)
+        # The client is only kept if logged in, otherwise its connections are closed
+        if res.status_code != 200:
+            client.close()
 
         # Stops errors by catching any response completely unknown responce not in JSON format as all error messages use it
         try:
             res.json()
-            # If the API call is successful the returns the SID which is used in subsequent requests
+            # If the API call is successful adds the SID to the client which is then used (as the sid) for all subsequent requests
             if res.status_code == 200:
-                return (True, res.json()['sid'])
+                client.headers.update({'X-chkp-sid': res.json()['sid']})
+                return (True, client)
             # Based on the HTTP response from the Checkpoint feeds back custom error messages to the user
             elif res.status_code == 400:
                 print(res.json())
@@ -39,20 +83,140 @@ def login(fw, user, pword):
             error = re.sub(r'<.*?>', '', str(list(res))).replace("b'", "").replace("\\n", " ").replace("[  ", "").replace(".  ']", "")
             return (False, "\u26A0\uFE0F  [yellow]WARNING[/yellow] - {} for {}".format(error, fw))
     # Handles exceptions where the checkpoint is unreachable as wouldn't get a HTTP response status back
-    except requests.exceptions.RequestException as e:
-        return (False, "\u26A0\uFE0F  [yellow]WARNING[/yellow] - {}".format(e))
+    except api_errors as e:
+        client.close()
+        return (False, "\u26A0\uFE0F  [yellow]WARNING[/yellow] - {}".format(str(e) or type(e).__name__))
 
-# Used to close all sessions
+# Used to close all sessions, also closes the connections held open by the client
 def logoff(fw, sid):
     api_call(fw, "logout", {}, sid)
+    sid.close()
+
+################################## API Client ##################################
+# A client per manager wrapping a pooled requests session so all API calls reuse the same keep-alive connections and SID header
+class ApiClient:
+    def __init__(self, fw, timeout=10):
+        self.url = api_url.format(fw)
+        self.timeout = (timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.verify = False
+        self.headers = self.session.headers
+        self.headers.update({'Content-Type' : 'application/json'})
+        self.session.mount(self.url.split('//')[0] + '//', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    # All Checkpoint API calls must be POST, is counted (with the response size) when the run is instrumented (--stats)
+    def post(self, command, json_payload):
+        res = self.session.post(self.url + command, data=json.dumps(json_payload), timeout=self.timeout)
+        stats.count(self, res.content)
+        return res
+
+    def close(self):
+        self.session.close()
+
+################################## Asyncio API Client ##################################
+# All the asyncio API clients share one event loop run in its own thread. Login, layer discovery, pagination and logout are still sync functions
+# (called by main from its worker threads) that run their API calls on this loop and wait for them, so only the API calls are async. The pages
+# of a policy are still sent at once (post_all) and the API calls of all managers share the loop along with each managers limits
+loop = None
+loop_lock = Lock()
+
+def event_loop():
+    global loop
+    with loop_lock:
+        if loop == None:
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+# RUN: Runs a coroutine on the shared event loop and waits for its result
+def run(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result()
+
+# TOKEN_BUCKET: Holds up to burst tokens, refilled at rate tokens per second. Each API call takes a token waiting for one if there are none left
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.last = burst, time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def take(self):
+        if self.rate == 0:
+            return
+        # Calls waiting for a token are queued by the lock so they get them in order
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens, self.last = 1, time.monotonic()
+            self.tokens -= 1
+
+# RESPONSE: The parts of the aiohttp response used by api_call and login (same as a requests response)
+class Response:
+    def __init__(self, status_code, content):
+        self.status_code, self.content = status_code, content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def __iter__(self):
+        return iter([self.content])
+
+# A client per manager with its own aiohttp session (pooled keep-alive connections), concurrency limit (page_workers) and rate limit (rate_limit)
+class AsyncApiClient:
+    def __init__(self, fw, timeout=10):
+        self.url = api_url.format(fw)
+        self.timeout = timeout
+        self.headers = {'Content-Type' : 'application/json'}
+        self.session = None
+
+    # The session, semaphore and token bucket are created on the event loop the first time they are used
+    async def apost(self, command, json_payload):
+        if self.session == None:
+            self.limit = asyncio.Semaphore(page_workers)
+            self.bucket = TokenBucket(rate_limit, rate_burst)
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False, limit=pool_size),
+                                                 timeout=aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=read_timeout))
+        async with self.limit:
+            await self.bucket.take()
+            async with self.session.post(self.url + command, data=json.dumps(json_payload), headers=self.headers) as res:
+                content = await res.read()
+        stats.count(self, content)
+        return Response(res.status, content)
+
+    # All Checkpoint API calls must be POST, post_all sends them all at once (limited by page_workers) returning the responses in payload order
+    def post(self, command, json_payload):
+        return run(self.apost(command, json_payload))
+
+    def post_all(self, command, json_payloads):
+        async def gather():
+            return await asyncio.gather(*[self.apost(command, each_payload) for each_payload in json_payloads])
+        return run(gather())
+
+    def close(self):
+        if self.session != None:
+            run(self.session.close())
+
+# Errors raised by the API clients when the manager can't be reached (or doesn't respond in time)
+api_errors = (requests.exceptions.RequestException, asyncio.TimeoutError) + ((aiohttp.ClientError,) if aiohttp != None else ())
 
 ################################## API Engine ##################################
-# The 'API engine' that runs any cmds fed into it (by other methods) against the Checkpoint manager
+# The 'API engine' that runs any cmds fed into it (by other methods) against the Checkpoint manager. The sid is the ApiClient returned by login
 def api_call(ip_addr, command, json_payload, sid):
-    url = 'https://' + ip_addr + '/web_api/' + command
-    request_headers = {'Content-Type' : 'application/json', 'X-chkp-sid' : sid}
-    # Runs the API call with the supplied payload, must be POST
-    res = requests.post(url,data=json.dumps(json_payload), headers=request_headers, verify=False)
+    # Runs the API call with the supplied payload over the clients pooled connections
+    return api_result(ip_addr, command, json_payload, sid.post(command, json_payload))
+
+# API_CALLS: Runs the command with each of the payloads returning the results in payload order. The asyncio client sends them all at once
+# (limited to page_workers at a time by the client), with the requests client up to page_workers are run at once in threads
+def api_calls(ip_addr, command, json_payloads, sid):
+    if isinstance(sid, AsyncApiClient):
+        return [api_result(ip_addr, command, each_payload, res) for each_payload, res in zip(json_payloads, sid.post_all(command, json_payloads))]
+    # map() returns the results in payload order whatever order they are received in, so the rules stay in order
+    with ThreadPoolExecutor(max_workers=page_workers) as executor:
+        return list(executor.map(lambda each_payload: api_call(ip_addr, command, each_payload, sid), json_payloads))
+
+def api_result(ip_addr, command, json_payload, res):
     # If a command fails tells the user and stops the script
     if res.status_code != 200:
         print('\n!!! ERROR - {} - {}'.format(res.json()["code"], res.json()["message"]))
@@ -72,33 +236,84 @@ def get_acls(dev, sid):
         policy_name.append(policy['name'])
 
     # 2b. Get the total number of rules as can only get in one API call either 20 when expanded (show-as-ranges) or 500 non-expanded so need to use offsets
-    for policy in policy_name:
-        output = api_call(dev, "show-access-rulebase", {"limit" : 0, "name" : policy}, sid)
+    all_totals = api_calls(dev, "show-access-rulebase", [{"limit" : 0, "name" : policy} for policy in policy_name], sid)
+    for policy, output in zip(policy_name, all_totals):
         # Create a dict of {name: policy_name, num_rules: total_number_rules_in_policy)
         policy_offset.append(dict(name=policy, num_rules=output['total']))
 
-    # 2c. ACL: Using offset tuple get list of all the rules within each policy (does not expand groups)
+    # 2c. DICTIONARY: Single download of each policy with objects as UIDs, acl_expanded is the groups and their members (used to build the ranges)
+    if collection_mode == 'dictionary':
+        payloads = []
+        for policy in policy_offset:
+            payload = {"name": policy['name'], "show-hits": True, "use-object-dictionary": True}
+            payloads.extend(page_payloads(payload, policy['num_rules'], 500))
+        return api_calls(dev, "show-access-rulebase", payloads, sid), get_groups(dev, sid)
+
+    # 2c. ACL: Using offset tuple get list of all the rules within each policy (does not expand groups). The pages of all policies are got together
+    payloads = []
     for policy in policy_offset:
-        # (Start rule number, total number rules, amount to offset the start by each iteration)
-        for offset in range(0, policy['num_rules'], 500):
-        # for offset in range(1,4,3):
-            # Limit is the max number of rules returned and offset the number of rules to skip. To get just rules 11 to 25 use range(10,25,15) and "limit": 15
-            payload = {"offset": offset, "limit": 500, "name": policy['name'], "show-hits": True, "use-object-dictionary": False}
-            # payload = {"offset": offset, "limit": 15, "name": policy['name'], "show-hits": True, "use-object-dictionary": False}
-            output = api_call(dev , "show-access-rulebase", payload, sid)
-            acl_brief.append(output)
+        payload = {"name": policy['name'], "show-hits": True, "use-object-dictionary": False}
+        payloads.extend(page_payloads(payload, policy['num_rules'], 500))
+    acl_brief = api_calls(dev, "show-access-rulebase", payloads, sid)
 
     # 2d. ACL_EXP: Using offset tuple get list of all the rules within each policy, with all groups and objects expanded as ranges
+    payloads = []
     for policy in policy_offset:
-        # for offset in range(1,4,3):
-        for offset in range(0, policy['num_rules'], 20):
-            payload = {"offset": offset, "limit": 20, "name": policy['name'], "show-as-ranges": True, "show-hits": True,  "use-object-dictionary": False}
-            # payload = {"offset": offset, "limit": 15, "name": policy['name'], "show-as-ranges": True, "show-hits": True,  "use-object-dictionary": False}
-            output = api_call(dev , "show-access-rulebase", payload, sid)
-            acl_expanded.append(output)
+        payload = {"name": policy['name'], "show-as-ranges": True, "show-hits": True,  "use-object-dictionary": False}
+        payloads.extend(page_payloads(payload, policy['num_rules'], 20))
+    acl_expanded = api_calls(dev, "show-access-rulebase", payloads, sid)
 
     return acl_brief, acl_expanded
 
+# PAGE_PAYLOADS: Limit is the max number of items returned and offset the number of items to skip. To get just rules 11 to 25 use offset 10 and "limit": 15
+def page_payloads(payload, total, limit, start=0):
+    return [dict(payload, offset=offset, limit=limit) for offset in range(start, total, limit)]
+
+# GET_PAGES: As all offsets are known from the total number of items the pages are requested in parallel (up to page_workers at once)
+def get_pages(dev, sid, command, payload, total, limit, start=0):
+    return api_calls(dev, command, page_payloads(payload, total, limit, start), sid)
+
+# GET_ALL_PAGES: When the total is not already known gets the first page (has the total in it) and then the rest of the pages in parallel
+def get_all_pages(dev, sid, command, payload, limit):
+    first_page = api_call(dev , command, dict(payload, offset=0, limit=limit), sid)
+    return [first_page] + get_pages(dev, sid, command, payload, first_page['total'], limit, limit)
+
+# GET_GROUPS: Gets all network and service groups (with members) once per manager in the format {group_uid: group_object}
+def get_groups(dev, sid):
+    groups = {}
+    for command in ["show-groups", "show-service-groups"]:
+        total = api_call(dev, command, {"limit": 1}, sid)['total']
+        for page in get_pages(dev, sid, command, {"details-level": "full"}, total, 500):
+            for group in page.get('objects', []):
+                groups[group['uid']] = group
+    return groups
+
+# CACHE_KEY: Last publish time of the manager and last modify time of each policy (layer), if none have changed the cached ACLs can be used.
+# Has the collection mode as the cached ACLs are in a different format for each
+def cache_key(dev, sid):
+    published = api_call(dev, "show-last-published-session", {}, sid)
+    all_policies = api_call(dev, "show-access-layers", {"details-level": "full"}, sid)
+    return dict(mode=collection_mode, published=published['publish-time']['posix'],
+                policies={policy['name']: policy['meta-info']['last-modify-time']['posix'] for policy in all_policies['access-layers']})
+
+# REFRESH_HITS: Only gets the rules hits (details-level uid so no objects, 500 rules per call) and adds them to the cached rules by policy and rule UID
+def refresh_hits(dev, sid, acl_brief, acl_expanded):
+    hits = {}
+    all_policies = api_call(dev, "show-access-layers", {}, sid)
+    for policy in all_policies['access-layers']:
+        payload = {"name": policy['name'], "show-hits": True, "details-level": "uid", "use-object-dictionary": False}
+        for page in get_all_pages(dev, sid, "show-access-rulebase", payload, 500):
+            for rule in get_rules(page):
+                hits[(policy['name'], rule['uid'])] = rule['hits']
+    # If the policies or rules are not the same as those cached the policy has changed so the cached ACLs cant be used
+    if set(hits) != {(page['name'], rule['uid']) for page in acl_brief for rule in get_rules(page)}:
+        return None
+    # In dictionary mode there is only one set of pages (acl_expanded is the groups)
+    for page in (acl_brief if isinstance(acl_expanded, dict) else acl_brief + acl_expanded):
+        for rule in get_rules(page):
+            rule['hits'] = hits[(page['name'], rule['uid'])]
+    return acl_brief, acl_expanded
+
 
 ################################## DRY filters run by the main Sanitize method (format_acl) ##################################
 
@@ -147,34 +362,25 @@ def categorize_obj(object):
         normalized.append('unknown_' + obj['name'])
     return normalized
 
-# NORM_IP: Converts source and destination Address ranges into usable format (host, network or range).
+# NORM_IP: Converts source and destination Address ranges (IPv4 and IPv6) into usable format (host, network or range).
 def normalise_ip(ip_element):
     addr_list = []
-    # If is no IPv4 addresses or address objects adds a buffer object
-    if len(ip_element['ipv4']) == 0 and len(ip_element['others']) == 0:
+    addrs = ip_element['ipv4'] + ip_element.get('ipv6', [])
+    # If is no IP addresses or address objects adds a buffer object
+    if len(addrs) == 0 and len(ip_element['others']) == 0:
         addr_list.append('none')
-    # If is IPv4 addresses converts ranges to prefixes
-    elif len(ip_element['ipv4']) != 0:
-        for addr in ip_element['ipv4']:
-            # If start/end ranges are the same create a host entry
-            if addr['start'] == addr['end']:
-                addr_list.append(addr['start'] + '/32')
-            # If its address range 0.0.0.0 to 255.255.255.255 represents 'any' in the rulebase
-            elif addr['start'] == '0.0.0.0' and addr['end'] == '255.255.255.255':
-                addr_list.append('any')
+    # If is IP addresses converts ranges to prefixes
+    elif len(addrs) != 0:
+        for addr in addrs:
+            prefixes = range_prefixes(addr['start'], addr['end'])
+            # Any (the whole IPv4 and IPv6 ranges) is only added once
+            if prefixes == ('any',) and 'any' in addr_list:
+                continue
+            # If the range is not a single network it is kept as start-end addresses when range_mode is 'ranges'
+            if len(prefixes) > 1 and range_mode == 'ranges':
+                addr_list.append(addr['start'] + '-' + addr['end'])
             else:
-            # If start/end range are a valid network address create a network entry
-                try:
-                    # Split IPs into octets and subtract creating new list that is the wildcard mask
-                    wildcard = []
-                    for start, end in zip(addr['start'].split('.'), addr['end'].split('.')):
-                        wildcard.append(int(end) - int(start))
-                    # As is a list of numbers map() converts each item to a string so they can be joined
-                    wildcard = '.'.join(map(str, wildcard))
-                    addr_list.append(str(ip_network(addr['start'] + '/' + wildcard)))
-                # If is not a valid network creates a range just adds start-end addresses
-                except ValueError:
-                        addr_list.append(addr['start'] + '-' + addr['end'])
+                addr_list.extend(prefixes)
     # None IPs, so UID of an object (normally Internet)
     elif len(ip_element['others']) != 0:
         addr_list.extend(categorize_obj(ip_element['others']))
@@ -183,6 +389,109 @@ def normalise_ip(ip_element):
         addr_list.append('none')
     return addr_list
 
+# RANGE_PREFIXES: Converts a start/end address range into the fewest networks (prefixes) that cover it, a host if start and end are the same and
+# 'any' if is all addresses. Works on the addresses as integers so is the same for IPv4 and IPv6, invalid ranges are returned as start-end
+@lru_cache(maxsize=range_cache)
+def range_prefixes(start, end):
+    try:
+        first, last = ip_address(start), ip_address(end)
+    except ValueError:
+        return (start + '-' + end,)
+    bits, first_int, last_int = first.max_prefixlen, int(first), int(last)
+    if first.version != last.version or first_int > last_int:
+        return (start + '-' + end,)
+    elif first_int == 0 and last_int == 2 ** bits - 1:
+        return ('any',)
+    prefixes = []
+    while first_int <= last_int:
+        # Biggest network that starts at the address (is aligned on its size) and does not go past the end of the range
+        size = min((first_int & -first_int).bit_length() - 1 if first_int != 0 else bits, (last_int - first_int + 1).bit_length() - 1)
+        prefixes.append('{}/{}'.format(first.__class__(first_int), bits - size))
+        first_int += 1 << size
+    return tuple(prefixes)
+
+# RESOLVE: With the object dictionary objects (and group members) are UIDs, swaps them for the full object. Unknown UIDs are kept as the name
+def resolve(obj, objects):
+    if isinstance(obj, str):
+        return objects.get(obj, dict(uid=obj, name=obj, type='unknown'))
+    return objects.get(obj['uid'], obj)
+
+# ADDR_RANGES: Builds the source or destination ranges (as show-as-ranges would) by expanding groups down to host, network and range objects
+def addr_ranges(objs, negated, objects):
+    ranges = {'ipv4': [], 'ipv6': [], 'others': [], 'excluded-others': []}
+    # Negated fields are blank in show-as-ranges, are filled in from the non-expanded rule by format_acl
+    if negated == True:
+        objs = []
+    for obj in objs:
+        if obj['type'] == 'group':
+            for key, member_ranges in addr_ranges([resolve(member, objects) for member in obj.get('members', [])], False, objects).items():
+                ranges[key].extend(member_ranges)
+        elif obj['type'] == 'CpmiAnyObject':
+            ranges['ipv4'].append(dict(start='0.0.0.0', end='255.255.255.255'))
+            ranges['ipv6'].append(dict(start='0:0:0:0:0:0:0:0', end='ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff'))
+        elif obj['type'] == 'network':
+            for ver, subnet, mask in [('ipv4', 'subnet4', 'mask-length4'), ('ipv6', 'subnet6', 'mask-length6')]:
+                if obj.get(subnet) != None:
+                    network = ip_network('{}/{}'.format(obj[subnet], obj[mask]))
+                    ranges[ver].append(dict(start=str(network[0]), end=str(network[-1])))
+        elif obj['type'] == 'address-range':
+            for ver in ['ipv4', 'ipv6']:
+                if obj.get(ver + '-address-first') != None:
+                    ranges[ver].append(dict(start=obj[ver + '-address-first'], end=obj[ver + '-address-last']))
+        # Hosts and Checkpoint devices (gateways, managers, etc) that have an IP address
+        elif obj.get('ipv4-address') != None or obj.get('ipv6-address') != None:
+            for ver in ['ipv4', 'ipv6']:
+                if obj.get(ver + '-address') != None:
+                    ranges[ver].append(dict(start=obj[ver + '-address'], end=obj[ver + '-address']))
+        # Anything that is not an address (Internet, dns-domain, access-role, etc)
+        else:
+            ranges['others'].append(obj)
+    # Removes duplicate ranges (same object in several groups) whilst keeping the order
+    for ver in ['ipv4', 'ipv6']:
+        ranges[ver] = list({(addr['start'], addr['end']): addr for addr in ranges[ver]}.values())
+    return ranges
+
+# SVC_RANGES: Builds the service ranges (as show-as-ranges would) by expanding service groups, negated services are added as excluded
+def svc_ranges(objs, negated, objects):
+    ranges = {'tcp': [], 'udp': [], 'others': [], 'excluded-others': []}
+    for obj in objs:
+        if obj['type'] == 'service-group':
+            member_ranges = svc_ranges([resolve(member, objects) for member in obj.get('members', [])], negated, objects)
+            for key in ranges:
+                ranges[key].extend(member_ranges[key])
+        elif obj['type'] == 'CpmiAnyObject':
+            ranges['tcp'].append(dict(start='0', end='65535'))
+            ranges['udp'].append(dict(start='0', end='65535'))
+        elif negated == True:
+            ranges['excluded-others'].append(obj)
+        else:
+            ranges['others'].append(obj)
+    return ranges
+
+# DICTIONARY: Changes the UIDs in the single download rulebase (use-object-dictionary) back to objects and adds the ranges built from them.
+# The same pages are then used for the ACL (source, destination, service) and the expanded ACL (source-ranges, destination-ranges, service-ranges)
+def expand_dictionary(acl_brief, groups):
+    objects = {}
+    for policy in acl_brief:
+        for obj in policy.get('objects-dictionary', []):
+            objects[obj['uid']] = obj
+    objects.update(groups)
+    for policy in acl_brief:
+        for rule in policy['rulebase']:
+            # If it has access-sections then is another layer of nested rulebase
+            for rule in (rule.get('rulebase', []) if rule['type'] == 'access-section' else [rule]):
+                for field in ['source', 'destination', 'service']:
+                    rule[field] = [resolve(obj, objects) for obj in rule[field]]
+                # Action is copied as format_acl renames it for inline policies and the same action object is shared by all rules
+                rule['action'] = dict(resolve(rule['action'], objects))
+                if rule.get('inline-layer') != None:
+                    rule['inline-layer'] = resolve(rule['inline-layer'], objects)
+                rule['source-ranges'] = addr_ranges(rule['source'], rule['source-negate'], objects)
+                rule['destination-ranges'] = addr_ranges(rule['destination'], rule['destination-negate'], objects)
+                rule['service-ranges'] = svc_ranges(rule['service'], rule['service-negate'], objects)
+    # Separate lists of the same pages as format_acl releases each page from its list once it has been read
+    return acl_brief, list(acl_brief)
+
 # NEGATE: Adds NOT to any source, destination, or services that are negated
 def negate(ace):
     temp_svc, temp_dst, temp_src = ([] for i in range(3))
@@ -206,129 +515,131 @@ def negate(ace):
 
 
 # ################################## 3. Sanitize the data - Create ACL structured data ##################################
-# 3. ENGINE: Feeds ACL data and uses functions to produce standardized data model of ACL and expanded ACL
-def format_acl(fw, acl_brief, acl_expanded):
-    acl, acl_exp, final_acl = ([] for i in range(3))
-    #3a. Loops through each section and set of 500 rules (non-expanded ACEs) to create new list of lists of only the fields required
+# RULES: Yields the rules of a rulebase page, if it has access-sections then is another layer of nested rulebase
+def get_rules(policy):
+    for rule in policy['rulebase']:
+        if rule['type'] == 'access-section':
+            for each_rule in rule['rulebase']:
+                yield each_rule
+        # If it does not have an access-sections no more rulebase nesting
+        elif rule['type'] == 'access-rule':
+            yield rule
+
+# 3a. ACE: Creates a list of only the fields required from the rule, the (non-expanded) ACL has the negate fields and the expanded ACL the ranges
+def create_ace(policy_name, rule, expanded):
+    # For nested inline policies replaces action with name of the nested policy (not changed in the rule as dictionary mode shares it)
+    if rule.get('inline-layer') != None:
+        action = 'POLICY_' + rule['inline-layer']['name']
+    else:
+        action = rule['action']['name']
+    if expanded == False:
+        return [policy_name, rule['rule-number'], action, 'protocol', rule['source'], 'any_port', rule['destination'], rule['service'],
+                rule['hits']['value'], rule['hits'].get('last-date'), rule['enabled'], rule['source-negate'], rule['destination-negate'],
+                rule['service-negate']]
+    else:
+        return [policy_name, rule['rule-number'], action, 'protocol', rule['source-ranges'], 'any_port', rule['destination-ranges'],
+                rule['service-ranges'], rule['hits']['value'], rule['hits'].get('last-date'), rule['enabled']]
+
+# Normalises the data of an ACE (categorize object names, simplify ranges, timestamp, etc)
+def normalise_ace(ace):
+    # 3b.ACL: For source, destination and service objects add an identifier (hst, net, grp, etc)
+    if len(ace) == 14:
+        ace[4] = categorize_obj(ace[4])
+        ace[6] = categorize_obj(ace[6])
+        dst_svc = categorize_obj(ace[7])
+        # Object 'CpmiAnyObject' can be used by other things so have to add protocol on here
+        if dst_svc == ['Any']:
+            ace[7] = ['any_any']
+        else:
+            ace[7] = dst_svc
+
+    # 3c. ACL_EXP: For address ranges converts source and destination ranges into host or network
+    else:
+        ace[4] = normalise_ip(ace[4])
+        ace[6] = normalise_ip(ace[6])
+        # If has TCP and UDP range is represented as 'ANY' in the rulebase
+        dst_svc = []
+        if len(ace[7]['tcp']) != 0 and len(ace[7]['udp']) != 0:
+            dst_svc.append('any_any')
+        # Anything else adds identifier to ICMP, protocol, application or group objects
+        if len(ace[7]['others']) != 0:
+            dst_svc.extend(categorize_obj(ace[7]['others']))
+        # For excludes source. Needs to go through negate function later so adds negate boolean to ace (element 12 to 14)
+        elif len(ace[7]['excluded-others']) != 0:
+            dst_svc.extend(categorize_obj(ace[7]['excluded-others']))
+            ace.extend([False, False, True])
+        ace[7] = dst_svc
+
+    #3d. ACE: Only ACE has the negate field, adds NOT to any source, destination, or services that are negated
+    if len(ace) == 14:
+        negate(ace)
+
+    # 3e. From unixtime (posix) gets human readable time and splits date and time into separate elements
+    if ace[9] == None:
+        ace[9] = ''
+        ace.insert(10, '')
+    else:
+        unix_time = str(ace[9]['posix'])[:-3]
+        human_time = datetime.fromtimestamp(int(unix_time)).strftime('%Y-%m-%d %H:%M:%S').split(' ')
+        ace[9] = human_time[0]
+        ace.insert(10, human_time[1])
+    # 3f. Change state to 'inactive' or blank
+    if ace[11] == False:
+        ace[11] = 'Inactive'
+    else:
+        ace[11] = ''
+    return ace
+
+# 3g. "show-as-ranges" with negated dst or src fields are blank, therefore need to get those values from the ACL. Only the negated rules are kept
+# in the format {rule_position: [src, dst]}, the position being the order of the rule in the rulebase (is the same in both sets of pages)
+def get_negated(acl_brief):
+    negated = {}
+    rule_pos = 0
     for policy in acl_brief:
-        for rule in policy['rulebase']:
-            # If it has access-sections then is another layer of nested rulebase
-            if rule['type'] == 'access-section':
-                for rule in rule['rulebase']:
-                    # For nested inline policies replaces action with name of nested policy
-                    if rule.get('inline-layer') != None:
-                        rule['action']['name'] = 'POLICY_' + rule['inline-layer']['name']
-                    acl.append([policy['name'], rule['rule-number'], rule['action']['name'], 'protocol', rule['source'], 'any_port',
-                                rule['destination'], rule['service'], rule['hits']['value'], rule['hits'].get('last-date'),
-                                rule['enabled'], rule['source-negate'], rule['destination-negate'], rule['service-negate']])
-            # If it does not have an access-sections no more rulebase nesting
-            elif rule['type'] == 'access-rule':
-                # For nested inline policies replaces action with name of nested policy
-                if rule.get('inline-layer') != None:
-                    rule['action']['name'] = 'POLICY_' + rule['inline-layer']['name']
-                acl.append([policy['name'], rule['rule-number'], rule['action']['name'], 'protocol', rule['source'], 'any_port',
-                            rule['destination'], rule['service'], rule['hits']['value'], rule['hits'].get('last-date'),
-                            rule['enabled'], rule['source-negate'], rule['destination-negate'], rule['service-negate']])
+        for rule in get_rules(policy):
+            if rule['source-negate'] == True or rule['destination-negate'] == True:
+                ace = normalise_ace(create_ace(policy['name'], rule, False))
+                negated[rule_pos] = [ace[4] if ace[12] == True else None, ace[6] if ace[13] == True else None]
+            rule_pos += 1
+    return negated
 
-    #3b. Loops through each section and set of 20 rules (expanded ACEs) to create new list of lists of only the fields required
-    for policy in acl_expanded:
-        for rule in policy['rulebase']:
-            # If it has access-sections then is another layer of nested rulebase
-            if rule['type'] == 'access-section':
-                for rule in rule['rulebase']:
-                    # For nested inline policies replaces action with name of the nested policy
-                    if rule.get('inline-layer') != None:
-                        rule['action']['name'] = 'POLICY_' + rule['inline-layer']['name']
-                    acl_exp.append([policy['name'], rule['rule-number'], rule['action']['name'], 'protocol', rule['source-ranges'],
-                                    'any_port', rule['destination-ranges'], rule['service-ranges'], rule['hits']['value'],
-                                    rule['hits'].get('last-date'), rule['enabled']])
-            # If it does not have an access-sections no more rulebase nesting
-            elif rule['type'] == 'access-rule':
-            # For nested inline policies replaces action with name of the nested policy
-                if rule.get('inline-layer') != None:
-                    rule['action']['name'] = 'POLICY_' + rule['inline-layer']['name']
-                acl_exp.append([policy['name'], rule['rule-number'], rule['action']['name'], 'protocol', rule['source-ranges'],
-                                'any_port', rule['destination-ranges'], rule['service-ranges'], rule['hits']['value'],
-                                rule['hits'].get('last-date'), rule['enabled']])
-
-    # Loops though both rulebases to normalise the data (categorize object names, simplify ranges, timestamp, etc)
-    for acl_item in [acl, acl_exp]:
-        for ace in acl_item:
-
-            # 3c.ACL: For source, destination and service objects add an identifier (hst, net, grp, etc)
-            if len(ace) == 14:
-                ace[4] = categorize_obj(ace[4])
-                ace[6] = categorize_obj(ace[6])
-                dst_svc = categorize_obj(ace[7])
-                # Object 'CpmiAnyObject' can be used by other things so have to add protocol on here
-                if dst_svc == ['Any']:
-                    ace[7] = ['any_any']
+# 3h. CREATE ACE: Yields a separate ACE record for each unique source/destination/service of the rule
+def expand_ace(ace):
+    # Loops through source, destination and service lists and spliting out into all variations
+    for src in ace[4]:
+        for dst in ace[6]:
+            for each_prot_svc in ace[7]:
+                # Splits the dst_svc into protocol and service
+                prot_svc = each_prot_svc.split('_')
+                # Needed incase object names have underscore in them (_) to join rest of object name back together
+                if len(prot_svc) == 2:
+                    svc = prot_svc[1]
                 else:
-                    ace[7] = dst_svc
+                    svc = '_'.join(prot_svc[1:])
+                yield Ace(ace[0], ace[1], ace[2], prot_svc[0], src, 'any_port', dst, svc, ace[8], ace[9], ace[10], ace[11])
 
-            # 3d. ACL_EXP: For address ranges converts source and destination ranges into host or network
-            else:
-                ace[4] = normalise_ip(ace[4])
-                ace[6] = normalise_ip(ace[6])
-                # If has TCP and UDP range is represented as 'ANY' in the rulebase
-                dst_svc = []
-                temp_svc = []
-                if len(ace[7]['tcp']) != 0 and len(ace[7]['udp']) != 0:
-                    dst_svc.append('any_any')
-                # Anything else adds identifier to ICMP, protocol, application or group objects
-                if len(ace[7]['others']) != 0:
-                    dst_svc.extend(categorize_obj(ace[7]['others']))
-                # For excludes source. Needs to go through negate function later so adds negate boolean to ace (element 12 to 14)
-                elif len(ace[7]['excluded-others']) != 0:
-                    dst_svc.extend(categorize_obj(ace[7]['excluded-others']))
-                    ace.extend([False, False, True])
-                ace[7] = dst_svc
-
-            #3e. ACE: Only ACE has the negate field, adds NOT to any source, destination, or services that are negated
-            if len(ace) == 14:
-                negate(ace)
-
-            # 3f. From unixtime (posix) gets human readable time and splits date and time into separate elements
-            if ace[9] == None:
-                ace[9] = ''
-                ace.insert(10, '')
-            else:
-                unix_time = str(ace[9]['posix'])[:-3]
-                human_time = datetime.fromtimestamp(int(unix_time)).strftime('%Y-%m-%d %H:%M:%S').split(' ')
-                ace[9] = human_time[0]
-                ace.insert(10, human_time[1])
-            # 3g. Change state to 'inactive' or blank
-            if ace[11] == False:
-                ace[11] = 'Inactive'
-            else:
-                ace[11] = ''
-
-    # # 3h. "show-as-ranges" with negated dst or src fields are blank, therefore need to get those values from acl list
-    for rule, rule_exp in zip(acl,acl_exp):
-        # tmp_rule = []
-        if rule[12] == True:
-            rule_exp[4] = rule[4]
-        if rule[13] == True:
-            rule_exp[6] = rule[6]
-
-    # CREATE ACE: Creates a separate ace entry for each unique source/destination rule before creating ACL and adding it to the final_acl list
-    for acl_item in [acl, acl_exp]:
-        temp_acl = []                # Has to be here so is cleared at each iteration
-        for ace in acl_item:
-            # Loops through source, destination  and service lists and spliting out into all variations
-            for src in ace[4]:
-                for dst in ace[6]:
-                    for each_prot_svc in ace[7]:
-                        # Splits the dst_svc into protocol and service
-                        prot_svc = each_prot_svc.split('_')
-                        # Needed incase object names have underscore in them (_) to join rest of object name back together
-                        if len(prot_svc) == 2:
-                            svc = prot_svc[1]
-                        else:
-                            svc = '_'.join(prot_svc[1:])
-                        temp_acl.append([ace[0], ace[1], ace[2], prot_svc[0], src, 'any_port', dst, svc, ace[8], ace[9], ace[10], ace[11]])
-        final_acl.append(temp_acl)
-
-    # OUTPUT: Returns a dictionary of {device_ip_acl: non_expanded_acl, device_ip_exp_acl: expanded_acl} with every line of each being in the format:
+# ACL_ROWS: Yields the ACL (or expanded ACL) rows a rule at a time. Each page is removed from the list once read so the raw API output is
+# released as the rows are written, memory is only needed for the rule currently being expanded rather than the whole rulebase
+def acl_rows(acl_pages, expanded, negated):
+    rule_pos = 0
+    while len(acl_pages) != 0:
+        policy = acl_pages.pop(0)
+        for rule in get_rules(policy):
+            ace = normalise_ace(create_ace(policy['name'], rule, expanded))
+            if expanded == True and negated.get(rule_pos) != None:
+                ace[4] = negated[rule_pos][0] or ace[4]
+                ace[6] = negated[rule_pos][1] or ace[6]
+            rule_pos += 1
+            yield from expand_ace(ace)
+
+# 3. ENGINE: Feeds ACL data and uses functions to produce standardized data model of ACL and expanded ACL
+def format_acl(fw, acl_brief, acl_expanded):
+    # If the policy was got in a single download (collection_mode 'dictionary') acl_expanded is the groups, creates both page formats from it
+    if isinstance(acl_expanded, dict):
+        acl_brief, acl_expanded = expand_dictionary(acl_brief, acl_expanded)
+    negated = get_negated(acl_brief)
+
+    # OUTPUT: Returns a dictionary of {device_ip_acl: non_expanded_acl, device_ip_exp_acl: expanded_acl}. Both are generators (the rows are only
+    # created as they are read, so can only be read once) with every row of each being an ACE record (record.Ace) with the fields:
     # [name, num, permit/deny, protocol, src_ip/pfx, src_port, dst_ip/pfx, dst_port, hitcnt, last_hit_date, last_hit_time, state]
-    return {fw + '_acl': final_acl[0], fw + '_exp_acl': final_acl[1]}
+    return {fw + '_acl': acl_rows(acl_brief, False, negated), fw + '_exp_acl': acl_rows(acl_expanded, True, negated)}
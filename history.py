@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+import csv
+import sqlite3
+from datetime import datetime, timedelta
+
+
+######################## Variables to change dependant on environment ########################
+# Number of rows inserted at a time (one executemany and transaction), is how many rows are held in memory waiting to be inserted
+batch_rows = 5000
+# Number of rules shown by the history subcommand, all of them are saved to the CSV file
+print_rows = 50
+# Header names of the stale and deltas files
+stale_header = ['Device', 'Policy/ACL Name', 'Line Number', 'Access', 'Hit Count', 'Unchanged Since', 'Runs']
+deltas_header = ['Device', 'Policy/ACL Name', 'Line Number', 'Access', 'Previous Hit Count', 'Hit Count', 'Change']
+
+
+################################## History store ##################################
+# Optional (--history) SQLite database holding the rows (ACL and expanded ACL) of every run along with the run date, so the hit counts can
+# be compared across runs with indexed SQL. Rows are inserted as they are read (written to the report) in batches of batch_rows
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, run_date TEXT NOT NULL, report TEXT);
+CREATE TABLE IF NOT EXISTS aces (run_id INTEGER NOT NULL REFERENCES runs (run_id), device TEXT NOT NULL, expanded INTEGER NOT NULL,
+                                 acl_name TEXT NOT NULL, num INTEGER NOT NULL, action TEXT, protocol TEXT, src TEXT, src_port TEXT, dst TEXT,
+                                 dst_port TEXT, hitcnt INTEGER, last_hit_date TEXT, last_hit_time TEXT, state TEXT);
+CREATE INDEX IF NOT EXISTS runs_date ON runs (run_date);
+CREATE INDEX IF NOT EXISTS aces_rule ON aces (device, acl_name, num, run_id);
+CREATE INDEX IF NOT EXISTS aces_run ON aces (run_id, expanded);
+'''
+INSERT = 'INSERT INTO aces VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+# CONNECT: Opens (creating if it doesn't exist) the history database
+def connect(filename):
+    store = sqlite3.connect(filename)
+    store.executescript(SCHEMA)
+    return store
+
+# SAVE: Adds a run (run_date defaults to now) and returns the ACL with each sheet wrapped so its rows are inserted as they are read
+def save(store, report, acl, run_date=None):
+    with store:
+        run_id = store.execute('INSERT INTO runs (run_date, report) VALUES (?, ?)',
+                               ((run_date or datetime.now()).isoformat(timespec='seconds'), report)).lastrowid
+    saved = {}
+    for sheet, rows in acl.items():
+        # Sheets are named device_acl or device_exp_acl
+        if sheet.endswith('_exp_acl'):
+            saved[sheet] = sheet_rows(store, run_id, sheet[:-len('_exp_acl')], 1, rows)
+        else:
+            saved[sheet] = sheet_rows(store, run_id, sheet[:-len('_acl')], 0, rows)
+    return saved
+
+def sheet_rows(store, run_id, device, expanded, rows):
+    batch = []
+    for ace in rows:
+        batch.append((run_id, device, expanded, ace[0], int(ace[1]), ace[2], ace[3], ace[4], ace[5], ace[6], ace[7], int(ace[8]), ace[9],
+                      ace[10], ace[11]))
+        if len(batch) == batch_rows:
+            with store:
+                store.executemany(INSERT, batch)
+            batch = []
+        yield ace
+    with store:
+        store.executemany(INSERT, batch)
+
+# RUNS: The run IDs of the last num_runs runs (all if None) that are since the date, newest first
+def last_runs(store, since=None, num_runs=None):
+    return [run_id for run_id, in store.execute('SELECT run_id FROM runs WHERE run_date >= ? ORDER BY run_date DESC, run_id DESC LIMIT ?',
+                                                 (since or '', num_runs or -1))]
+
+# STALE: Rules (of the ACL) in all the runs of the last days whose hit count has not changed, returned as [device, acl_name, num, action,
+# hitcnt, date of the first run compared, number of runs compared]. Is compared from the last run on or before the start of the days (if
+# there is one) so the rule has not been hit for at least that long, rules added since then are not stale. num_runs limits it to the last
+# number of runs
+def stale_rules(store, days=90, num_runs=None):
+    since = (datetime.now() - timedelta(days=days)).isoformat(timespec='seconds')
+    baseline = store.execute('SELECT MAX(run_date) FROM runs WHERE run_date <= ?', (since,)).fetchone()[0]
+    run_ids = last_runs(store, baseline or since, num_runs)
+    if len(run_ids) == 0:
+        return []
+    query = ('SELECT device, acl_name, num, MAX(action), MAX(hitcnt), MIN(run_date), COUNT(DISTINCT run_id) FROM aces JOIN runs USING (run_id) '
+             'WHERE expanded = 0 AND run_id IN ({}) GROUP BY device, acl_name, num HAVING MAX(hitcnt) = MIN(hitcnt) AND '
+             'COUNT(DISTINCT run_id) = ? ORDER BY device, acl_name, num').format(', '.join('?' * len(run_ids)))
+    return [list(row) for row in store.execute(query, run_ids + [len(run_ids)])]
+
+# DELTAS: Change in the hit count of each rule (of the ACL) between the last two runs, returned as [device, acl_name, num, action, old hitcnt,
+# new hitcnt, delta]. Rules only in one of the runs have None for the other run and the delta
+def hit_deltas(store):
+    run_ids = last_runs(store, num_runs=2)
+    if len(run_ids) != 2:
+        return []
+    query = ('SELECT device, acl_name, num, MAX(CASE WHEN run_id = :new THEN action END), MAX(CASE WHEN run_id = :old THEN hitcnt END), '
+             'MAX(CASE WHEN run_id = :new THEN hitcnt END) FROM aces WHERE expanded = 0 AND run_id IN (:old, :new) '
+             'GROUP BY device, acl_name, num ORDER BY device, acl_name, num')
+    deltas = []
+    for device, acl_name, num, action, old, new in store.execute(query, dict(old=run_ids[1], new=run_ids[0])):
+        deltas.append([device, acl_name, num, action, old, new, new - old if old != None and new != None else None])
+    return deltas
+
+# WRITE: Saves the stale rules or hit count deltas as a CSV file with a header row
+def write_rules(filename, header, rules):
+    with open(filename, 'w', newline='') as file_content:
+        writer = csv.writer(file_content)
+        writer.writerow(header)
+        writer.writerows(rules)
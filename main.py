@@ -2,18 +2,43 @@
 
 import argparse
 from getpass import getpass
+from ipaddress import ip_address
 import os
+import time
 from datetime import date
 from collections import defaultdict
+from itertools import islice
+import glob
+import csv
+import json
+import sqlite3
+import atexit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from threading import BoundedSemaphore, Lock
+from contextlib import nullcontext
 import yaml
 from rich.console import Console
 from rich.theme import Theme
 from rich.progress import track
+from rich.table import Table
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, colors, PatternFill, Alignment
 from openpyxl.styles.differential import DifferentialStyle
 from openpyxl.formatting.rule import Rule
+import cache
+import stats
+import query
+import analysis
+import history
+from record import Ace
+# Parquet is only needed for that report format (-f parquet) so is optional, the format is only offered if it is installed
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 ######################## Variables to change dependant on environment ########################
@@ -21,9 +46,24 @@ from openpyxl.formatting.rule import Rule
 directory = os.path.dirname(__file__)
 report_name = 'ACLreport_' + date.today().strftime('%Y%m%d')
 input_file = 'input.yml'
+# Number of devices ACLs are gathered from at the same time of each FW type (can be overridden per FW type at runtime) and across all FW types
+# (None is no overall limit, only the per FW type limits). If the overall limit is set it is also the default of each FW type
+type_workers = 1
+workers = None
+# Number of processes formatting the ACLs at the same time (is CPU bound so up to the number of cores), 0 formats them in the gathering threads
+format_workers = 0
+# Number of devices logged into at the same time and how long to wait (in seconds) for each connection to open
+login_workers = 10
+timeout = 10
+# Report format, 'xlsx' is a workbook with a sheet per device. 'csv', 'jsonl' or 'parquet' create a file per device sheet (not limited in rows)
+report_format = 'xlsx'
+# Number of rows written to parquet at a time (each is a row group), is how many rows are held in memory
+parquet_rows = 50000
 # Header names and columns widths for the XL sheet
 header = {'Policy/ACL Name':25, 'Line Number':17, 'Access':18, 'Protocol':12, 'Source Address':23, 'Source Service':14, 'Destination Address':23,
           'Destination Service':26, 'Hit Count':14, 'Date Last Hit':17, 'Time Last Hit':17, 'State':10}
+# Stages of the run (and per device stages) that are timed by --stats and can be profiled with --profile
+stages = ['validate_creds', 'logon', 'login', 'gather_acls', 'cache_key', 'refresh_hits', 'get_acls', 'format_acl', 'analyse_acls', 'create_report', 'logoff']
 
 
 ################################## Multi-Use functions ##################################
@@ -76,6 +116,42 @@ def create_parser():
     parser.add_argument('-u', '--user', help='Global username for all devices, overides that set in input file')
     parser.add_argument('-l', '--location', default=directory, help='Location to save and run the report (default: %(default)s)')
     parser.add_argument('-n', '--name', default=report_name, help='Name for the report (default: %(default)s)')
+    parser.add_argument('-w', '--workers', type=int, default=workers, help='Max number of devices to gather ACLs from at once across all FW types '
+                        '(default: no limit, only the per FW type limits)')
+    parser.add_argument('--asa-workers', type=int, help='Max number of ASAs to gather ACLs from at once (default: same as --workers or {})'.format(type_workers))
+    parser.add_argument('--ckp-workers', type=int, help='Max number of Checkpoints to gather ACLs from at once (default: same as --workers or {})'.format(type_workers))
+    parser.add_argument('--format-workers', type=int, default=format_workers, help='Max number of processes formatting ACLs at once, 0 formats '
+                        'them as they are gathered (default: %(default)s)')
+    parser.add_argument('--login-workers', type=int, default=login_workers, help='Max number of devices to log into at once (default: %(default)s)')
+    parser.add_argument('-t', '--timeout', type=int, default=timeout, help='Seconds to wait for each device connection to open (default: %(default)s)')
+    parser.add_argument('--ckp-async', action='store_true', help='Use the asyncio Checkpoint API client (aiohttp) rather than the requests client')
+    parser.add_argument('--no-cache', action='store_true', help='Gather the full ACLs from all devices without using or updating the cache')
+    parser.add_argument('--cache-dir', metavar='DIR', default=cache.cache_dir, help='Directory the gathered ACLs are cached in (default: %(default)s)')
+    parser.add_argument('--hits-only', action='store_true', help="Only refresh the hit counts of cached ACLs, doesn't check for policy changes")
+    parser.add_argument('--capture', metavar='DIR', help='Directory to save the raw ACLs gathered from each device to (so can be replayed)')
+    parser.add_argument('--replay', metavar='DIR', help='Directory of captured ACLs to create the report from, no devices are connected to')
+    parser.add_argument('-f', '--format', default=report_format, choices=['xlsx', 'csv', 'jsonl'] + (['parquet'] if pyarrow != None else []),
+                        help='Report format (default: %(default)s)')
+    parser.add_argument('--history', metavar='DB', help='SQLite database to save the rows of the run to (also used by the history subcommand)')
+    parser.add_argument('--analyse', action='store_true', help='Save the shadowed, redundant and correlated rules of each device to a findings file')
+    parser.add_argument('--stats', action='store_true', help='Save the time, API calls/SSH commands, rows and memory of each stage in a JSON run report')
+    parser.add_argument('--profile', metavar='STAGE', choices=stages, help='Save a cProfile of the stage (also creates the run report), is one of: ' +
+                        ', '.join(stages))
+    # QUERY: Subcommand to find the rules that match traffic in the expanded ACLs of the report (-l, -n and -f) or the captures (--replay)
+    subparsers = parser.add_subparsers(dest='command')
+    query_parser = subparsers.add_parser('query', help='Find the rules on each firewall that match the traffic (no devices are connected to)')
+    query_parser.add_argument('-s', '--src', type=ip_address, help='Source IP address (default: any)')
+    query_parser.add_argument('-d', '--dst', type=ip_address, help='Destination IP address (default: any)')
+    query_parser.add_argument('-p', '--protocol', help='Protocol name or number such as tcp, udp or icmp (default: any)')
+    query_parser.add_argument('--port', type=int, help='Destination port, only used for TCP and UDP (default: any)')
+    query_parser.add_argument('--src-port', type=int, help='Source port, only used for TCP and UDP (default: any)')
+    query_parser.add_argument('--all', action='store_true', help='Show all the rules that match rather than only the first of each ACL')
+    # HISTORY: Subcommand to compare the hit counts of the runs saved to the history database (--history)
+    history_parser = subparsers.add_parser('history', help='Show the rules not hit in the last days or the change in hits from the last run')
+    history_parser.add_argument('--stale', metavar='DAYS', type=int, default=90, help='Rules whose hit count has not changed in the last days '
+                                '(default: %(default)s)')
+    history_parser.add_argument('--runs', type=int, help='Only compare the last number of runs (default: all runs in the days)')
+    history_parser.add_argument('--deltas', action='store_true', help='Show the change in hit count of every rule since the previous run instead')
     return vars(parser.parse_args())
 
 
@@ -102,10 +178,14 @@ def validate_creds(args, fw_types):
         else:
             location_exist = "yes"
 
-    #2b. NAME: If the file already exists user is asked whether they wish to overwrite it
+    #2b. NAME: If the file already exists user is asked whether they wish to overwrite it. For a file per sheet formats checks for any device file
     while file_exist == "yes":
-        if os.path.exists(os.path.join(args['location'], args['name'] + ".xlsx")):
-            rc.print("The output file [i cyan]{}[/i cyan] already exist, do you want to overwrite it?".format(args['name'] + ".xlsx"))
+        if args['format'] == 'xlsx':
+            report_files = glob.glob(os.path.join(glob.escape(args['location']), glob.escape(args['name']) + ".xlsx"))
+        else:
+            report_files = glob.glob(os.path.join(glob.escape(args['location']), glob.escape(args['name']) + "_*." + args['format']))
+        if len(report_files) != 0:
+            rc.print("The output file [i cyan]{}[/i cyan] already exist, do you want to overwrite it?".format(os.path.basename(report_files[0])))
             answer = rc.input('[b green3]y or n: [/b green3]').lower()
             if answer == 'n':
                 args['name'] = input("Please enter a new name for the output file: ")
@@ -116,6 +196,13 @@ def validate_creds(args, fw_types):
         else:
             file_exist = "no"
 
+    # REPLAY: Devices are not connected to so there is no need for the input file
+    if args['replay'] != None:
+        if not os.path.isdir(args['replay']):
+            rc.print(":x: [b red]Error[/b red] - The replay directory [i cyan]'{}'[/i cyan] does not exist".format(args['replay']))
+            exit()
+        return all_fw
+
     # 2c. LOAD: Load the input file into a dictionary
     with open(os.path.join(args['location'], args['input']), 'r') as file_content:
         my_vars = yaml.load(file_content, Loader=yaml.FullLoader)
@@ -140,7 +227,7 @@ def validate_creds(args, fw_types):
 
 ###################################### 3. Logon ######################################
 # Logon to devices and get Session ID back which is then used for any subsequent connections
-def logon(fw_types, fw_cred):
+def logon(args, fw_types, fw_cred):
     fw_sid = defaultdict(dict)
     import_fw = {}
     errors = []
@@ -150,10 +237,19 @@ def logon(fw_types, fw_cred):
         if fw_cred.get(each_type) != None:
             # Import FW type module as a dynamic variable, this allows the module to be specified using string from 'fw_types' list
             import_fw.update({each_type: __import__(each_type)})
-            # for each_fw in fw_cred[each_type]:
-            for each_fw in track(fw_cred[each_type], 'Testing ' + each_type + ' username/password and device connectivity'):
-                dev_ip = list(each_fw.keys())[0]
-                fw_sid[each_type][dev_ip] = import_fw[each_type].login(dev_ip, list(each_fw.values())[0][0], list(each_fw.values())[0][1])
+            if each_type == 'ckp' and args.get('ckp_async') == True:
+                import_fw[each_type].async_api = True
+            # Pre-populates the FWs so that the SIDs stay in the same order as the input file whatever order the logins finish in
+            fw_sid[each_type] = dict.fromkeys([list(each_fw.keys())[0] for each_fw in fw_cred[each_type]])
+            with ThreadPoolExecutor(max_workers=args['login_workers']) as executor:
+                logins = {}
+                for each_fw in fw_cred[each_type]:
+                    dev_ip = list(each_fw.keys())[0]
+                    logins[executor.submit(stats.timed('login', each_type, dev_ip, import_fw[each_type].login), dev_ip, list(each_fw.values())[0][0], list(each_fw.values())[0][1],
+                                           args['timeout'])] = dev_ip
+                # Progress bar advances as each login completes rather than in the input order
+                for each_login in track(as_completed(logins), 'Testing ' + each_type + ' username/password and device connectivity', total=len(logins)):
+                    fw_sid[each_type][logins[each_login]] = each_login.result()
 
     # FAILFAST: Any sessions returning an error (False) print errors, close all other open sessions and exit. If have a SID (True) change tuple to just SID
     for each_type, each_fw_sid in fw_sid.items():
@@ -169,20 +265,209 @@ def logon(fw_types, fw_cred):
     return import_fw, fw_sid
 
 
+###################################### 4. Gather ACLs ######################################
+# COLLECT_ACL: Gathers and formats the ACLs of one device. Errors are returned (rather than raised) so a failed device doesn't stop the other workers
+def collect_acl(args, import_fw, fw_type, fw, sid, all_limit, format_pool=None):
+    with all_limit:
+        colour = toggle_colour()
+        try:
+            acls, key, cached = None, None, None
+            use_cache = args['no_cache'] == False and hasattr(import_fw[fw_type], 'cache_key')
+            # CACHE: If FW type supports it and the devices policy is unchanged (same key) uses the cached ACLs and only refreshes the hit counts.
+            # HITS_ONLY doesn't check the policy is unchanged (no key) so any cached ACLs are used
+            if use_cache == True:
+                if args['hits_only'] == False:
+                    with stats.stage('cache_key', fw_type, fw, sid):
+                        key = import_fw[fw_type].cache_key(fw, sid)
+                cached = cache.load(fw_type, fw, key)
+            if cached != None:
+                rc.print('[{}]Refreshing the hit counts of the cached ACLs of the {} [i]{}[/i]...[/{}]'.format(colour, fw_type, fw, colour))
+                # If the cached ACLs no longer match the device (policy has changed) refresh_hits returns None
+                with stats.stage('refresh_hits', fw_type, fw, sid):
+                    acls = import_fw[fw_type].refresh_hits(fw, sid, cached['acl_brief'], cached['acl_expanded'])
+                # HITS_ONLY has no key from the device so the refreshed ACLs are saved with the key they were cached with
+                if acls != None and key == None:
+                    key = cached['key']
+            if acls == None:
+                # Key is got before the ACLs (so a change during gathering is caught next run), the key already got this run is reused
+                if use_cache == True and key == None:
+                    with stats.stage('cache_key', fw_type, fw, sid):
+                        key = import_fw[fw_type].cache_key(fw, sid)
+                rc.print('[{}]Gathering and formatting ACL information from the {} [i]{}[/i], be patient it can take a while...[/{}]'.format(colour, fw_type, fw, colour))
+                with stats.stage('get_acls', fw_type, fw, sid):
+                    acls = import_fw[fw_type].get_acls(fw, sid)
+            acl_brief, acl_expanded = acls
+            # Must be saved (and captured) before formatting as format_acl can release the raw ACLs as it reads them
+            if use_cache == True:
+                cache.save(fw_type, fw, key, acl_brief, acl_expanded)
+            if args['capture'] != None:
+                cache.capture(args['capture'], fw_type, fw, acl_brief, acl_expanded)
+            # FORMAT_POOL: The raw ACLs are passed to a format process (returns a future) so this worker can move onto the next device
+            if format_pool != None:
+                return (True, format_pool.submit(format_worker, fw_type, fw, acl_brief, acl_expanded))
+            # STATS: The rows are counted (and the time to create them added to format_acl) as they are written to the report
+            with stats.stage('format_acl', fw_type, fw, sid):
+                return (True, stats.rows(fw_type, fw, import_fw[fw_type].format_acl(fw, acl_brief, acl_expanded)))
+        # SystemExit is also caught as a failed API call exits the script, this would otherwise kill the worker silently
+        except (Exception, SystemExit) as e:
+            return (False, "\u26A0\uFE0F  [yellow]WARNING[/yellow] - Failed to gather the ACLs from {} {}: '{}'".format(fw_type, fw, e))
+
+# FORMAT_WORKER: Run in a format process, formats the raw ACLs of a device returning all the rows (generators can't be passed back) and time taken.
+# The rows are ACE records (any lists are made into them), as their strings are interned repeated values are only pickled once
+def format_worker(fw_type, fw, acl_brief, acl_expanded):
+    start_time = time.perf_counter()
+    acl = __import__(fw_type).format_acl(fw, acl_brief, acl_expanded)
+    acl = {sheet: [ace if isinstance(ace, Ace) else Ace(*ace) for ace in rows] for sheet, rows in acl.items()}
+    return acl, time.perf_counter() - start_time
+
+# FORMAT_RESULT: Waits for a device to be formatted, errors are returned (like collect_acl) so a failed device doesn't stop the other devices
+def format_result(fw_type, fw, future):
+    try:
+        acl, seconds = future.result()
+    except Exception as e:
+        return (False, "\u26A0\uFE0F  [yellow]WARNING[/yellow] - Failed to format the ACLs from {} {}: '{}'".format(fw_type, fw, e))
+    stats.add_time(fw_type, fw, 'format_acl', seconds)
+    return (True, stats.rows(fw_type, fw, acl))
+
+# FORMAT_POOL: Process pool for formatting the ACLs on all cores, the processes don't inherit the instrumentation (only the main process is)
+def format_pool(args):
+    if args['format_workers'] > 0:
+        return ProcessPoolExecutor(max_workers=args['format_workers'], initializer=stats.stop)
+    return None
+
+# GATHER_ACLS: Runs collect_acl for all devices using a worker pool per FW type, if set the total number of workers across all pools is capped by 'workers'.
+# Returns once all devices are gathered (report is in input order) so the raw ACLs of every device are held until written, memory is not per device
+def gather_acls(args, import_fw, fw_sid):
+    acl = {}
+    results = {}
+    errors = []
+    all_limit = BoundedSemaphore(args['workers']) if args['workers'] != None else nullcontext()
+    format_procs = format_pool(args)
+    # Old cached ACLs are removed before any are used
+    if args['no_cache'] == False:
+        cache.evict()
+
+    # 4a. Submit every device to the pool for its FW type, the pool size is the per FW type limit (falls back to the global limit or type_workers)
+    pools = {fw_type: ThreadPoolExecutor(max_workers=args.get(fw_type + '_workers') or args['workers'] or type_workers) for fw_type in fw_sid}
+    for fw_type, details in fw_sid.items():
+        for fw, sid in details.items():
+            results[(fw_type, fw)] = pools[fw_type].submit(collect_acl, args, import_fw, fw_type, fw, sid, all_limit, format_procs)
+    # 4b. Results are read back in the order submitted so the ACL dict (and XL sheets) are in the same order as the input file. With format
+    # processes the result is a future of the formatted ACLs, devices are still gathered (and formatted) while waiting on it
+    for (fw_type, fw), future in results.items():
+        result = future.result()
+        if result[0] == True and format_procs != None:
+            result = format_result(fw_type, fw, result[1])
+        if result[0] == True:
+            acl.update(result[1])
+        else:
+            rc.print(result[1])
+            errors.append(fw)
+    for pool in list(pools.values()) + [format_procs]:
+        if pool != None:
+            pool.shutdown()
+    # CAPTURE: Saves the order of the devices captured so they can be replayed in the same order, if none were captured (the directory may not exist) there is no order
+    if args['capture'] != None:
+        captured = [[fw_type, fw] for fw_type, fw in results if os.path.exists(cache.cache_file(fw_type, fw, args['capture']))]
+        if len(captured) != 0:
+            cache.capture_order(args['capture'], captured)
+    if len(errors) != 0:
+        rc.print(':x: [b red]Error[/b red] - Failed to gather ACLs from [i]{}[/i], these are not in the report.'.format(str(errors).replace('[', '').replace(']', '')))
+    return acl
+
+
+# REPLAY_ACLS: Formats the ACLs captured (--capture) in a previous run, no devices are connected to
+def replay_acls(args, fw_types):
+    acl = {}
+    errors = []
+    import_fw = {each_type: __import__(each_type) for each_type in fw_types}
+    format_procs = format_pool(args)
+    results = {}
+    for fw_type, fw, acl_brief, acl_expanded in cache.replay(args['replay']):
+        colour = toggle_colour()
+        rc.print('[{}]Formatting the captured ACL information of the {} [i]{}[/i]...[/{}]'.format(colour, fw_type, fw, colour))
+        # FORMAT_POOL: Each device is passed to a format process, the results are read back in the captured order once all are passed
+        if format_procs != None:
+            results[(fw_type, fw)] = format_procs.submit(format_worker, fw_type, fw, acl_brief, acl_expanded)
+            continue
+        try:
+            with stats.stage('format_acl', fw_type, fw):
+                acl.update(stats.rows(fw_type, fw, import_fw[fw_type].format_acl(fw, acl_brief, acl_expanded)))
+        except Exception as e:
+            rc.print("\u26A0\uFE0F  [yellow]WARNING[/yellow] - Failed to format the captured ACLs from {} {}: '{}'".format(fw_type, fw, e))
+            errors.append(fw)
+    for (fw_type, fw), future in results.items():
+        result = format_result(fw_type, fw, future)
+        if result[0] == True:
+            acl.update(result[1])
+        else:
+            rc.print(result[1])
+            errors.append(fw)
+    if format_procs != None:
+        format_procs.shutdown()
+    if len(errors) != 0:
+        rc.print(':x: [b red]Error[/b red] - Failed to format ACLs from [i]{}[/i], these are not in the report.'.format(str(errors).replace('[', '').replace(']', '')))
+    return acl
+
+
+# QUERY_ACLS: Prints the rules of each device ACL that match the traffic, the first of each ACL is the one that would be hit
+def query_acls(args, fw_types):
+    # 4a. Loads the expanded ACLs of the report or formats those of the captures
+    if args['replay'] != None:
+        if not os.path.isdir(args['replay']):
+            rc.print(":x: [b red]Error[/b red] - The replay directory [i cyan]'{}'[/i cyan] does not exist".format(args['replay']))
+            exit()
+        acl = replay_acls(args, fw_types)
+    else:
+        acl = query.report_acl(args['location'], args['name'], args['format'])
+    index = query.Index(acl)
+    if len(index.sheets) == 0:
+        rc.print(":x: [b red]Error[/b red] - No expanded ACLs found in the {} report [i cyan]'{}'[/i cyan]".format(args['format'],
+                 os.path.join(args['location'], args['name'])))
+        exit()
+
+    # 4b. Finds the matching rules, only the first of each ACL unless --all
+    start_time = time.perf_counter()
+    if args['all'] == True:
+        matches = index.match(args['src'], args['dst'], args['protocol'], args['port'], args['src_port'])
+    else:
+        matches = {sheet: {acl_name: [ace] for acl_name, ace in acls.items()} for sheet, acls in
+                   index.first(args['src'], args['dst'], args['protocol'], args['port'], args['src_port']).items()}
+    seconds = time.perf_counter() - start_time
+
+    # 4c. A table per device of the matching rules
+    for sheet, acls in matches.items():
+        table = Table(*header, title=sheet[:-len('_exp_acl')])
+        for aces in acls.values():
+            for ace in aces:
+                table.add_row(*[str(value) for value in ace])
+        rc.print(table)
+    num_rules = sum(len(aces) for acls in matches.values() for aces in acls.values())
+    rc.print(':white_heavy_check_mark: {} matching rules on {} of the {} devices, searched {} rules in {:.3f} ms'.format(num_rules, len(matches),
+             len(index.sheets), len(index.rows), seconds * 1000))
+
+
 ############################## Logoff - Gracefully close all device conns ###################################
-def logoff(import_fw, fw_sid):
+# Exits the script unless exit_run is False (is run in a finally so must not hide an error being raised)
+def logoff(import_fw, fw_sid, exit_run=True):
         for fw_type, fw_sid in fw_sid.items():
             for fw, sid in fw_sid.items():
                 if not isinstance(sid, tuple):
-                    import_fw[fw_type].logoff(fw, sid)
-        exit()
+                    with stats.stage('logoff', fw_type, fw, sid):
+                        import_fw[fw_type].logoff(fw, sid)
+        if exit_run == True:
+            exit()
 
 
 ############################ Toggle colour - alternative colour at each loop iteration ###########################
+# Locked as it is called by all the gathering workers (threads) at once
+colour_lock = Lock()
+
 def toggle_colour(last=[0]):
     colours = ['green4', 'dark_sea_green4']
-    colour = colours[last[0]]
-    last[0] = (last[0] + 1) % 2         # ensure the index is 0 or 1 alternatively
+    with colour_lock:
+        colour = colours[last[0]]
+        last[0] = (last[0] + 1) % 2         # ensure the index is 0 or 1 alternatively
     return colour
 
 
@@ -191,60 +476,228 @@ def create_xls(args, acl):
     print('Creating the spreadsheet...')
     filename = os.path.join(args['location'], args['name'] + ".xlsx")
 
-    # 5a. Create a workbook per device
-    wb = Workbook()
+    # 5a. Create a write-only workbook (rows are streamed to disk as added) with a sheet per device. If creating the rows of a device fails all
+    # its sheets are closed and removed from the workbook
+    wb = Workbook(write_only=True)
+    sheets, failed = defaultdict(list), []
     for dvc, dvc_acl in acl.items():
-        ws1 = wb.create_sheet(title=dvc)
-
-        # 5b. Add the headers, set font, colour and column width (from header dictionary)
-        for col, head in zip(range(1,len(header) + 1), header.items()):
-            ws1['{}1'.format(get_column_letter(col))] = head[0]      # get_column_letter converts number to letter
-            ws1['{}1'.format(get_column_letter(col))].fill = PatternFill(bgColor=colors.Color("00DCDCDC"))
-            ws1['{}1'.format(get_column_letter(col))].font = Font(bold=True, size=14)
-            ws1.column_dimensions[get_column_letter(col)].width = head[1]
-        # 5c. Add the ACE entries. The columns holding numbers are changed to integers
-        for ace in dvc_acl:
-            ace[1] = int(ace[1])
-            ace[8] = int(ace[8])
-            if ace[7].isdigit():
-                ace[7] = int(ace[7])
-            ws1.append(ace)
-        # 5d. Required as making ace[7] messes up alignment for that column
-        for col in ws1.columns:
-            for cell in col:
-                cell.alignment = Alignment(horizontal='left')
-        # 5e. Add a key at start with info on the colourised rows for ACEs with frequent hit-cnts
-        ws1.insert_rows(1)
-        ws1.insert_rows(2)
-        keys = {'A1': 'Key:', 'B1':'Hit in last 1 day', 'E1':'Hit in last 7 days', 'G1':'Hit in last 30 days', 'I1':'Inactive'}
-        colour  = {'B1':'E6B0AA', 'E1':'A9CCE3', 'G1':'F5CBA7', 'I1':'D4EFDF'}
-
-        for cell, val in keys.items():
-            ws1[cell] = val
-        ws1['A1'].font = Font(bold=True)
-        for cell, col in colour.items():
-            ws1[cell].fill = PatternFill(start_color=col, end_color=col, fill_type='solid')
-
-        ws1.freeze_panes = ws1['A4']                    # Freezes the top row (A1) so remains when scrolling
-        ws1.auto_filter.ref = 'A3:L4'                   # Adds dropdown to headers to the headers
-
-        # 5f. Colours used for columns dependant on the last hit data (J column). Formula is a standard XL formula
-        style_grn = DifferentialStyle(fill=PatternFill(bgColor=colors.Color("00D4EFDF")))
-        rule_inactive = Rule(type="expression",formula=['=$L1="inactive"'], dxf=style_grn)
-        style_red = DifferentialStyle(fill=PatternFill(bgColor=colors.Color("00E6B0AA")))
-        rule_1day = Rule(type="expression",formula=["=AND(TODAY()-$J1>=0,TODAY()-$J1<=1)"], dxf=style_red)
-        style_blu = DifferentialStyle(fill=PatternFill(bgColor=colors.Color("00A9CCE3")))
-        rule_7day = Rule(type="expression", formula=["=AND(TODAY()-$J1>=0,TODAY()-$J1<=7)"], dxf=style_blu)
-        style_org = DifferentialStyle(fill=PatternFill(bgColor=colors.Color("00F5CBA7")))
-        rule_30day = Rule(type="expression", formula=["=AND(TODAY()-$J1>=0,TODAY()-$J1<=30)"], dxf=style_org)
-
-        # 5g. Apply the rules to workbook and save it
-        for rule in [rule_inactive, rule_1day, rule_7day, rule_30day]:
-            ws1.conditional_formatting.add(ws1.dimensions, rule)
-
-    wb.remove(wb['Sheet'])
+        device = sheet_device(dvc)
+        if device in failed:
+            continue
+        sheets[device].append(wb.create_sheet(title=dvc))
+        try:
+            write_sheet(sheets[device][-1], dvc_acl)
+        except (Exception, SystemExit) as e:
+            device_failed(device, e, failed)
+            for ws1 in sheets[device]:
+                ws1.close()
+                wb.remove(ws1)
     wb.save(filename)
     rc.print(':white_heavy_check_mark: Firewall policy report [b blue]{}[/b blue] has been created'.format(filename))
+    report_failed(failed)
+
+# WRITE_SHEET: Writes the key, header and rows of a device sheet
+def write_sheet(ws1, dvc_acl):
+    left = Alignment(horizontal='left')          # Required as numbers are right aligned, text is already left aligned
+
+    # 5b. Column widths (from header dictionary), freeze top 3 rows so remains when scrolling and dropdown for the headers
+    for col, width in zip(range(1,len(header) + 1), header.values()):
+        ws1.column_dimensions[get_column_letter(col)].width = width      # get_column_letter converts number to letter
+    ws1.freeze_panes = 'A4'
+    ws1.auto_filter.ref = 'A3:L4'
+
+    # 5c. Add a key at start with info on the colourised rows for ACEs with frequent hit-cnts, rows are written in order so 1 to 3 go first
+    keys = {'A':'Key:', 'B':'Hit in last 1 day', 'E':'Hit in last 7 days', 'G':'Hit in last 30 days', 'I':'Inactive'}
+    colour  = {'B':'E6B0AA', 'E':'A9CCE3', 'G':'F5CBA7', 'I':'D4EFDF'}
+    key_row = []
+    for col in range(1, 10):
+        key_row.append(WriteOnlyCell(ws1, value=keys.get(get_column_letter(col))))
+        if get_column_letter(col) in colour:
+            key_row[-1].fill = PatternFill(start_color=colour[get_column_letter(col)], end_color=colour[get_column_letter(col)], fill_type='solid')
+    key_row[0].font = Font(bold=True)
+    ws1.append(key_row)
+    ws1.append([])
+
+    # 5d. Add the headers, set font and colour
+    head_row = []
+    for head in header:
+        cell = WriteOnlyCell(ws1, value=head)
+        cell.fill = PatternFill(bgColor=colors.Color("00DCDCDC"))
+        cell.font = Font(bold=True, size=14)
+        cell.alignment = left
+        head_row.append(cell)
+    ws1.append(head_row)
+
+    # 5e. Add the ACE entries. The columns holding numbers are changed to integers, only these cells need a style (alignment)
+    num_rows = 3
+    for ace in dvc_acl:
+        row = col_types(ace)
+        if isinstance(row[7], str) and row[7].isdigit():
+            row[7] = int(row[7])
+        for col in [1, 7, 8]:
+            if isinstance(row[col], int):
+                row[col] = WriteOnlyCell(ws1, value=row[col])
+                row[col].alignment = left
+        ws1.append(row)
+        num_rows += 1
+
+    # 5f. Colours used for columns dependant on the last hit data (J column). Formula is a standard XL formula
+    style_grn = DifferentialStyle(fill=PatternFill(bgColor=colors.Color("00D4EFDF")))
+    rule_inactive = Rule(type="expression",formula=['=$L1="inactive"'], dxf=style_grn)
+    style_red = DifferentialStyle(fill=PatternFill(bgColor=colors.Color("00E6B0AA")))
+    rule_1day = Rule(type="expression",formula=["=AND(TODAY()-$J1>=0,TODAY()-$J1<=1)"], dxf=style_red)
+    style_blu = DifferentialStyle(fill=PatternFill(bgColor=colors.Color("00A9CCE3")))
+    rule_7day = Rule(type="expression", formula=["=AND(TODAY()-$J1>=0,TODAY()-$J1<=7)"], dxf=style_blu)
+    style_org = DifferentialStyle(fill=PatternFill(bgColor=colors.Color("00F5CBA7")))
+    rule_30day = Rule(type="expression", formula=["=AND(TODAY()-$J1>=0,TODAY()-$J1<=30)"], dxf=style_org)
+
+    # 5g. Apply the rules to all the rows written (is written at the end of the sheet)
+    for rule in [rule_inactive, rule_1day, rule_7day, rule_30day]:
+        ws1.conditional_formatting.add('A1:L{}'.format(num_rows), rule)
+
+# SHEET_DEVICE: The device of a sheet, sheets are named device_acl or device_exp_acl
+def sheet_device(dvc):
+    return dvc[:-len('_exp_acl')] if dvc.endswith('_exp_acl') else dvc[:-len('_acl')]
+
+# DEVICE_FAILED: The rows (can be generators) are created as they are written, so formatting a device can fail while the report is written. Is
+# reported (like collect_acl) so a failed device doesn't stop the other devices being written, it is left out of the report
+def device_failed(device, e, failed):
+    rc.print("\u26A0\uFE0F  [yellow]WARNING[/yellow] - Failed to format the ACLs from {}: '{}'".format(device, e))
+    failed.append(device)
+
+def report_failed(failed):
+    if len(failed) != 0:
+        rc.print(':x: [b red]Error[/b red] - Failed to format ACLs from [i]{}[/i], these are not in the report.'.format(str(failed).replace('[', '').replace(']', '')))
+
+
+ ################################## 5. Build CSV, JSON Lines or Parquet report ##################################
+# COL_TYPES: Returns the ACE (an ACE record or list) as a list with the line number and hit count as integers, all other columns stay as strings
+# so each column is only one type (for parquet)
+def col_types(ace):
+    row = list(ace)
+    row[1], row[8] = int(row[1]), int(row[8])
+    return row
+
+# CSV: The header row followed by a row per ACE
+def write_csv(filename, dvc_acl):
+    with open(filename, 'w', newline='') as file_content:
+        writer = csv.writer(file_content)
+        writer.writerow(header.keys())
+        for ace in dvc_acl:
+            writer.writerow(col_types(ace))
+
+# JSONL: A JSON object per ACE using the header names as the keys
+def write_jsonl(filename, dvc_acl):
+    with open(filename, 'w') as file_content:
+        for ace in dvc_acl:
+            file_content.write(json.dumps(dict(zip(header, col_types(ace)))) + '\n')
+
+# PARQUET: Rows are written in row groups of parquet_rows so only that many rows are held in memory at once
+def write_parquet(filename, dvc_acl):
+    schema = pyarrow.schema([(head, pyarrow.int64() if col in [1, 8] else pyarrow.string()) for col, head in enumerate(header)])
+    dvc_acl = iter(dvc_acl)
+    with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+        while True:
+            rows = [col_types(ace) for ace in islice(dvc_acl, parquet_rows)]
+            if len(rows) == 0:
+                break
+            # Rows are turned into columns to create the table
+            columns = [pyarrow.array(col, type=field.type) for col, field in zip(zip(*rows), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+
+# REPORT: Creates the XL workbook or a file per device sheet (named report-name_device-sheet) in the format chosen, rows are streamed to the file
+def create_report(args, acl):
+    if args['format'] == 'xlsx':
+        create_xls(args, acl)
+    else:
+        print('Creating the {} files...'.format(args['format']))
+        writers = {'csv': write_csv, 'jsonl': write_jsonl, 'parquet': write_parquet}
+        files, failed = defaultdict(list), []
+        for dvc, dvc_acl in acl.items():
+            device = sheet_device(dvc)
+            if device in failed:
+                continue
+            files[device].append(os.path.join(args['location'], '{}_{}.{}'.format(args['name'], dvc, args['format'])))
+            # If creating the rows of a device fails all its files are deleted
+            try:
+                writers[args['format']](files[device][-1], dvc_acl)
+            except (Exception, SystemExit) as e:
+                device_failed(device, e, failed)
+                for filename in files[device]:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+        rc.print(':white_heavy_check_mark: Firewall policy report files [b blue]{}[/b blue] have been created'.format(
+                 os.path.join(args['location'], args['name'] + '_*.' + args['format'])))
+        report_failed(failed)
+
+
+################################## Shadowed, redundant and correlated rules ##################################
+# ANALYSE: Saves the findings of the expanded ACL of each device as report-name_device_findings.csv. The expanded ACL rows are read into a
+# list first (rather than created as they are written) so that they can still be written to the report
+def analyse_acls(args, acl):
+    print('Analysing the expanded ACLs...')
+    failed = []
+    for dvc in list(acl):
+        if dvc.endswith('_exp_acl'):
+            # FAILED: If creating the rows fails the device is removed so it isn't in the report either
+            try:
+                acl[dvc] = list(acl[dvc])
+            except (Exception, SystemExit) as e:
+                device_failed(dvc[:-len('_exp_acl')], e, failed)
+                del acl[dvc]
+                acl.pop(dvc[:-len('_exp_acl')] + '_acl', None)
+                continue
+            dvc_findings = analysis.findings(acl[dvc])
+            filename = os.path.join(args['location'], '{}_{}_findings.csv'.format(args['name'], dvc[:-len('_exp_acl')]))
+            analysis.write_findings(filename, dvc_findings)
+            rc.print(':white_heavy_check_mark: {} shadowed, redundant or correlated rules on {}, saved to [b blue]{}[/b blue]'.format(
+                     len(dvc_findings), dvc[:-len('_exp_acl')], filename))
+    report_failed(failed)
+
+
+################################## History of the runs ##################################
+# SAVE_HISTORY: Opens the history database (--history) and wraps the rows of the ACL so they are saved as they are written to the report
+def save_history(args, acl):
+    try:
+        store = history.connect(args['history'])
+        acl.update(history.save(store, args['name'], acl))
+        return store
+    except sqlite3.Error as e:
+        rc.print("\u26A0\uFE0F  [yellow]WARNING[/yellow] - Failed to open the history database '{}', the run is not saved: '{}'".format(args['history'], e))
+
+# HISTORY_REPORT: Saves the stale rules (--stale) or the change in hit counts since the last run (--deltas) from the history database as
+# report-name_stale.csv or report-name_deltas.csv and prints the first history.print_rows of them
+def history_report(args):
+    if args['history'] == None or not os.path.isfile(args['history']):
+        rc.print(":x: [b red]Error[/b red] - The history database [i cyan]'{}'[/i cyan] does not exist, set it with --history".format(args['history']))
+        exit()
+    store = history.connect(args['history'])
+    if args['deltas'] == True:
+        rules, header, title = history.hit_deltas(store), history.deltas_header, 'Hit count changes'
+        filename = os.path.join(args['location'], args['name'] + '_deltas.csv')
+    else:
+        rules, header, title = history.stale_rules(store, args['stale'], args['runs']), history.stale_header, 'Rules not hit in the last {} days'.format(args['stale'])
+        filename = os.path.join(args['location'], args['name'] + '_stale.csv')
+    store.close()
+    history.write_rules(filename, header, rules)
+    # TABLE: Only the first rules are printed as a table of every rule of a large policy is too slow to render and read
+    table = Table(*header, title=title)
+    for rule in rules[:history.print_rows]:
+        table.add_row(*['' if value == None else str(value) for value in rule])
+    rc.print(table)
+    if len(rules) > history.print_rows:
+        rc.print('Showing the first {} rules'.format(history.print_rows))
+    rc.print(':white_heavy_check_mark: {} rules from the history database [b blue]{}[/b blue], saved to [b blue]{}[/b blue]'.format(
+             len(rules), args['history'], filename))
+
+
+# STATS: Saves the run report (and profile of a stage) named after the report in the report location
+def save_stats(args):
+    try:
+        for filename in stats.save(os.path.join(args['location'], args['name'])):
+            rc.print(':white_heavy_check_mark: Run stats file [b blue]{}[/b blue] has been created'.format(filename))
+    except OSError as e:
+        rc.print("\u26A0\uFE0F  [yellow]WARNING[/yellow] - Failed to save the run report: '{}'".format(e))
 
 
 ###################################### Run the scripts ######################################
@@ -258,29 +711,67 @@ def main():
 
 	# 1. Gather input from user
     args = create_parser()
+    cache.cache_dir = args['cache_dir']
+    # STATS: Instrument the run, the run report is saved at exit as the script can exit at any stage
+    if args['stats'] == True or args['profile'] != None:
+        stats.start(args['profile'])
+        atexit.register(save_stats, args)
+    # QUERY: Finds the rules that match the traffic from the report or captures of a previous run rather than connecting to the devices
+    if args['command'] == 'query':
+        query_acls(args, fw_types)
+        exit()
+    # HISTORY: Compares the hit counts of the previous runs saved to the history database
+    if args['command'] == 'history':
+        history_report(args)
+        exit()
     # 2. Validate location and filename and create list of FWs
-    fw_cred = validate_creds(args, fw_types)
+    with stats.stage('validate_creds'):
+        fw_cred = validate_creds(args, fw_types)
+
+    # REPLAY: Creates the report from the captured ACLs of a previous run rather than connecting to the devices
+    if args['replay'] != None:
+        with stats.stage('gather_acls'):
+            acl = replay_acls(args, fw_types)
+        store = save_history(args, acl) if args['history'] != None else None
+        if args['analyse'] == True:
+            with stats.stage('analyse_acls'):
+                analyse_acls(args, acl)
+        with stats.stage('create_report'):
+            create_report(args, acl)
+        if store != None:
+            store.close()
+        exit()
 
     # 3. Check login details and create a nested dictionary of sessions for each device
     if len(fw_cred) != None:
-        import_fw, fw_sid = logon(fw_types, fw_cred)
+        with stats.stage('logon'):
+            import_fw, fw_sid = logon(args, fw_types, fw_cred)
 
     # 4. Gather ACLs from devices then format the data to create new data-models of {fwip_acl: [non_expanded_acl], fw_ip_exp_acl: [expanded_acl]}
-    acl = {}
-    for fw_type, details in fw_sid.items():
-        for fw, sid in details.items():
-            colour = toggle_colour()
-            rc.print('[{}]Gathering and formatting ACL information from the {} [i]{}[/i], be patient it can take a while...[/{}]'.format(colour, fw_type, fw, colour))
-            acl_brief, acl_expanded = import_fw[fw_type].get_acls(fw, sid)
-
-            import_fw[fw_type].format_acl(fw, acl_brief, acl_expanded)
-            acl.update(import_fw[fw_type].format_acl(fw, acl_brief, acl_expanded))
+    with stats.stage('gather_acls'):
+        acl = gather_acls(args, import_fw, fw_sid)
 
-    # 5. Build the Excel worksheet, a separate sheet per device
-    create_xls(args, acl)
-
-    #6. Logoff sessions form all firewalls
-    logoff(import_fw, fw_sid)
+    # The sessions are always closed, even if creating the report fails
+    store = None
+    try:
+        # HISTORY: The rows are saved to the history database (--history) as they are written to the report
+        store = save_history(args, acl) if args['history'] != None else None
+
+        # ANALYSE: Finds the rules of each device that are shadowed, redundant or correlated by earlier rules
+        if args['analyse'] == True:
+            with stats.stage('analyse_acls'):
+                analyse_acls(args, acl)
+
+        # 5. Build the Excel worksheet (a separate sheet per device) or the files of the chosen report format
+        with stats.stage('create_report'):
+            create_report(args, acl)
+    finally:
+        if store != None:
+            store.close()
+
+        #6. Logoff sessions form all firewalls
+        with stats.stage('logoff'):
+            logoff(import_fw, fw_sid, exit_run=False)
 
 if __name__ == '__main__':
     main()
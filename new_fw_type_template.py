@@ -7,8 +7,8 @@ urllib3.disable_warnings()
 
 
 ###################################### 1. Login ######################################
-# Initial login to get a Session ID (SID) and handling of errors.
-def login(fw, user, pword):
+# Initial login to get a Session ID (SID) and handling of errors. Timeout is how long (seconds) to wait for the connection to open
+def login(fw, user, pword, timeout=10):
     # Login attempt
     try:
         pass
@@ -28,6 +28,17 @@ def get_acls(dev, sid):
     pass
     return acl_brief, acl_expanded
 
+# Optional (used by the cache), returns a key that changes whenever the policy changes such as the policy revision or a hash of the config
+def cache_key(fw, sid):
+    pass
+    return None
+
+# Optional (used by the cache), only updates the hit counts of the cached ACLs (output of get_acls) returning (acl_brief, acl_expanded). Returns None
+# if they no longer match the device rules, the full ACLs are then gathered
+def refresh_hits(fw, sid, acl_brief, acl_expanded):
+    pass
+    return None
+
 
 ################################## DRY filters run by the main Sanitize method (format_acl) ##################################
 # Due to the repetitive nature of ACLs it is likely same code is used multiple times when santising the data
@@ -37,6 +48,8 @@ def get_acls(dev, sid):
 # ################################## 3. Sanitize the data - Create ACL structured data ##################################
 # Takes the data gathered from get_acls and normalises it to create two lists (ACL and Expanded_ACL) in a standardized data model format to create the XL sheet report
 # [name, num, permit/deny, protocol, src_ip/pfx, src_port, dst_ip/pfx, dst_port, hitcnt, last_hit_date, last_hit_time, state]
+# The lists can instead be generators yielding each ACE (is only read once), this stops big rulebases having to be held in memory all at once
+# Each ACE can be a list or an ACE record (record.Ace(*ace)), the record is a lot smaller so is best for big rulebases held in memory
 
 def format_acl(fw, acl_brief, acl_expanded):
     pass
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+import os
+import csv
+import json
+import glob
+from heapq import merge
+from functools import lru_cache
+from ipaddress import ip_address, ip_network
+from openpyxl import load_workbook
+from record import Ace
+# Parquet reports are only read if pyarrow is installed
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+######################## Variables to change dependant on environment ########################
+# Named ports (as used by ASA) that the ports of a rule can be, anything not a number or one of these can't be matched
+PORT_NAMES = {'aol': 5190, 'bgp': 179, 'biff': 512, 'bootpc': 68, 'bootps': 67, 'chargen': 19, 'cifs': 3020, 'citrix-ica': 1494, 'cmd': 514,
+              'ctiqbe': 2748, 'daytime': 13, 'discard': 9, 'dnsix': 195, 'domain': 53, 'echo': 7, 'exec': 512, 'finger': 79, 'ftp': 21,
+              'ftp-data': 20, 'gopher': 70, 'h323': 1720, 'hostname': 101, 'http': 80, 'https': 443, 'ident': 113, 'imap4': 143, 'irc': 194,
+              'isakmp': 500, 'kerberos': 88, 'klogin': 543, 'kshell': 544, 'ldap': 389, 'ldaps': 636, 'login': 513, 'lotusnotes': 1352,
+              'lpd': 515, 'mobile-ip': 434, 'nameserver': 42, 'netbios-dgm': 138, 'netbios-ns': 137, 'netbios-ssn': 139, 'nfs': 2049,
+              'nntp': 119, 'ntp': 123, 'pcanywhere-data': 5631, 'pcanywhere-status': 5632, 'pim-auto-rp': 496, 'pop2': 109, 'pop3': 110,
+              'pptp': 1723, 'radius': 1645, 'radius-acct': 1646, 'rip': 520, 'rsh': 514, 'rtsp': 554, 'secureid-udp': 5510, 'sip': 5060,
+              'smtp': 25, 'snmp': 161, 'snmptrap': 162, 'sqlnet': 1521, 'ssh': 22, 'sunrpc': 111, 'syslog': 514, 'tacacs': 49, 'talk': 517,
+              'telnet': 23, 'tftp': 69, 'time': 37, 'uucp': 540, 'vxlan': 4789, 'who': 513, 'whois': 43, 'www': 80, 'xdmcp': 177}
+
+
+################################## Rule match query (offline packet tracer) ##################################
+# Answers 'which rules on which firewalls would match src X, dst Y, protocol Z, port P' from the expanded ACLs (*_exp_acl sheets of format_acl).
+# The source and destination addresses of every row are indexed by prefix, each IP version has a table per prefix length of {network: [row ids]}
+# so an address is looked up with one dictionary get per prefix length in use (longest prefix match). The rows found by the address that
+# matches the fewest rows are then checked against the other address, protocol and port (port intervals of each row are worked out once)
+BITS = {4: 32, 6: 128}
+ANY_PROTO = ['ip', 'any']
+PROTO_NUMS = {'icmp': '1', 'tcp': '6', 'udp': '17', 'icmp6': '58'}
+
+# ADDR_RANGES: Converts an address cell into a tuple of (version, first, last) integer ranges, negated (NOT_) is everything else in the same IP version.
+# Object names (or anything else that is not an address) can't be matched so have no ranges. Cached as the same addresses are in many rows
+@lru_cache(maxsize=65536)
+def addr_ranges(addr):
+    if addr.startswith('NOT_'):
+        excluded = addr_ranges(addr[4:])
+        ranges = []
+        for ver in {each_range[0] for each_range in excluded}:
+            first = 0
+            for each_ver, start, end in sorted(each_range for each_range in excluded if each_range[0] == ver):
+                if start > first:
+                    ranges.append((ver, first, start - 1))
+                first = max(first, end + 1)
+            if first <= 2 ** BITS[ver] - 1:
+                ranges.append((ver, first, 2 ** BITS[ver] - 1))
+        return tuple(ranges)
+    elif addr in ['any', 'any4', 'any6']:
+        return ((4, 0, 2 ** 32 - 1), (6, 0, 2 ** 128 - 1))
+    try:
+        if '-' in addr:
+            start, end = (ip_address(each_addr) for each_addr in addr.split('-', 1))
+            return ((start.version, int(start), int(end)),) if start.version == end.version else ()
+        network = ip_network(addr, strict=False)
+        return ((network.version, int(network[0]), int(network[-1])),)
+    except ValueError:
+        return ()
+
+# PREFIXES: Returns the (prefix length, network) of the fewest networks that cover the integer range first to last. Cached like addr_ranges
+@lru_cache(maxsize=65536)
+def prefixes(ver, first, last):
+    networks = []
+    while first <= last:
+        size = min((first & -first).bit_length() - 1 if first != 0 else BITS[ver], (last - first + 1).bit_length() - 1)
+        networks.append((BITS[ver] - size, first >> size))
+        first += 1 << size
+    return tuple(networks)
+
+# PORT_RANGES: Converts a source or destination port cell into a tuple of (first, last) port ranges. ASA uses NOT_, LT_ and GT_ and Checkpoint > and <
+# for the operators, names are changed to the port number. Anything that is not a port (ICMP types, object names) can't be matched
+@lru_cache(maxsize=4096)
+def port_ranges(port):
+    if port in ['any_port', 'any']:
+        return ((0, 65535),)
+    elif port.startswith('NOT_'):
+        excluded = port_ranges(port[4:])
+        return tuple((first, last) for first, last in [(0, excluded[0][0] - 1), (excluded[0][1] + 1, 65535)] if first <= last) if excluded else ()
+    elif port.startswith('LT_') or port.startswith('<'):
+        return tuple((0, first - 1) for first, last in port_ranges(port[3:] if port.startswith('LT_') else port[1:]))
+    elif port.startswith('GT_') or port.startswith('>'):
+        return tuple((last + 1, 65535) for first, last in port_ranges(port[3:] if port.startswith('GT_') else port[1:]))
+    elif '-' in port:
+        first, last = (port_number(each_port) for each_port in port.split('-', 1))
+        return ((first, last),) if first != None and last != None else ()
+    elif port_number(port) != None:
+        return ((port_number(port), port_number(port)),)
+    return ()
+
+def port_number(port):
+    if port.isdigit():
+        return int(port)
+    return PORT_NAMES.get(port)
+
+# PROTO_MATCH: IP (ASA) or any (Checkpoint) match every protocol, tcp-udp (ASA) matches TCP or UDP. Protocols can be the name or number
+def proto_match(rule_proto, protocol):
+    if protocol == None or rule_proto in ANY_PROTO:
+        return True
+    elif rule_proto == 'tcp-udp':
+        return protocol in ['tcp', 'udp', '6', '17']
+    return rule_proto == protocol or rule_proto == PROTO_NUMS.get(protocol) or PROTO_NUMS.get(rule_proto) == protocol
+
+def in_ranges(ranges, value):
+    for first, last in ranges:
+        if first <= value <= last:
+            return True
+    return False
+
+def addr_match(ranges, ver, value):
+    for each_ver, first, last in ranges:
+        if each_ver == ver and first <= value <= last:
+            return True
+    return False
+
+
+# INDEX: Holds the rows of the expanded ACLs and for each ACL (of each device sheet) the source and destination prefix tables. Rows are added a
+# sheet at a time (add) so the rows of format_acl (generators or lists), the report files or replayed captures can be indexed as they are read
+class Index:
+    def __init__(self, acl=None):
+        self.rows = []
+        self.sheets = []
+        self.acls = {}
+        for sheet, rows in (acl or {}).items():
+            if sheet.endswith('_exp_acl'):
+                self.add(sheet, rows)
+
+    # ADD: Indexes the rows of a device sheet, each is kept as (ace, src_ranges, dst_ranges, src_port_ranges, dst_port_ranges)
+    def add(self, sheet, rows):
+        self.sheets.append(sheet)
+        for ace in rows:
+            if not isinstance(ace, Ace):
+                ace = Ace(*ace)
+            row_id = len(self.rows)
+            self.rows.append((ace, addr_ranges(ace.src), addr_ranges(ace.dst), port_ranges(ace.src_port), port_ranges(ace.dst_port)))
+            tables = self.acls.get((sheet, ace.name))
+            if tables == None:
+                tables = self.acls[(sheet, ace.name)] = {'rows': [], 'src': {4: {}, 6: {}}, 'dst': {4: {}, 6: {}}}
+            tables['rows'].append(row_id)
+            for field, ranges in [('src', self.rows[-1][1]), ('dst', self.rows[-1][2])]:
+                for ver, first, last in ranges:
+                    for length, network in prefixes(ver, first, last):
+                        tables[field][ver].setdefault(length, {}).setdefault(network, []).append(row_id)
+
+    # LOOKUP: Lists of row ids (each in row order) of the prefixes holding the address, one dictionary lookup per prefix length in use
+    def lookup(self, table, addr):
+        found = []
+        for length, networks in table[addr.version].items():
+            row_ids = networks.get(int(addr) >> (BITS[addr.version] - length))
+            if row_ids != None:
+                found.append(row_ids)
+        return found
+
+    # MATCH: Returns every rule that matches in the format {device_sheet: {acl_name: [ace, ace]}} with the ACEs in the order of the ACL, so the
+    # first of each is the rule that would be hit (with first=True only that rule is found). Any of the fields not given (None) matches all rules
+    def match(self, src=None, dst=None, protocol=None, port=None, src_port=None, first=False):
+        src = ip_address(src) if src != None else None
+        dst = ip_address(dst) if dst != None else None
+        protocol = str(protocol).lower() if protocol != None else None
+        # Only TCP and UDP have ports, for any other protocol the ports are ignored
+        port = int(port) if port != None and protocol in [None, 'tcp', 'udp', '6', '17'] else None
+        src_port = int(src_port) if src_port != None and protocol in [None, 'tcp', 'udp', '6', '17'] else None
+        result = {}
+        for (sheet, acl_name), tables in self.acls.items():
+            # CANDIDATES: The row ids of whichever address matches the fewest rows of the ACL, merged into row order (only read up to the first
+            # match if first=True). With no addresses every row of the ACL is a candidate
+            candidates = [self.lookup(tables[field], addr) for field, addr in [('src', src), ('dst', dst)] if addr != None]
+            if len(candidates) == 0:
+                candidates = [[tables['rows']]]
+            row_ids = merge(*min(candidates, key=lambda found: sum(len(each_ids) for each_ids in found)))
+            last_id = None
+            for row_id in row_ids:
+                # The same row can be in more than one list (such as any is in both the IPv4 and IPv6 tables)
+                if row_id == last_id:
+                    continue
+                last_id = row_id
+                ace, src_ranges, dst_ranges, src_ports, dst_ports = self.rows[row_id]
+                if src != None and not addr_match(src_ranges, src.version, int(src)):
+                    continue
+                if dst != None and not addr_match(dst_ranges, dst.version, int(dst)):
+                    continue
+                if not proto_match(ace.protocol, protocol):
+                    continue
+                if port != None and ace.protocol not in ['icmp', 'icmp6'] and not in_ranges(dst_ports, port):
+                    continue
+                if src_port != None and not in_ranges(src_ports, src_port):
+                    continue
+                result.setdefault(sheet, {}).setdefault(acl_name, []).append(ace)
+                if first == True:
+                    break
+        return result
+
+    # FIRST: Returns only the first rule that matches (the one that would be hit) in the format {device_sheet: {acl_name: ace}}
+    def first(self, src=None, dst=None, protocol=None, port=None, src_port=None):
+        return {sheet: {acl_name: aces[0] for acl_name, aces in acls.items()} for sheet, acls in
+                self.match(src, dst, protocol, port, src_port, first=True).items()}
+
+
+################################## Read the expanded ACLs from a report ##################################
+# REPORT_ACL: Returns the expanded ACL sheets of a report (created with -f xlsx, csv, jsonl or parquet) as {device_sheet: rows}
+def report_acl(location, name, report_format):
+    acl = {}
+    if report_format == 'xlsx':
+        wb = load_workbook(os.path.join(location, name + '.xlsx'), read_only=True)
+        for ws in wb.worksheets:
+            # First 3 rows are the key and header, numbers are changed back to strings (such as the destination port)
+            if ws.title.endswith('_exp_acl'):
+                acl[ws.title] = [['' if cell == None else str(cell) for cell in row] for row in ws.iter_rows(min_row=4, values_only=True)]
+        return acl
+    for filename in sorted(glob.glob(os.path.join(location, '{}_*_exp_acl.{}'.format(glob.escape(name), report_format)))):
+        sheet = os.path.basename(filename)[len(name) + 1:-len(report_format) - 1]
+        if report_format == 'csv':
+            with open(filename, newline='') as file_content:
+                acl[sheet] = list(csv.reader(file_content))[1:]
+        elif report_format == 'jsonl':
+            with open(filename) as file_content:
+                acl[sheet] = [list(json.loads(line).values()) for line in file_content]
+        elif report_format == 'parquet' and pyarrow != None:
+            acl[sheet] = [list(row.values()) for row in pyarrow.parquet.read_table(filename).to_pylist()]
+    return acl
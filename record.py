@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+from sys import intern
+
+
+################################## ACE record ##################################
+# Every row of the ACL and expanded ACL (output of format_acl) is an ACE record rather than a 12 element list. The fields are slots (no per row
+# dictionary or list) with the line number and hit count as integers and all the strings interned, so values repeated across rows (ACL name,
+# action, protocol, 'any', 'any_port', dates, etc) are only held in memory once however many rows use them. It can still be read like the list
+# [name, num, permit/deny, protocol, src_ip/pfx, src_port, dst_ip/pfx, dst_port, hitcnt, last_hit_date, last_hit_time, state]
+class Ace:
+    __slots__ = ('name', 'num', 'action', 'protocol', 'src', 'src_port', 'dst', 'dst_port', 'hitcnt', 'date', 'time', 'state')
+
+    def __init__(self, name, num, action, protocol, src, src_port, dst, dst_port, hitcnt, date, time, state):
+        self.num, self.hitcnt = int(num), int(hitcnt)
+        # Interning all the fields in one go is the quickest, only if any are not strings (such as None from other FW types) is each checked
+        try:
+            self.name, self.action, self.protocol, self.src, self.src_port = intern(name), intern(action), intern(protocol), intern(src), intern(src_port)
+            self.dst, self.dst_port, self.date, self.time, self.state = intern(dst), intern(dst_port), intern(date), intern(time), intern(state)
+        except TypeError:
+            self.name, self.action, self.protocol, self.src, self.src_port = text(name), text(action), text(protocol), text(src), text(src_port)
+            self.dst, self.dst_port, self.date, self.time, self.state = text(dst), text(dst_port), text(date), text(time), text(state)
+
+    # Read like a list, for example ace[1] or list(ace)
+    def __iter__(self):
+        for field in self.__slots__:
+            yield getattr(self, field)
+
+    def __getitem__(self, index):
+        return getattr(self, self.__slots__[index])
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    # Is equal to another ACE or a list (or tuple) of the same values
+    def __eq__(self, other):
+        if isinstance(other, (Ace, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return 'Ace({})'.format(', '.join(repr(value) for value in self))
+
+    # Pickled as the values (rather than a dictionary of slots) so is small when passed from the format processes
+    def __reduce__(self):
+        return (Ace, tuple(self))
+
+# TEXT: Interns strings so each value is only held once, anything else (such as None from other FW types) is left as is
+def text(value):
+    return intern(value) if isinstance(value, str) else value
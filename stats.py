@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+import json
+import time
+import cProfile
+import pstats
+import tracemalloc
+from datetime import datetime
+from threading import Lock
+from contextlib import contextmanager
+
+
+################################## Run instrumentation ##################################
+# Opt-in (--stats or --profile) timing of each stage of the run (validate_creds, logon, gather_acls, create_report, logoff) and per device of
+# login, cache_key, refresh_hits, get_acls, format_acl and logoff. Per device it counts the API calls or SSH commands, bytes received and ACL rows.
+# Peak memory (tracemalloc) is per run stage as the devices are gathered at the same time so share the memory. Is saved as JSON next to the report
+enabled = False
+profile_stage = None
+run = {}
+profiles = []
+lock = Lock()
+devices = {}
+
+# START: Turns on the instrumentation, if profile is a stage name that stage is run under cProfile (all devices of it are combined)
+def start(profile=None):
+    global enabled, profile_stage
+    enabled, profile_stage = True, profile
+    run.update(date=datetime.now().isoformat(timespec='seconds'), stages={}, devices={})
+    tracemalloc.start()
+
+# STOP: Turns off the instrumentation, is run by the format worker processes as they inherit it when forked (only the main process is instrumented)
+def stop():
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+# DEVICE: Stats of a device, sid is so the API calls and SSH commands (only have the sid) can be matched to the device
+def device(fw_type, fw, sid=None):
+    with lock:
+        if fw not in run['devices']:
+            run['devices'][fw] = dict(fw_type=fw_type, stages={}, commands=0, bytes_received=0, rows=0)
+        if sid != None:
+            devices[id(sid)] = run['devices'][fw]
+    return run['devices'][fw]
+
+# PROFILE: Returns a profiler if the stage is being profiled, all the profiles of the stage are combined when saved
+def profiler(name):
+    if name != profile_stage:
+        return None
+    profile = cProfile.Profile()
+    with lock:
+        profiles.append(profile)
+    return profile
+
+# STAGE: Times a run stage or if fw is set a device stage (seconds are added together if the stage is run more than once for the device)
+@contextmanager
+def stage(name, fw_type=None, fw=None, sid=None):
+    if enabled == False:
+        yield
+        return
+    profile = profiler(name)
+    if fw == None:
+        tracemalloc.reset_peak()
+    else:
+        device(fw_type, fw, sid)
+    # From python 3.12 only one profiler can run at a time, if the devices overlap only the first is profiled
+    if profile != None:
+        try:
+            profile.enable()
+        except ValueError:
+            profile = None
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profile != None:
+            profile.disable()
+        seconds = time.perf_counter() - start_time
+        if fw == None:
+            run['stages'][name] = dict(seconds=round(seconds, 3), peak_mb=round(tracemalloc.get_traced_memory()[1] / 1000000, 1))
+        else:
+            add_time(fw_type, fw, name, seconds)
+
+# ADD_TIME: Adds the seconds to the device stage, is for time measured elsewhere (such as in the format worker processes)
+def add_time(fw_type, fw, name, seconds):
+    if enabled == False:
+        return
+    dvc = device(fw_type, fw)
+    with lock:
+        dvc['stages'][name] = round(dvc['stages'].get(name, 0) + seconds, 3)
+
+# TIMED: Returns func wrapped in a device stage, used for functions run by a worker pool (such as login)
+def timed(name, fw_type, fw, func):
+    def wrapper(*args, **kwargs):
+        with stage(name, fw_type, fw):
+            return func(*args, **kwargs)
+    return wrapper
+
+# COUNT: Adds an API call or SSH command to the device the sid belongs to, received is the output (str or bytes)
+def count(sid, received):
+    if enabled == False or id(sid) not in devices:
+        return
+    with lock:
+        devices[id(sid)]['commands'] += 1
+        devices[id(sid)]['bytes_received'] += len(received.encode() if isinstance(received, str) else received)
+
+# ROWS: Wraps each sheet of the format_acl output to count the rows, the time taken to create the rows (format_acl can return generators that
+# are only run as the report is written) is added to the devices format_acl stage
+def rows(fw_type, fw, acl):
+    if enabled == False:
+        return acl
+    return {sheet: sheet_rows(fw_type, fw, each_rows) for sheet, each_rows in acl.items()}
+
+def sheet_rows(fw_type, fw, each_rows):
+    dvc = device(fw_type, fw)
+    each_rows, seconds = iter(each_rows), 0
+    profile = profiler('format_acl')
+    while True:
+        start_time = time.perf_counter()
+        if profile != None:
+            profile.enable()
+        try:
+            ace = next(each_rows)
+        except StopIteration:
+            break
+        finally:
+            if profile != None:
+                profile.disable()
+            seconds += time.perf_counter() - start_time
+        dvc['rows'] += 1
+        yield ace
+    add_time(fw_type, fw, 'format_acl', seconds)
+
+# FW_TYPES: Totals of the device stats for each FW type
+def fw_types():
+    totals = {}
+    for dvc in run['devices'].values():
+        fw_type = totals.setdefault(dvc['fw_type'], dict(devices=0, stages={}, commands=0, bytes_received=0, rows=0))
+        fw_type['devices'] += 1
+        for name, seconds in dvc['stages'].items():
+            fw_type['stages'][name] = round(fw_type['stages'].get(name, 0) + seconds, 3)
+        for each_count in ['commands', 'bytes_received', 'rows']:
+            fw_type[each_count] += dvc[each_count]
+    return totals
+
+# SAVE: Saves the run report as 'filename_stats.json' and the profile of the stage (if profiled) as 'filename_stage.prof' (read with pstats or snakeviz)
+def save(filename):
+    if enabled == False:
+        return []
+    saved = [filename + '_stats.json']
+    with open(saved[0], 'w') as file_content:
+        peak_mb = max([each_stage['peak_mb'] for each_stage in run['stages'].values()] or [0])
+        json.dump(dict(run, fw_types=fw_types(), peak_mb=peak_mb), file_content, indent=2)
+    profiled = [profile for profile in profiles if profile.getstats() != []]
+    if len(profiled) != 0:
+        saved.append('{}_{}.prof'.format(filename, profile_stage))
+        pstats.Stats(*profiled).dump_stats(saved[1])
+    return saved
@@ -0,0 +1,67 @@
+import json
+import time
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Stub of the Checkpoint management API (over HTTP) so the API clients can be tested without a manager. Serves login, logout, show-access-layers
+# and the pages of show-access-rulebase from {policy_name: [rules]}, recording each API call and the most API calls being handled at once
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        command = self.path.split('/')[-1]
+        with self.server.lock:
+            self.server.calls.append((command, payload, time.monotonic()))
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        time.sleep(self.server.delay)
+        status, output = self.server.respond(command, payload, self.headers.get('X-chkp-sid'))
+        with self.server.lock:
+            self.server.active -= 1
+        content = json.dumps(output).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, policies, user='admin', pword='admin', delay=0):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.policies, self.user, self.pword, self.delay = policies, user, pword, delay
+        self.calls, self.active, self.max_active, self.lock = [], 0, 0, Lock()
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    # Address to use as the manager in the clients (IP:port)
+    @property
+    def fw(self):
+        return '{}:{}'.format(*self.server_address)
+
+    def respond(self, command, payload, sid):
+        if command == 'login':
+            if payload == {'user': self.user, 'password': self.pword}:
+                return 200, {'sid': 'stub-sid'}
+            return 400, {'code': 'err_login_failed', 'message': 'Authentication to server failed.'}
+        elif sid != 'stub-sid':
+            return 401, {'code': 'generic_err_wrong_session_id', 'message': 'Wrong session id [{}].'.format(sid)}
+        elif command == 'logout':
+            return 200, {'message': 'OK'}
+        elif command == 'show-access-layers':
+            return 200, {'access-layers': [{'name': policy} for policy in self.policies], 'total': len(self.policies)}
+        elif command == 'show-access-rulebase' and payload['name'] in self.policies:
+            rules = self.policies[payload['name']]
+            offset, limit = payload.get('offset', 0), payload.get('limit', 50)
+            page = rules[offset:offset + limit]
+            return 200, {'name': payload['name'], 'from': offset + 1, 'to': offset + len(page), 'total': len(rules), 'rulebase': page}
+        return 404, {'code': 'generic_err_object_not_found', 'message': 'Requested object not found'}
@@ -1,11 +1,42 @@
 import re
 import os
+import csv
+import copy
+import importlib
+import json
+import pickle
+import time
+from threading import Lock
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from rich.console import Console
+from openpyxl import load_workbook
 
 # From the named script import the functions to be tested
 from main import create_fw_dict
+import main
 import asa
 import ckp
+import cache
+import stats
+import query
+import analysis
+import history
+from datetime import datetime, timedelta
+from record import Ace
 from .example_acls import ckp_acl
+from .ckp_stub import StubServer
+
+
+# ASA_CHANNEL: Fake Netmiko connection, send_command returns the output of the command (from output) and records the prompt and timeout it waited for
+class AsaChannel:
+    def find_prompt(self):
+        self.prompts = getattr(self, 'prompts', 0) + 1
+        return 'asa#'
+    def send_command(self, cmd, expect_string=None, read_timeout=None):
+        self.sent = getattr(self, 'sent', []) + [(cmd, expect_string, read_timeout)]
+        return self.output(cmd)
 
 
 # INPUT_DATA: Tests that the input file of FWs is converted into corretc data-model format
@@ -31,56 +62,66 @@ def test_asa_format_data():
                 acl_brief.append(line)
 
     acl = asa.format_acl('1.1.1.1', acl_brief, acl_expanded)
-    assert acl['1.1.1.1_acl'] == [['stecap', '1', 'permit', 'ip', 'any', 'any_port', 'any', 'any_port', '0', '', '', ''] ,
-                                  ['stecap', '2', 'permit', 'tcp', '10.10.10.0/32', 'any_port', 'any', '443', '0', '', '', ''] ,
-                                  ['mgmt', '2', 'permit', 'icmp', 'any', 'any_port', 'any', 'echo', '13759', '', '', ''] ,
-                                  ['mgmt', '3', 'permit', 'icmp', '1.1.1.1/32', 'any_port', 'any', 'echo-reply', '0', '', '', ''] ,
-                                  ['mgmt', '4', 'permit', 'icmp', 'any', 'any_port', '2.2.2.2/32', 'unreachable', '3028', '', '', ''] ,
-                                  ['mgmt', '5', 'permit', 'icmp', '10.10.10.0/24', 'any_port', 'any', 'time-exceeded', '0', '', '', ''] ,
-                                  ['mgmt', '6', 'deny', 'icmp', 'any', 'any_port', 'any', 'any_port', '0', '', '', ''] ,
-                                  ['mgmt', '9', 'permit', 'tcp', '10.10.10.1/32', 'any_port', 'obj_67-68', 'any_port', '0', '', '', 'inactive'] ,
-                                  ['mgmt', '10', 'permit', 'tcp', 'any', '22', '20.20.20.0/24', '67-68', '9222', '', '', ''] ,
-                                  ['mgmt', '11', 'permit', 'tcp', '10.10.10.1/32', 'any_port', 'obj_67-68', 'any_port', '0', '', '', ''] ,
-                                  ['mgmt', '12', 'permit', 'tcp', '20.20.20.0/24', '22', 'any', '22', '1227', '', '', ''] ,
-                                  ['Outside_mpc', '1', 'permit', 'icmp', 'any', 'any_port', 'any', 'echo-reply', '30', '', '', ''] ,
-                                  ['Outside_mpc', '2', 'permit', 'ip', 'any', 'any_port', '185.4.167.128/28', 'any_port', '0', '', '', 'inactive'] ,
-                                  ['Outside_mpc', '3', 'permit', 'tcp', 'any', 'any_port', 'obj_dc1dmznpgp03', 'any_port', '114382', '', '', ''] ,
-                                  ['Outside_mpc', '4', 'permit', 'udp', 'obj_dc1dmznpgp03', 'any_port', 'obj_dc2dmzdns03', '53', '114382', '', '', ''] ,
-                                  ['Outside_mpc', '5', 'permit', 'svc-grp_TCPUDP', 'intf_Outside_mpc', 'any_port', 'grp_UMB_DNS', 'domain', '0', '', '', ''] ,
-                                  ['Outside_mpc', '6', 'deny', 'icmp', 'any', 'any_port', 'any', 'any_port', '0', '', '', ''] ,
-                                  ['outside', '2', 'deny', 'tcp', 'any', 'any_port', 'grp_HTTP_HTTPS', 'any_port', '0', '', '', ''] ,
-                                  ['outside', '3', 'deny', 'ip', 'any', 'any_port', 'grp_LOCAL_NETWORKS', 'any_port', '24876', '', '', '']]
-
-    assert acl['1.1.1.1_exp_acl'] == [['stecap', '1', 'permit', 'ip', 'any', 'any_port', 'any', 'any_port', '0', '', '', ''] ,
-                                      ['stecap', '2', 'permit', 'tcp', '10.10.10.0/32', 'any_port', 'any', '443', '0', '', '', ''] ,
-                                      ['stecap', '2', 'permit', 'tcp', 'any', 'any_port', '10.10.10.0/24', '443', '0', '', '', ''] ,
-                                      ['mgmt', '2', 'permit', 'icmp', 'any', 'any_port', 'any', 'echo', '13759', '', '', ''] ,
-                                      ['mgmt', '3', 'permit', 'icmp', '1.1.1.1/32', 'any_port', 'any', 'echo-reply', '0', '', '', ''] ,
-                                      ['mgmt', '4', 'permit', 'icmp', 'any', 'any_port', '2.2.2.2/32', 'unreachable', '3028', '', '', ''] ,
-                                      ['mgmt', '5', 'permit', 'icmp', '10.10.10.0/24', 'any_port', 'any', 'time-exceeded', '0', '', '', ''] ,
-                                      ['mgmt', '5', 'permit', 'icmp', 'any', 'any_port', '10.10.10.0/24', 'time-exceeded', '0', '', '', ''] ,
-                                      ['mgmt', '6', 'deny', 'icmp', 'any', 'any_port', 'any', 'any_port', '0', '', '', ''] ,
-                                      ['mgmt', '10', 'permit', 'tcp', 'any', '22', '20.20.20.0/24', '67-68', '9222', '', '', ''] ,
-                                      ['mgmt', '12', 'permit', 'tcp', '20.20.20.0/24', '22', 'any', '22', '1227', '', '', ''] ,
-                                      ['Outside_mpc', '1', 'permit', 'icmp', 'any', 'any_port', 'any', 'echo-reply', '30', '', '', ''] ,
-                                      ['Outside_mpc', '2', 'permit', 'ip', 'any', 'any_port', '185.4.167.128/28', 'any_port', '0', '', '', 'inactive'] ,
-                                      ['Outside_mpc', '3', 'permit', 'tcp', 'any', 'any_port', '10.255.111.85/32', 'https', '96119', '', '', ''] ,
-                                      ['Outside_mpc', '3', 'permit', 'tcp', 'any', 'any_port', '10.255.111.85/32', 'ldaps', '15681', '', '', ''] ,
-                                      ['Outside_mpc', '3', 'permit', 'tcp', 'any', 'any_port', '10.255.111.85/32', 'ldap', '2582', '', '', ''] ,
-                                      ['Outside_mpc', '4', 'permit', 'udp', '10.255.111.85/32', 'any_port', '10.255.211.211/32', '53', '114382', '', '', ''] ,
-                                      ['Outside_mpc', '5', 'permit', 'udp', 'intf_Outside_mpc', 'any_port', '10.255.120.14/32', 'domain', '0', '', '', ''] ,
-                                      ['Outside_mpc', '5', 'permit', 'tcp', 'intf_Outside_mpc', 'any_port', '10.255.120.14/32', 'domain', '0', '', '', ''] ,
-                                      ['Outside_mpc', '6', 'deny', 'icmp', 'any', 'any_port', 'any', 'any_port', '0', '', '', ''] ,
-                                      ['outside', '2', 'deny', 'tcp', 'any', 'www', 'any', 'any_port', '0', '', '', ''] ,
-                                      ['outside', '2', 'deny', 'tcp', 'any', 'https', 'any', 'any_port', '0', '', '', ''] ,
-                                      ['outside', '3', 'deny', 'ip', 'any', 'any_port', '10.10.10.0/24', 'any_port', '24876', '', '', ''] ,
-                                      ['outside', '3', 'deny', 'ip', 'any', 'any_port', '10.10.20.0/24', 'any_port', '0', '', '', '']]
-
-# CKP_FORMAT: Loads test ACLs and ensures that the ACL and Expanded ACL are output in the correct formated
-def test_ckp_format_data():
+    assert acl['1.1.1.1_acl'] == [['stecap', 1, 'permit', 'ip', 'any', 'any_port', 'any', 'any_port', 0, '', '', ''] ,
+                                  ['stecap', 2, 'permit', 'tcp', '10.10.10.0/32', 'any_port', 'any', '443', 0, '', '', ''] ,
+                                  ['mgmt', 2, 'permit', 'icmp', 'any', 'any_port', 'any', 'echo', 13759, '', '', ''] ,
+                                  ['mgmt', 3, 'permit', 'icmp', '1.1.1.1/32', 'any_port', 'any', 'echo-reply', 0, '', '', ''] ,
+                                  ['mgmt', 4, 'permit', 'icmp', 'any', 'any_port', '2.2.2.2/32', 'unreachable', 3028, '', '', ''] ,
+                                  ['mgmt', 5, 'permit', 'icmp', '10.10.10.0/24', 'any_port', 'any', 'time-exceeded', 0, '', '', ''] ,
+                                  ['mgmt', 6, 'deny', 'icmp', 'any', 'any_port', 'any', 'any_port', 0, '', '', ''] ,
+                                  ['mgmt', 9, 'permit', 'tcp', '10.10.10.1/32', 'any_port', 'obj_67-68', 'any_port', 0, '', '', 'inactive'] ,
+                                  ['mgmt', 10, 'permit', 'tcp', 'any', '22', '20.20.20.0/24', '67-68', 9222, '', '', ''] ,
+                                  ['mgmt', 11, 'permit', 'tcp', '10.10.10.1/32', 'any_port', 'obj_67-68', 'any_port', 0, '', '', ''] ,
+                                  ['mgmt', 12, 'permit', 'tcp', '20.20.20.0/24', '22', 'any', '22', 1227, '', '', ''] ,
+                                  ['Outside_mpc', 1, 'permit', 'icmp', 'any', 'any_port', 'any', 'echo-reply', 30, '', '', ''] ,
+                                  ['Outside_mpc', 2, 'permit', 'ip', 'any', 'any_port', '185.4.167.128/28', 'any_port', 0, '', '', 'inactive'] ,
+                                  ['Outside_mpc', 3, 'permit', 'tcp', 'any', 'any_port', 'obj_dc1dmznpgp03', 'any_port', 114382, '', '', ''] ,
+                                  ['Outside_mpc', 4, 'permit', 'udp', 'obj_dc1dmznpgp03', 'any_port', 'obj_dc2dmzdns03', '53', 114382, '', '', ''] ,
+                                  ['Outside_mpc', 5, 'permit', 'svc-grp_TCPUDP', 'intf_Outside_mpc', 'any_port', 'grp_UMB_DNS', 'domain', 0, '', '', ''] ,
+                                  ['Outside_mpc', 6, 'deny', 'icmp', 'any', 'any_port', 'any', 'any_port', 0, '', '', ''] ,
+                                  ['outside', 2, 'deny', 'tcp', 'any', 'any_port', 'grp_HTTP_HTTPS', 'any_port', 0, '', '', ''] ,
+                                  ['outside', 3, 'deny', 'ip', 'any', 'any_port', 'grp_LOCAL_NETWORKS', 'any_port', 24876, '', '', '']]
+
+    assert acl['1.1.1.1_exp_acl'] == [['stecap', 1, 'permit', 'ip', 'any', 'any_port', 'any', 'any_port', 0, '', '', ''] ,
+                                      ['stecap', 2, 'permit', 'tcp', '10.10.10.0/32', 'any_port', 'any', '443', 0, '', '', ''] ,
+                                      ['stecap', 2, 'permit', 'tcp', 'any', 'any_port', '10.10.10.0/24', '443', 0, '', '', ''] ,
+                                      ['mgmt', 2, 'permit', 'icmp', 'any', 'any_port', 'any', 'echo', 13759, '', '', ''] ,
+                                      ['mgmt', 3, 'permit', 'icmp', '1.1.1.1/32', 'any_port', 'any', 'echo-reply', 0, '', '', ''] ,
+                                      ['mgmt', 4, 'permit', 'icmp', 'any', 'any_port', '2.2.2.2/32', 'unreachable', 3028, '', '', ''] ,
+                                      ['mgmt', 5, 'permit', 'icmp', '10.10.10.0/24', 'any_port', 'any', 'time-exceeded', 0, '', '', ''] ,
+                                      ['mgmt', 5, 'permit', 'icmp', 'any', 'any_port', '10.10.10.0/24', 'time-exceeded', 0, '', '', ''] ,
+                                      ['mgmt', 6, 'deny', 'icmp', 'any', 'any_port', 'any', 'any_port', 0, '', '', ''] ,
+                                      ['mgmt', 10, 'permit', 'tcp', 'any', '22', '20.20.20.0/24', '67-68', 9222, '', '', ''] ,
+                                      ['mgmt', 12, 'permit', 'tcp', '20.20.20.0/24', '22', 'any', '22', 1227, '', '', ''] ,
+                                      ['Outside_mpc', 1, 'permit', 'icmp', 'any', 'any_port', 'any', 'echo-reply', 30, '', '', ''] ,
+                                      ['Outside_mpc', 2, 'permit', 'ip', 'any', 'any_port', '185.4.167.128/28', 'any_port', 0, '', '', 'inactive'] ,
+                                      ['Outside_mpc', 3, 'permit', 'tcp', 'any', 'any_port', '10.255.111.85/32', 'https', 96119, '', '', ''] ,
+                                      ['Outside_mpc', 3, 'permit', 'tcp', 'any', 'any_port', '10.255.111.85/32', 'ldaps', 15681, '', '', ''] ,
+                                      ['Outside_mpc', 3, 'permit', 'tcp', 'any', 'any_port', '10.255.111.85/32', 'ldap', 2582, '', '', ''] ,
+                                      ['Outside_mpc', 4, 'permit', 'udp', '10.255.111.85/32', 'any_port', '10.255.211.211/32', '53', 114382, '', '', ''] ,
+                                      ['Outside_mpc', 5, 'permit', 'udp', 'intf_Outside_mpc', 'any_port', '10.255.120.14/32', 'domain', 0, '', '', ''] ,
+                                      ['Outside_mpc', 5, 'permit', 'tcp', 'intf_Outside_mpc', 'any_port', '10.255.120.14/32', 'domain', 0, '', '', ''] ,
+                                      ['Outside_mpc', 6, 'deny', 'icmp', 'any', 'any_port', 'any', 'any_port', 0, '', '', ''] ,
+                                      ['outside', 2, 'deny', 'tcp', 'any', 'www', 'any', 'any_port', 0, '', '', ''] ,
+                                      ['outside', 2, 'deny', 'tcp', 'any', 'https', 'any', 'any_port', 0, '', '', ''] ,
+                                      ['outside', 3, 'deny', 'ip', 'any', 'any_port', '10.10.10.0/24', 'any_port', 24876, '', '', ''] ,
+                                      ['outside', 3, 'deny', 'ip', 'any', 'any_port', '10.10.20.0/24', 'any_port', 0, '', '', '']]
+
+# ASA_IPV6: Ensures IPv6 hosts are a /128 and IPv6 prefixes are unchanged
+def test_asa_ipv6_host():
+    acl_expanded = ('access-list v6 line 1 extended permit tcp host 2001:db8::1 host 2001:db8::2 eq www (hitcnt=0) 0x4d69e4a3\n'
+                    'access-list v6 line 2 extended permit tcp 2001:db8::/32 host 10.1.1.1 eq www (hitcnt=0) 0x4c1d46ce')
+    acl = asa.format_acl('1.1.1.1', [], acl_expanded)
+    assert [list(ace)[4:8] for ace in acl['1.1.1.1_exp_acl']] == [['2001:db8::1/128', 'any_port', '2001:db8::2/128', 'www'],
+                                                                 ['2001:db8::/32', 'any_port', '10.1.1.1/32', 'www']]
+
+# CKP_FORMAT: Loads test ACLs and ensures that the ACL and Expanded ACL are output in the correct formated (ranges kept as start-end)
+def test_ckp_format_data(monkeypatch):
+    monkeypatch.setattr(ckp, 'range_mode', 'ranges')
     acl_brief =  ckp_acl.acl_brief
     acl_expanded = ckp_acl.acl_expanded
-    acl = ckp.format_acl('1.1.1.1', acl_brief, acl_expanded)
+    # format_acl returns generators so the rows are read into lists to be compared
+    acl = {dvc: list(rows) for dvc, rows in ckp.format_acl('1.1.1.1', acl_brief, acl_expanded).items()}
     assert acl['1.1.1.1_acl'] == [['appctrl', 1, 'Accept', 'app', 'net_10.0.0.0', 'any_port', 'Internet', 'Office365', 16729509098, '2021-05-20', '19:11:33', ''],
                                   ['appctrl', 2, 'Accept', 'app', 'net_172.16.0.0', 'any_port', 'Internet', 'Facebook', 0, '', '', ''],
                                   ['appctrl', 2, 'Accept', 'app', 'net_172.16.0.0', 'any_port', 'Internet', 'Facebook Apps', 0, '', '', ''],
@@ -252,3 +293,419 @@ def test_ckp_format_data():
                                       ['Network',  9,  'POLICY_inline_app_ctrl',  'tcp',  '172.16.0.0/12',  'any_port',  'any',  '8080',  3495974,  '2021-05-20',  '20:28:09',  ''],
                                       ['Network',  9,  'POLICY_inline_app_ctrl',  'tcp',  '172.16.0.0/12',  'any_port',  'any',  '443',  3495974,  '2021-05-20',  '20:28:09',  ''],
                                       ['Network',  9,  'POLICY_inline_app_ctrl',  'tcp',  '172.16.0.0/12',  'any_port',  'any',  '80',  3495974,  '2021-05-20',  '20:28:09',  '']]
+
+# CKP_DICTIONARY: Single download rulebase (object UIDs and object dictionary) produces the ACL and the expanded ACL built from the group members
+def test_ckp_format_dictionary(monkeypatch):
+    monkeypatch.setattr(ckp, 'range_mode', 'ranges')
+    objs = [dict(uid='h1', name='h1', type='host', **{'ipv4-address': '10.1.1.1'}),
+            dict(uid='n1', name='n1', type='network', subnet4='10.2.0.0', **{'mask-length4': 16}),
+            dict(uid='r1', name='r1', type='address-range', **{'ipv4-address-first': '10.3.0.1', 'ipv4-address-last': '10.3.0.9'}),
+            dict(uid='https', name='https', type='service-tcp', port='443'), dict(uid='dns', name='domain-udp', type='service-udp', port='53'),
+            dict(uid='any', name='Any', type='CpmiAnyObject'), dict(uid='inet', name='Internet', type='Internet'),
+            dict(uid='acc', name='Accept', type='RulebaseAction'), dict(uid='drp', name='Drop', type='RulebaseAction')]
+    groups = {'g1': dict(uid='g1', name='G1', type='group', members=[dict(uid='n1', name='n1', type='network'), dict(uid='h1', name='h1', type='host'),
+                                                                     dict(uid='g2', name='G2', type='group')]),
+              'g2': dict(uid='g2', name='G2', type='group', members=[dict(uid='r1', name='r1', type='address-range'), dict(uid='h1', name='h1', type='host')]),
+              'sg1': dict(uid='sg1', name='SG1', type='service-group', members=['https', 'dns'])}
+    def rule(num, src, dst, svc, action, hits, enabled):
+        return {'type': 'access-rule', 'rule-number': num, 'source': src, 'source-negate': False, 'destination': dst, 'destination-negate': False,
+                'service': svc, 'service-negate': False, 'action': action, 'hits': {'value': hits}, 'enabled': enabled}
+    acl_brief = [{'name': 'pol', 'objects-dictionary': objs, 'rulebase': [rule(1, ['h1'], ['g1'], ['sg1'], 'acc', 5, True),
+                 {'type': 'access-section', 'rulebase': [rule(2, ['any'], ['inet'], ['any'], 'drp', 0, False)]}]}]
+
+    acl = {dvc: list(rows) for dvc, rows in ckp.format_acl('1.1.1.1', acl_brief, groups).items()}
+    # The raw pages are released once they have been read
+    assert acl_brief == []
+    assert acl['1.1.1.1_acl'] == [['pol', 1, 'Accept', 'svc-grp', 'hst_h1', 'any_port', 'grp_G1', 'SG1', 5, '', '', ''],
+                                  ['pol', 2, 'Drop', 'any', 'Any', 'any_port', 'Internet', 'any', 0, '', '', 'Inactive']]
+    assert acl['1.1.1.1_exp_acl'] == [['pol', 1, 'Accept', 'tcp', '10.1.1.1/32', 'any_port', '10.2.0.0/16', '443', 5, '', '', ''],
+                                      ['pol', 1, 'Accept', 'udp', '10.1.1.1/32', 'any_port', '10.2.0.0/16', '53', 5, '', '', ''],
+                                      ['pol', 1, 'Accept', 'tcp', '10.1.1.1/32', 'any_port', '10.1.1.1/32', '443', 5, '', '', ''],
+                                      ['pol', 1, 'Accept', 'udp', '10.1.1.1/32', 'any_port', '10.1.1.1/32', '53', 5, '', '', ''],
+                                      ['pol', 1, 'Accept', 'tcp', '10.1.1.1/32', 'any_port', '10.3.0.1-10.3.0.9', '443', 5, '', '', ''],
+                                      ['pol', 1, 'Accept', 'udp', '10.1.1.1/32', 'any_port', '10.3.0.1-10.3.0.9', '53', 5, '', '', ''],
+                                      ['pol', 2, 'Drop', 'any', 'any', 'any_port', 'Internet', 'any', 0, '', '', 'Inactive']]
+
+# CKP_NORM_IP: IPv4 and IPv6 ranges are split into the fewest prefixes (or kept as start-end ranges) and any is only added once
+def test_ckp_normalise_ip(monkeypatch):
+    ranges = {'ipv4': [dict(start='10.3.0.1', end='10.3.0.9'), dict(start='10.2.0.0', end='10.2.255.255'), dict(start='10.1.1.1', end='10.1.1.1'),
+                       dict(start='0.0.0.0', end='255.255.255.255')],
+              'ipv6': [dict(start='2001:db8::', end='2001:db8::ff'), dict(start='2001:db8::1:0', end='2001:db8::1:2'),
+                       dict(start='::', end='ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff')], 'others': []}
+    assert ckp.normalise_ip(ranges) == ['10.3.0.1/32', '10.3.0.2/31', '10.3.0.4/30', '10.3.0.8/31', '10.2.0.0/16', '10.1.1.1/32', 'any',
+                                        '2001:db8::/120', '2001:db8::1:0/127', '2001:db8::1:2/128']
+    monkeypatch.setattr(ckp, 'range_mode', 'ranges')
+    assert ckp.normalise_ip(ranges) == ['10.3.0.1-10.3.0.9', '10.2.0.0/16', '10.1.1.1/32', 'any', '2001:db8::/120', '2001:db8::1:0-2001:db8::1:2']
+    assert ckp.range_prefixes('10.3.0.9', '10.3.0.1') == ('10.3.0.9-10.3.0.1',)
+    assert ckp.range_prefixes.cache_info().hits != 0
+
+# QUERY: Finds the first (and all) matching rules of each ACL from the expanded ACLs, directly and from a CSV report with the query subcommand
+def test_query(tmp_path, monkeypatch, capsys):
+    with open(os.path.join(os.path.dirname(__file__), 'example_acls', 'asa_acl_expanded.txt')) as file_content:
+        acl = asa.format_acl('1.1.1.1', [], file_content.read())
+    acl['2.2.2.2_exp_acl'] = [['pol', 1, 'Drop', 'tcp', 'NOT_10.0.0.0/8', 'any_port', 'any', '>1023', 0, '', '', ''],
+                              ['pol', 2, 'Accept', 'udp', '10.0.0.0/8', 'any_port', '2001:db8::/32', 'domain', 0, '', '', ''],
+                              ['pol', 3, 'Accept', 'any', 'hst_h1', 'any_port', '10.10.20.0-10.10.20.9', 'any', 0, '', '', '']]
+    index = query.Index(acl)
+    assert index.sheets == ['1.1.1.1_exp_acl', '2.2.2.2_exp_acl']
+    # Object names (hst_h1) can't be matched to an address
+    assert index.first('10.10.10.5', '10.10.20.1', 'tcp', 443) == {'1.1.1.1_exp_acl': {
+        'stecap': ['stecap', 1, 'permit', 'ip', 'any', 'any_port', 'any', 'any_port', 0, '', '', ''],
+        'outside': ['outside', 2, 'deny', 'tcp', 'any', 'www', 'any', 'any_port', 0, '', '', '']}}
+    assert index.first(dst='10.10.20.1', protocol='tcp', port=443)['2.2.2.2_exp_acl']['pol'][1] == 3
+    # Source port no longer matches the www source port rule, negated source and port ranges
+    assert index.first('10.10.10.5', '10.10.20.1', 'tcp', 443, src_port=50000)['1.1.1.1_exp_acl']['outside'][1] == 3
+    assert index.first('192.168.1.1', '10.10.20.1', 'tcp', 8080)['2.2.2.2_exp_acl']['pol'][1] == 1
+    assert index.first('10.1.1.1', '2001:db8::53', 'udp', 53) == {'1.1.1.1_exp_acl': {'stecap': index.rows[0][0]},
+                                                                  '2.2.2.2_exp_acl': {'pol': index.rows[-2][0]}}
+    assert [ace[1] for ace in index.match(dst='10.10.10.1', protocol='icmp')['1.1.1.1_exp_acl']['mgmt']] == [2, 3, 5, 5, 6]
+
+    main.rc = Console()
+    main.create_report(dict(format='csv', location=str(tmp_path), name='report'), acl)
+    monkeypatch.setattr('sys.argv', ['main.py', '-l', str(tmp_path), '-n', 'report', '-f', 'csv', 'query', '-d', '10.10.20.1', '-p', 'tcp',
+                                     '--port', '443', '--all'])
+    with pytest.raises(SystemExit):
+        main.main()
+    assert '6 matching rules on 2 of the 2 devices' in capsys.readouterr().out
+
+# ANALYSIS: Rules covered by earlier rules are shadowed (different action) or redundant (same action), partial overlaps with a different action
+# are correlated. A later rule that covers an earlier one (such as a deny any at the end) and rules with object names or inactive are not reported
+def test_analysis(tmp_path):
+    rows = [['acl', 1, 'permit', 'tcp', '10.1.0.0/16', 'any_port', 'any', '443', 5, '', '', ''],
+            ['acl', 2, 'deny', 'tcp', '10.1.1.0/24', 'any_port', '10.9.9.9/32', 'https', 0, '', '', ''],
+            ['acl', 3, 'permit', 'tcp', '10.1.2.1/32', 'any_port', '10.9.9.0/24', '443', 0, '', '', ''],
+            ['acl', 3, 'permit', 'tcp', '10.1.2.0/30', 'any_port', '10.9.9.0/24', 'https', 0, '', '', ''],
+            ['acl', 4, 'permit', 'tcp-udp', '10.1.2.1/32', 'any_port', '10.9.9.0/24', '1-1024', 0, '', '', ''],
+            ['acl', 5, 'deny', 'ip', '10.0.0.0/8', 'any_port', '10.9.0.0/16', 'any_port', 0, '', '', ''],
+            ['acl', 6, 'permit', 'tcp', '10.1.3.0/24', 'any_port', '10.9.9.0/24', '443', 0, '', '', 'inactive'],
+            ['acl', 7, 'permit', 'tcp', 'grp_servers', 'any_port', '10.9.9.0/24', '443', 0, '', '', ''],
+            ['acl', 8, 'deny', 'ip', 'any', 'any_port', 'any', 'any_port', 9, '', '', ''],
+            ['other', 1, 'deny', 'tcp', '10.1.1.0/24', 'any_port', '10.9.9.9/32', '443', 0, '', '', '']]
+    assert analysis.findings([Ace(*row) for row in rows]) == [['acl', 2, 'deny', 'shadowed', '1 (permit)', 0],
+                                                              ['acl', 3, 'permit', 'redundant', '1 (permit)', 0],
+                                                              ['acl', 5, 'deny', 'correlated', '1 (permit)', 0]]
+    filename = os.path.join(tmp_path, 'findings.csv')
+    analysis.write_findings(filename, analysis.findings(rows))
+    assert open(filename).read().splitlines()[:2] == [','.join(analysis.findings_header), 'acl,2,deny,shadowed,1 (permit),0']
+
+# HISTORY: Rows are saved (in batches) as they are read, the stale rules and hit count changes are compared across the runs
+def test_history(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(history, 'batch_rows', 2)
+    db = os.path.join(tmp_path, 'history.db')
+    store = history.connect(db)
+    def run(days_ago, hits):
+        acl = {'1.1.1.1_acl': iter([Ace('acl', num, 'permit', 'ip', 'any', 'any_port', 'any', 'any_port', hitcnt, '', '', '') for num, hitcnt in hits]),
+               '1.1.1.1_exp_acl': iter([['acl', 1, 'permit', 'ip', '10.1.1.0/24', 'any_port', 'any', 'any_port', '0', '', '', '']])}
+        saved = history.save(store, 'report', acl, datetime.now() - timedelta(days=days_ago))
+        return {sheet: list(rows) for sheet, rows in saved.items()}
+    run(120, [(1, 5), (2, 0), (3, 7)])
+    run(60, [(1, 9), (2, 0), (3, 7)])
+    assert run(0, [(1, 9), (2, 0), (3, 8), (4, 0)])['1.1.1.1_acl'][3] == ['acl', 4, 'permit', 'ip', 'any', 'any_port', 'any', 'any_port', 0, '', '', '']
+    assert store.execute('SELECT COUNT(*) FROM aces').fetchone()[0] == 13
+    # Rule 1 was last hit 60 days ago, 2 never and 4 is new (only in the last run so is not stale)
+    assert [rule[2] for rule in history.stale_rules(store, 90)] == [2]
+    assert history.stale_rules(store, 30)[0][2:5] + history.stale_rules(store, 30)[0][6:] == [1, 'permit', 9, 2]
+    assert [rule[2] for rule in history.stale_rules(store, 30)] == [1, 2]
+    assert [rule[2] for rule in history.stale_rules(store, 90, num_runs=2)] == [1, 2]
+    assert history.hit_deltas(store) == [['1.1.1.1', 'acl', 1, 'permit', 9, 9, 0], ['1.1.1.1', 'acl', 2, 'permit', 0, 0, 0],
+                                         ['1.1.1.1', 'acl', 3, 'permit', 7, 8, 1], ['1.1.1.1', 'acl', 4, 'permit', None, 0, None]]
+    store.close()
+
+    main.rc = Console(width=200)
+    monkeypatch.setattr(history, 'print_rows', 1)
+    monkeypatch.setattr('sys.argv', ['main.py', '-l', str(tmp_path), '-n', 'report', '--history', db, 'history', '--stale', '30'])
+    with pytest.raises(SystemExit):
+        main.main()
+    assert '2 rules from the history database' in capsys.readouterr().out
+    with open(os.path.join(tmp_path, 'report_stale.csv')) as file_content:
+        assert [row[2] for row in csv.reader(file_content)] == ['Line Number', '1', '2']
+
+# REPORT_FORMAT: Ensures the CSV and JSON Lines files are created with the header and integer line number and hit count
+def test_report_format(tmp_path, monkeypatch):
+    main.rc = Console()
+    acl = {'1.1.1.1_acl': iter([['stecap', '1', 'permit', 'tcp', 'any', 'any_port', '10.1.1.1/32', '443', '7', '', '', '']])}
+    main.create_report(dict(format='csv', location=str(tmp_path), name='report'), acl)
+    assert open(os.path.join(tmp_path, 'report_1.1.1.1_acl.csv')).read().splitlines() == [','.join(main.header),
+                                                                    'stecap,1,permit,tcp,any,any_port,10.1.1.1/32,443,7,,,']
+    acl = {'1.1.1.1_acl': iter([['stecap', '1', 'permit', 'tcp', 'any', 'any_port', '10.1.1.1/32', '443', '7', '', '', '']])}
+    main.create_report(dict(format='jsonl', location=str(tmp_path), name='report'), acl)
+    with open(os.path.join(tmp_path, 'report_1.1.1.1_acl.jsonl')) as file_content:
+        assert [json.loads(line) for line in file_content] == [dict(zip(main.header, ['stecap', 1, 'permit', 'tcp', 'any', 'any_port', '10.1.1.1/32',
+                                                                                       '443', 7, '', '', '']))]
+    # Parquet is only a choice if pyarrow is installed
+    monkeypatch.setattr(main, 'pyarrow', None)
+    monkeypatch.setattr('sys.argv', ['main.py', '-f', 'parquet'])
+    with pytest.raises(SystemExit):
+        main.create_parser()
+
+# REPORT_FAILED: Ensures a device whose rows fail to be created (are created as the report is written) is left out of the report, the other devices are still written
+def test_report_failed_device(tmp_path, monkeypatch):
+    monkeypatch.setattr(ckp, 'range_mode', 'ranges')
+    main.rc = Console()
+    # A Checkpoint rule without hits. The fixture is reloaded as format_acl releases the pages of the ACLs it is given (in other tests)
+    importlib.reload(ckp_acl)
+    acl_brief = copy.deepcopy(ckp_acl.acl_brief)
+    del acl_brief[0]['rulebase'][0]['rulebase'][0]['hits']
+    for report_format in ['xlsx', 'csv']:
+        acl = dict(ckp.format_acl('1.1.1.1', copy.deepcopy(ckp_acl.acl_brief), copy.deepcopy(ckp_acl.acl_expanded)))
+        acl.update(ckp.format_acl('2.2.2.2', copy.deepcopy(acl_brief), copy.deepcopy(ckp_acl.acl_expanded)))
+        acl.update({'3.3.3.3_acl': iter([['stecap', '1', 'permit', 'tcp', 'any', 'any_port', '10.1.1.1/32', '443', '7', '', '', '']])})
+        main.create_report(dict(format=report_format, location=str(tmp_path), name='report'), acl)
+        if report_format == 'xlsx':
+            assert load_workbook(os.path.join(tmp_path, 'report.xlsx')).sheetnames == ['1.1.1.1_acl', '1.1.1.1_exp_acl', '3.3.3.3_acl']
+        else:
+            assert sorted(os.listdir(tmp_path))[1:] == ['report_1.1.1.1_acl.csv', 'report_1.1.1.1_exp_acl.csv', 'report_3.3.3.3_acl.csv']
+
+# CACHE: Ensures cached ACLs are only returned for the same key and old cached ACLs are removed
+def test_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'cache_dir', str(tmp_path))
+    cache.save('asa', '10.10.10.1', 'key1', ['4931fac3 f081f39e 00006128 5e6047e5'], 'show access-list output')
+    assert cache.load('asa', '10.10.10.1', 'key1') == dict(fw_type='asa', fw='10.10.10.1', key='key1', acl_brief=['4931fac3 f081f39e 00006128 5e6047e5'],
+                                                           acl_expanded='show access-list output')
+    assert cache.load('asa', '10.10.10.1', 'key2') == None
+    assert cache.load('asa', '10.10.10.1')['key'] == 'key1'
+    assert cache.load('asa', '10.10.10.2', 'key1') == None
+    # The cached ACLs are the devices config so only the user can read them
+    assert os.stat(cache.cache_file('asa', '10.10.10.1')).st_mode & 0o777 == 0o600
+    os.utime(cache.cache_file('asa', '10.10.10.1'), (0, 0))
+    cache.evict()
+    assert cache.load('asa', '10.10.10.1', 'key1') == None
+
+# CACHE_KEY: Ensures the key is only got once per device when the cached ACLs no longer match it (refresh_hits returns None)
+def test_cache_key_once(tmp_path, monkeypatch):
+    class FwType:
+        keys = 0
+        def cache_key(fw, sid):
+            FwType.keys += 1
+            return 'key1'
+        def refresh_hits(fw, sid, acl_brief, acl_expanded):
+            return None
+        def get_acls(fw, sid):
+            return [], ''
+        def format_acl(fw, acl_brief, acl_expanded):
+            return {fw + '_acl': [], fw + '_exp_acl': []}
+    monkeypatch.setattr(cache, 'cache_dir', str(tmp_path))
+    main.rc = Console()
+    cache.save('fw', '1.1.1.1', 'key1', [], '')
+    args = dict(no_cache=False, hits_only=False, capture=None)
+    assert main.collect_acl(args, {'fw': FwType}, 'fw', '1.1.1.1', None, nullcontext())[0] == True
+    assert FwType.keys == 1
+    # HITS_ONLY only gets the key if the cached ACLs have to be gathered again
+    assert main.collect_acl(dict(args, hits_only=True), {'fw': FwType}, 'fw', '1.1.1.1', None, nullcontext())[0] == True
+    assert FwType.keys == 2
+
+# ASA_HITS: Ensures the hitcnts of expanded ACEs and their object-group ACE are updated from the brief (ACEs not in the brief have no hits)
+def test_asa_update_hits():
+    acl_brief = ['4931fac3 f081f39e 0000000a 5e6047e5', 'e0db7aa9 f081f39e 00000005 5e6047e5', '4d69e4a3 00000000 00000001 5e56e683']
+    acl_expanded = ('access-list outside line 3 extended deny ip any object-group LOCAL_NETWORKS (hitcnt=24876) 0xf081f39e\n'
+                    '  access-list outside line 3 extended deny ip any 10.10.10.0 255.255.255.0 (hitcnt=24876) 0x4931fac3\n'
+                    '  access-list outside line 3 extended deny ip any 10.10.20.0 255.255.255.0 (hitcnt=0) 0xe0db7aa9\n'
+                    'access-list mgmt line 1 extended permit tcp any any eq ssh (hitcnt=7) 0x4d69e4a3\n'
+                    'access-list mgmt line 2 extended permit tcp any any eq https inactive (hitcnt=7) (inactive) 0x4c1d46ce')
+    assert [line.split('(hitcnt=')[1] for line in asa.update_hits(acl_brief, acl_expanded).splitlines()] == ['15) 0xf081f39e', '10) 0x4931fac3',
+                                                                                                     '5) 0xe0db7aa9', '1) 0x4d69e4a3', '0) (inactive) 0x4c1d46ce']
+
+# CKP_HITS: Ensures the hits got from the manager are added to the cached rules by policy and rule UID, or None if the rules have changed
+def test_ckp_refresh_hits():
+    class Response:
+        status_code = 200
+        def __init__(self, data):
+            self.data = data
+        def json(self):
+            return self.data
+    # Returns the pages of the rules (in place of the ApiClient)
+    class Client:
+        def __init__(self, rules):
+            self.rules = rules
+        def post(self, command, payload):
+            if command == 'show-access-layers':
+                return Response({'access-layers': [{'name': 'pol'}]})
+            return Response({'name': 'pol', 'total': len(self.rules), 'rulebase': self.rules[payload['offset']:payload['offset'] + payload['limit']]})
+
+    def rule(uid, hits):
+        return {'type': 'access-rule', 'uid': uid, 'hits': {'value': hits}}
+    acl_brief = [{'name': 'pol', 'rulebase': [rule('r1', 1), {'type': 'access-section', 'rulebase': [rule('r2', 2)]}]}]
+    acl_expanded = [{'name': 'pol', 'rulebase': [rule('r1', 1), rule('r2', 2)]}]
+    assert ckp.refresh_hits('1.1.1.1', Client([rule('r1', 10), rule('r2', 20)]), acl_brief, acl_expanded) == (
+           [{'name': 'pol', 'rulebase': [rule('r1', 10), {'type': 'access-section', 'rulebase': [rule('r2', 20)]}]}],
+           [{'name': 'pol', 'rulebase': [rule('r1', 10), rule('r2', 20)]}])
+    assert ckp.refresh_hits('1.1.1.1', Client([rule('r1', 10), rule('r3', 20)]), acl_brief, acl_expanded) == None
+
+# ASA_REFRESH: Ensures only the brief of each cached ACL is got and None is returned if an ACL has changed (ACE hash not cached or different number
+# of elements) or is gone
+def test_asa_refresh_hits():
+    class Sid(AsaChannel):
+        def __init__(self, brief):
+            self.brief, self.cmds = brief, []
+        def output(self, cmd):
+            self.cmds.append(cmd)
+            return self.brief.get(cmd.split(' ')[2], '')
+    acl_expanded = ('access-list mgmt line 1 extended permit tcp any any eq ssh (hitcnt=7) 0x4d69e4a3\n'
+                    'access-list data line 1 extended permit ip any any (hitcnt=0) 0x4c1d46ce')
+    sid = Sid({'mgmt': 'access-list mgmt; 1 elements; name hash: 0xaccf654f\n4d69e4a3 00000000 00000009 5e56e683',
+               'data': 'access-list data; 1 elements; name hash: 0xdb877718'})
+    assert asa.refresh_hits('1.1.1.1', sid, [], acl_expanded) == (['4d69e4a3 00000000 00000009 5e56e683'], acl_expanded.replace('=7', '=9'))
+    assert sid.cmds == ['show access-list mgmt brief', 'show access-list data brief']
+    sid.brief['mgmt'] = 'access-list mgmt; 1 elements; name hash: 0xaccf654f\n4d69e4a4 00000000 00000009 5e56e683'
+    assert asa.refresh_hits('1.1.1.1', sid, [], acl_expanded) == None
+    del sid.brief['mgmt']
+    assert asa.refresh_hits('1.1.1.1', sid, [], acl_expanded) == None
+    # An ACE with no hits added to or removed from an ACL is only in the number of elements, an object-group ACE is counted by its expanded ACEs
+    sid.brief['mgmt'] = 'access-list mgmt; 1 elements; name hash: 0xaccf654f\n4d69e4a3 00000000 00000009 5e56e683'
+    sid.brief['data'] = 'access-list data; 2 elements; name hash: 0xdb877718'
+    assert asa.refresh_hits('1.1.1.1', sid, [], acl_expanded) == None
+    acl_expanded += ('\naccess-list data line 2 extended deny tcp any object-group WEB any (hitcnt=0) 0xc1c8b23d\n'
+                     '  access-list data line 2 extended deny tcp any eq www any (hitcnt=0) 0x380c90d9\n'
+                     '  access-list data line 2 extended deny tcp any eq https any (hitcnt=0) 0xb29d4647')
+    sid.brief['data'] = 'access-list data; 3 elements; name hash: 0xdb877718'
+    assert asa.refresh_hits('1.1.1.1', sid, [], acl_expanded) != None
+    sid.brief['data'] = 'access-list data; 2 elements; name hash: 0xdb877718'
+    assert asa.refresh_hits('1.1.1.1', sid, [], acl_expanded) == None
+
+# ASA_COMMANDS: Ensures the prompt is only found once, each command waits for it with its own timeout and the output is in the command order
+def test_asa_send_commands():
+    class Sid(AsaChannel):
+        def output(self, cmd):
+            return {'show run access-group': 'access-group outside in interface outside\naccess-group mgmt in interface mgmt'}.get(cmd, '')
+    sid = Sid()
+    assert asa.send_commands(sid, ['show run access-group', 'show run | in match address', 'show run access-group']) == [
+           'access-group outside in interface outside\naccess-group mgmt in interface mgmt', '',
+           'access-group outside in interface outside\naccess-group mgmt in interface mgmt']
+    assert sid.prompts == 1
+    assert sid.sent[1] == ('show run | in match address', r'asa\#', asa.read_timeout)
+    asa.get_acls('1.1.1.1', sid)
+    assert sid.sent[-1] == (asa.SHOW_ACL, r'asa\#', asa.acl_read_timeout)
+    # ACL names are got from the access-group, split tunnel and crypto map lines of the one show run
+    assert asa.get_acl_names('access-group outside in interface outside\n split-tunnel-network-list value SPLIT\n'
+                             'crypto map CMAP 10 match address VPN\naccess-group outside global') == ['SPLIT', 'VPN', 'outside']
+
+# REPLAY: Ensures the captured ACLs are replayed in the captured device order
+def test_capture_replay(tmp_path):
+    cache.capture(str(tmp_path), 'ckp', '10.10.20.1', [{'name': 'pol', 'rulebase': []}], [{'name': 'pol', 'rulebase': []}])
+    cache.capture(str(tmp_path), 'asa', '10.10.10.1', ['4931fac3 f081f39e 00006128 5e6047e5'], 'show access-list output')
+    cache.capture_order(str(tmp_path), [['ckp', '10.10.20.1'], ['asa', '10.10.10.1']])
+    assert list(cache.replay(str(tmp_path))) == [('ckp', '10.10.20.1', [{'name': 'pol', 'rulebase': []}], [{'name': 'pol', 'rulebase': []}]),
+                                                  ('asa', '10.10.10.1', ['4931fac3 f081f39e 00006128 5e6047e5'], 'show access-list output')]
+
+# STATS: Ensures the commands, bytes and rows of each device are counted, totalled per FW type and saved in the run report
+def test_stats(tmp_path, monkeypatch):
+    class Sid:
+        def send_command(self, cmd):
+            return 'output'
+    for attr, value in dict(enabled=False, profile_stage=None, run={}, devices={}, profiles=[]).items():
+        monkeypatch.setattr(stats, attr, value)
+    stats.start()
+    try:
+        sid = Sid()
+        with stats.stage('gather_acls'):
+            with stats.stage('get_acls', 'asa', '1.1.1.1', sid):
+                asa.send_command(sid, 'show run access-group')
+                asa.send_command(sid, 'show access-list')
+            acl = stats.rows('asa', '1.1.1.1', {'1.1.1.1_acl': [['row1'], ['row2']], '1.1.1.1_exp_acl': [['row1']]})
+        assert [list(rows) for rows in acl.values()] == [[['row1'], ['row2']], [['row1']]]
+        stats.save(os.path.join(tmp_path, 'report'))
+    finally:
+        stats.stop()
+    with open(os.path.join(tmp_path, 'report_stats.json')) as file_content:
+        run = json.load(file_content)
+    assert list(run['stages']) == ['gather_acls']
+    assert run['fw_types']['asa']['devices'] == 1
+    assert {key: run['devices']['1.1.1.1'][key] for key in ['commands', 'bytes_received', 'rows']} == dict(commands=2, bytes_received=12, rows=3)
+    assert list(run['devices']['1.1.1.1']['stages']) == ['get_acls', 'format_acl']
+
+# FORMAT_WORKERS: Ensures the ACLs formatted by the format processes are the same and in the same device order as formatting them in the threads
+def test_format_workers():
+    class Sid(AsaChannel):
+        def __init__(self, name):
+            self.name = name
+        def output(self, cmd):
+            if cmd == asa.SHOW_ACL_NAMES:
+                return 'access-group {} in interface outside'.format(self.name)
+            elif cmd.endswith('brief'):
+                return '4d69e4a3 00000000 00000009 5e56e683'
+            elif cmd == 'show access-list | ex elements|cached|alert-interval|remark':
+                return 'access-list {} line 1 extended permit tcp any any eq ssh (hitcnt=9) 0x4d69e4a3'.format(self.name)
+            return ''
+    main.rc = Console()
+    fw_sid = {'asa': {'10.10.10.1': Sid('outside'), '10.10.10.2': Sid('inside'), '10.10.10.3': Sid('mgmt')}}
+    args = dict(workers=3, asa_workers=None, no_cache=True, hits_only=False, capture=None)
+    acl = {sheet: list(rows) for sheet, rows in main.gather_acls(dict(args, format_workers=0), {'asa': asa}, fw_sid).items()}
+    assert main.gather_acls(dict(args, format_workers=2), {'asa': asa}, fw_sid) == acl
+    assert list(acl) == ['10.10.10.1_acl', '10.10.10.1_exp_acl', '10.10.10.2_acl', '10.10.10.2_exp_acl', '10.10.10.3_acl', '10.10.10.3_exp_acl']
+
+# GATHER_WORKERS: Ensures the per FW type limit is used when there is no overall limit (--workers) and is capped by it when there is
+def test_gather_workers():
+    class Sid(AsaChannel):
+        active, max_active, lock = 0, 0, Lock()
+        def output(self, cmd):
+            if cmd != asa.SHOW_ACL:
+                return ''
+            with Sid.lock:
+                Sid.active += 1
+                Sid.max_active = max(Sid.max_active, Sid.active)
+            time.sleep(0.1)
+            with Sid.lock:
+                Sid.active -= 1
+            return 'access-list mgmt line 1 extended permit tcp any any eq ssh (hitcnt=9) 0x4d69e4a3'
+    main.rc = Console()
+    fw_sid = {'asa': {'10.10.10.{}'.format(num): Sid() for num in range(4)}}
+    args = dict(asa_workers=3, no_cache=True, hits_only=False, capture=None, format_workers=0)
+    for workers, max_active in [(None, 3), (2, 2)]:
+        Sid.max_active = 0
+        assert len(main.gather_acls(dict(args, workers=workers), {'asa': asa}, fw_sid)) == 8
+        assert Sid.max_active == max_active
+
+# CAPTURE_FAILED: Ensures there is no error saving the capture order when no device was captured (all failed so the directory was never made)
+def test_capture_none(tmp_path):
+    class Sid(AsaChannel):
+        def output(self, cmd):
+            raise OSError('Socket is closed')
+    main.rc = Console()
+    capture_dir = os.path.join(tmp_path, 'capture')
+    args = dict(workers=None, asa_workers=None, no_cache=True, hits_only=False, capture=capture_dir, format_workers=0)
+    assert main.gather_acls(args, {'asa': asa}, {'asa': {'10.10.10.1': Sid()}}) == {}
+    assert not os.path.exists(capture_dir)
+
+# CKP_API: Ensures login, the pages of every policy (in order) and logout work against the stub manager with the requests and asyncio clients
+def test_ckp_stub_api(monkeypatch):
+    policies = {'pol1': [dict(uid='r{}'.format(num)) for num in range(30)], 'pol2': [dict(uid='r{}'.format(num)) for num in range(30, 55)]}
+    server = StubServer(policies)
+    monkeypatch.setattr(ckp, 'api_url', 'http://{}/web_api/')
+    for async_api in [False, True]:
+        monkeypatch.setattr(ckp, 'async_api', async_api)
+        assert ckp.login(server.fw, 'admin', 'wrong')[0] == False
+        sid = ckp.login(server.fw, 'admin', 'admin')
+        assert sid[0] == True and isinstance(sid[1], ckp.AsyncApiClient) == async_api
+        acl_brief, acl_expanded = ckp.get_acls(server.fw, sid[1])
+        assert [rule['uid'] for page in acl_brief for rule in page['rulebase']] == ['r{}'.format(num) for num in range(55)]
+        assert [rule['uid'] for page in acl_expanded for rule in page['rulebase']] == ['r{}'.format(num) for num in range(55)]
+        assert len(acl_expanded) == 4
+        ckp.logoff(server.fw, sid[1])
+        assert server.calls[-1][0] == 'logout'
+    server.stop()
+
+# CKP_ASYNC: Ensures managers share the event loop and each is limited to page_workers API calls at once and rate_limit API calls per second
+def test_ckp_async_limits(monkeypatch):
+    for attr, value in dict(api_url='http://{}/web_api/', async_api=True, page_workers=2, rate_limit=40, rate_burst=4).items():
+        monkeypatch.setattr(ckp, attr, value)
+    servers = [StubServer({'pol': [dict(uid='r{}'.format(num)) for num in range(200)]}, delay=0.02) for each_server in range(2)]
+    sids = [ckp.login(server.fw, 'admin', 'admin')[1] for server in servers]
+    with ThreadPoolExecutor() as executor:
+        all_acls = list(executor.map(ckp.get_acls, [server.fw for server in servers], sids))
+    assert [len(acl_expanded) for acl_brief, acl_expanded in all_acls] == [10, 10]
+    for server in servers:
+        assert server.max_active == 2
+        elapsed = server.calls[-1][2] - server.calls[0][2]
+        assert elapsed >= (len(server.calls) - ckp.rate_burst - 1) / ckp.rate_limit
+        server.stop()
+    for sid in sids:
+        sid.close()
+
+# ACE_RECORD: Ensures ACE records have integer line numbers and hit counts, share repeated strings and are the same once pickled
+def test_ace_record():
+    ace = Ace('outside', '2', 'permit', 'tcp', 'any', 'any_port', '10.1.1.1/32', '443', '7', '', '', '')
+    assert ace == ['outside', 2, 'permit', 'tcp', 'any', 'any_port', '10.1.1.1/32', '443', 7, '', '', '']
+    assert (ace[1], ace.hitcnt, len(ace)) == (2, 7, 12)
+    assert Ace(*['out' + 'side'] + list(ace)[1:]).name is ace.name
+    assert pickle.loads(pickle.dumps(ace)) == ace
+    assert main.col_types(ace) == list(ace)